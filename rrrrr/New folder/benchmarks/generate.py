@@ -0,0 +1,78 @@
+"""
+Synthetic training / ideal / test data at configurable sizes
+"""
+import argparse
+import os
+import numpy as np
+import pandas as pd
+
+# Function families resembling data/ideal.csv: trigonometric, polynomial, log/sqrt
+FAMILIES = [
+    lambda x, a, b: a * np.sin(b * x),
+    lambda x, a, b: a * np.cos(b * x),
+    lambda x, a, b: a * x + b,
+    lambda x, a, b: a * x ** 2 + b,
+    lambda x, a, b: a * x ** 3 / 400 + b * x,
+    lambda x, a, b: a * np.sqrt(np.abs(x)) + b,
+    lambda x, a, b: a * np.log(1 + np.abs(x)) + b,
+    lambda x, a, b: a * np.sin(x) + b * x,
+]
+
+
+def generate(rows=400, ideal_cols=50, test_points=100, train_cols=4, seed=0):
+    """Return (train, ideal, test) DataFrames with lowercase headers like the data/ CSVs.
+
+    Training columns are randomly chosen ideal functions plus uniform noise of at
+    most 0.5; about half of the test points lie near a training function and the
+    rest are scattered.
+    """
+    rng = np.random.default_rng(seed)
+    x = np.round(np.linspace(-20, 20, rows, endpoint=False), 6)
+
+    columns = {'x': x}
+    for i in range(1, ideal_cols + 1):
+        family = FAMILIES[rng.integers(len(FAMILIES))]
+        # Round-trip through float32 to keep the ~8 significant digits of the real CSVs
+        columns[f'y{i}'] = family(x, rng.uniform(-3, 3), rng.uniform(-2, 2)).astype(np.float32)
+    ideal = pd.DataFrame(columns)
+
+    chosen = rng.choice(np.arange(1, ideal_cols + 1), size=train_cols, replace=ideal_cols < train_cols)
+    train = pd.DataFrame({'x': x, **{
+        f'y{i}': ideal[f'y{col}'] + rng.uniform(-0.5, 0.5, rows) for i, col in enumerate(chosen, 1)
+    }})
+
+    pick = rng.integers(rows, size=test_points)
+    source = ideal[[f'y{c}' for c in chosen]].to_numpy()[pick, rng.integers(train_cols, size=test_points)]
+    near = rng.random(test_points) < 0.5
+    y = np.where(near, source + rng.uniform(-0.6, 0.6, test_points),
+                 source + rng.normal(0, 20, test_points))
+    test = pd.DataFrame({'x': x[pick], 'y': y})
+    return train, ideal, test
+
+
+def write(out_dir, **sizes):
+    """Generate a data set and write train.csv, ideal.csv and test.csv into out_dir"""
+    os.makedirs(out_dir, exist_ok=True)
+    train, ideal, test = generate(**sizes)
+    paths = {}
+    for name, df in (('train', train), ('ideal', ideal), ('test', test)):
+        paths[name] = os.path.join(out_dir, f'{name}.csv')
+        df.to_csv(paths[name], index=False)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic benchmark data")
+    parser.add_argument('out_dir')
+    parser.add_argument('--rows', type=int, default=400)
+    parser.add_argument('--ideal-cols', type=int, default=50)
+    parser.add_argument('--test-points', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    paths = write(args.out_dir, rows=args.rows, ideal_cols=args.ideal_cols,
+                  test_points=args.test_points, seed=args.seed)
+    print(f"Wrote {', '.join(paths.values())}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+"""
+Time each pipeline stage on synthetic data and compare against a stored baseline
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from generate import write
+from database import DatabaseManager
+from fitting import FunctionFitter
+from visualizer import Visualizer
+
+SIZES = {
+    'small': {'rows': 400, 'ideal_cols': 50, 'test_points': 100},
+    'medium': {'rows': 4_000, 'ideal_cols': 500, 'test_points': 100_000},
+    'large': {'rows': 20_000, 'ideal_cols': 2_000, 'test_points': 1_000_000},
+}
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+
+def measure(func, repeat=1):
+    """Run func repeat times; return (fastest seconds, peak traced memory in MB).
+
+    Timing runs without tracemalloc, whose hooks slow allocation-heavy code; one
+    extra traced run records the memory peak.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return min(times), peak / 2 ** 20
+
+
+def run(sizes, workdir, plot=True, repeat=1, max_points=None, compact=False, in_memory=False):
+    """Generate data in workdir, run every stage there and return the per-stage metrics.
+
+    With in_memory the stages hand tables over in memory; the queued SQLite
+    writes are not flushed, so the timings exclude persistence.
+    """
+    paths = write(os.path.join(workdir, 'data'), **sizes)
+    db = DatabaseManager(f"sqlite:///{os.path.join(workdir, 'bench.db')}", compact=compact,
+                         in_memory=in_memory)
+    fitter = FunctionFitter(db)
+
+    stages = [
+        ('load_training', lambda: db.load_training(paths['train']), sizes['rows']),
+        ('load_ideal', lambda: db.load_ideal(paths['ideal']), sizes['rows']),
+        ('select_best_ideals', lambda: fitter.select_best_ideals(use_cache=False, verifiable=False),
+         sizes['ideal_cols']),
+        ('map_test_data', lambda: fitter.map_test_data(paths['test']), sizes['test_points']),
+    ]
+    if plot:
+        stages.append(('plot_all', lambda: Visualizer(db.engine, db.frames).plot_all(max_points), sizes['test_points']))
+
+    results = {}
+    cwd = os.getcwd()
+    os.chdir(workdir)  # plot_all writes visualization.html into the working directory
+    try:
+        for name, func, items in stages:
+            seconds, peak_mb = measure(func, repeat)
+            results[name] = {
+                'seconds': round(seconds, 4),
+                'peak_mb': round(peak_mb, 2),
+                'items_per_second': round(items / seconds, 1) if seconds else None,
+            }
+            print(f"{name:<20} {seconds:9.3f}s  peak {peak_mb:9.1f} MB")
+    finally:
+        os.chdir(cwd)
+    return results
+
+
+def compare(results, baseline, tolerance, min_seconds=0.05):
+    """Return the stages whose time grew by more than tolerance over the baseline"""
+    regressions = []
+    for name, current in results.items():
+        before = baseline.get(name)
+        if not before:
+            continue
+        limit = before['seconds'] * (1 + tolerance)
+        if current['seconds'] > limit and current['seconds'] - before['seconds'] > min_seconds:
+            regressions.append((name, before['seconds'], current['seconds']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ideal-function pipeline")
+    parser.add_argument('--size', choices=SIZES, default='small')
+    parser.add_argument('--rows', type=int, help="override the number of X rows")
+    parser.add_argument('--ideal-cols', type=int, help="override the number of ideal functions")
+    parser.add_argument('--test-points', type=int, help="override the number of test points")
+    parser.add_argument('--no-plot', action='store_true', help="skip the Bokeh stage")
+    parser.add_argument('--compact', action='store_true', help="float32 ideal catalog")
+    parser.add_argument('--in-memory', action='store_true',
+                        help="pass tables between stages in memory, without the SQLite sink")
+    parser.add_argument('--max-points', type=int, help="point budget for the plot stage")
+    parser.add_argument('--repeat', type=int, default=3, help="timed runs per stage (fastest wins)")
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save-baseline', action='store_true',
+                        help="store this run as the baseline for its size")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="allowed slowdown before a stage is flagged (0.25 = 25%%)")
+    args = parser.parse_args()
+
+    sizes = dict(SIZES[args.size])
+    for key in sizes:
+        if getattr(args, key) is not None:
+            sizes[key] = getattr(args, key)
+    label = '-'.join(f"{key}={value}" for key, value in sizes.items())
+
+    print(f"=== Benchmark {label} ===")
+    with tempfile.TemporaryDirectory() as workdir:
+        results = run(sizes, workdir, plot=not args.no_plot, repeat=args.repeat,
+                      max_points=args.max_points, compact=args.compact,
+                      in_memory=args.in_memory)
+
+    report = {'sizes': sizes, 'repeat': args.repeat, 'python': sys.version.split()[0], 'stages': results}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+
+    if args.save_baseline:
+        baselines[label] = results
+        with open(args.baseline, 'w') as f:
+            json.dump(baselines, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if label not in baselines:
+        print("No baseline for this size; run with --save-baseline to create one")
+        return 0
+    regressions = compare(results, baselines[label], args.tolerance)
+    for name, before, after in regressions:
+        print(f"REGRESSION {name}: {before:.3f}s -> {after:.3f}s")
+    if not regressions:
+        print("No regressions against the baseline")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
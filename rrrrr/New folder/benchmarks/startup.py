@@ -0,0 +1,65 @@
+"""
+Measure the wall time of short CLI invocations, where import cost dominates
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from generate import write
+
+CLI = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src', 'cli.py'))
+SRC = os.path.dirname(CLI)
+
+# name -> argv after the interpreter; the first two are reference points
+COMMANDS = {
+    'python (no imports)': ['-c', 'pass'],
+    'import main (eager)': ['-c', 'import main'],
+    'cli --help': [CLI, '--help'],
+    'cli report': [CLI, 'report'],
+    'cli map --point': [CLI, 'map', '--point', '0', '0'],
+    'cli fit (cached)': [CLI, 'fit'],
+    'cli plot': [CLI, 'plot', '--max-points', '1000'],
+}
+
+
+def run(argv, cwd):
+    start = time.perf_counter()
+    subprocess.run([sys.executable] + argv, cwd=cwd, check=True, stdout=subprocess.DEVNULL,
+                   stderr=subprocess.DEVNULL, env={**os.environ, 'PYTHONPATH': SRC})
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark CLI startup time")
+    parser.add_argument('--repeat', type=int, default=5, help="runs per command (median wins)")
+    parser.add_argument('--output', default=None, help="also write the timings to this JSON file")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        paths = write(os.path.join(workdir, 'data'))
+        run([CLI, 'load', '--train', paths['train'], '--ideal', paths['ideal']], workdir)
+        run([CLI, 'map', paths['test']], workdir)
+
+        print(f"{'command':<24}{'median':>10}{'min':>10}")
+        for name, argv in COMMANDS.items():
+            times = [run(argv, workdir) for _ in range(args.repeat)]
+            results[name] = {'median': round(statistics.median(times), 4), 'min': round(min(times), 4)}
+            print(f"{name:<24}{results[name]['median'] * 1000:>8.0f}ms{results[name]['min'] * 1000:>8.0f}ms")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'repeat': args.repeat, 'python': sys.version.split()[0], 'commands': results},
+                      f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
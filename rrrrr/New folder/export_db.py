@@ -1,60 +1,233 @@
 """
-Export Database Tables to Excel/CSV
+Export Database Tables to CSV / compressed CSV / Parquet
+
+Every table is streamed from one SQLite cursor in chunks, so tables larger
+than memory export fine. The mapped-points subset and the summary are derived
+from the same pass over test_results.
 """
-import pandas as pd
+import argparse
+import os
 import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+
+FORMATS = {'csv': '.csv', 'csv.gz': '.csv.gz', 'parquet': '.parquet'}
+
+
+def _arrow_type(pa, declared):
+    """Arrow type for a SQLite declared column type, following SQLite's affinity rules.
+
+    None for a column declared without a type, which may hold any values; its
+    type is taken from the data.
+    """
+    declared = declared.upper()
+    if not declared:
+        return None
+    if 'INT' in declared:
+        return pa.int64()
+    if any(name in declared for name in ('CHAR', 'CLOB', 'TEXT')):
+        return pa.string()
+    if 'BLOB' in declared:
+        return pa.binary()
+    return pa.float64()
+
+
+class ChunkWriter:
+    """Appends DataFrame chunks to one CSV, gzip CSV or Parquet file.
+
+    columns are the (name, declared SQLite type) pairs of the source table. The
+    Parquet schema is built from them, so a first chunk whose columns are all
+    NULL cannot fix a null type that later chunks fail to match; without them
+    the schema comes from the first chunk. Columns declared without a type
+    take the first chunk's type, float64 when that chunk holds only NULLs.
+    """
+
+    def __init__(self, path, fmt, columns=()):
+        self.path = path
+        self.fmt = fmt
+        self.columns = list(columns)
+        self.rows = 0
+        self._header = True
+        self._parquet = None
+        if fmt == 'parquet':
+            # Optional dependency, only needed for the columnar format
+            import pyarrow
+            import pyarrow.parquet
+            self._pa = pyarrow
+            self._pq = pyarrow.parquet
+            self._types = [(name, _arrow_type(pyarrow, declared)) for name, declared in self.columns]
+            self._schema = None
+        elif os.path.exists(path):
+            os.remove(path)
+
+    def _infer_schema(self, df):
+        """Complete the declared types with the ones the first chunk implies"""
+        inferred = self._pa.Table.from_pandas(df, preserve_index=False).schema
+        fields = []
+        for name, arrow_type in self._types:
+            if arrow_type is None:
+                arrow_type = inferred.field(name).type if name in inferred.names else self._pa.null()
+                if self._pa.types.is_null(arrow_type):
+                    arrow_type = self._pa.float64()
+            fields.append((name, arrow_type))
+        return self._pa.schema(fields)
+
+    def write(self, df):
+        if self.fmt == 'parquet':
+            if self._schema is None and self._types:
+                self._schema = self._infer_schema(df)
+            batch = self._pa.Table.from_pandas(df, schema=self._schema, preserve_index=False)
+            if self._parquet is None:
+                self._parquet = self._pq.ParquetWriter(self.path, batch.schema, compression='zstd')
+            self._parquet.write_table(batch)
+        else:
+            df.to_csv(self.path, mode='a', header=self._header, index=False,
+                      compression='gzip' if self.fmt == 'csv.gz' else None)
+            self._header = False
+        self.rows += len(df)
+
+    def close(self):
+        """Finish the file; an empty table still gets its header row"""
+        if self._header and self._parquet is None:
+            self.write(pd.DataFrame(columns=[name for name, _ in self.columns]))
+        if self._parquet is not None:
+            self._parquet.close()
+
+
+def _chunks(db_file, table, chunksize):
+    conn = sqlite3.connect(db_file)
+    try:
+        for chunk in pd.read_sql(f'SELECT * FROM "{table}"', conn, chunksize=chunksize):
+            # An empty table comes back as one frame without columns
+            if len(chunk):
+                yield chunk
+    finally:
+        conn.close()
+
+
+def _table_columns(db_file, table):
+    """(name, declared type) of every column of a table"""
+    conn = sqlite3.connect(db_file)
+    try:
+        return [(row[1], row[2]) for row in conn.execute(f'PRAGMA table_info("{table}")')]
+    finally:
+        conn.close()
+
+
+def export_table(db_file, table, path, fmt='csv', chunksize=100_000):
+    """Stream one table into path; returns the number of rows written"""
+    writer = ChunkWriter(path, fmt, _table_columns(db_file, table))
+    try:
+        for chunk in _chunks(db_file, table, chunksize):
+            writer.write(chunk)
+    finally:
+        writer.close()
+    return writer.rows
+
+
+def _stored_summary(db_file):
+    """Per-function aggregates from the mapping_summary table kept by DatabaseManager"""
+    conn = sqlite3.connect(db_file)
+    try:
+        return pd.read_sql("""
+            SELECT [Ideal func], Points as count, [Sum Delta] as sum,
+                   [Min Delta] as min, [Max Delta] as max
+            FROM mapping_summary
+            WHERE [Ideal func] IS NOT NULL AND Points > 0
+        """, conn, index_col='Ideal func')
+    finally:
+        conn.close()
+
+
+def export_results(db_file, paths, fmt='csv', chunksize=100_000, stored_summary=False):
+    """Stream test_results once, writing all rows, the mapped rows and the summary.
+
+    With stored_summary the summary comes from mapping_summary; otherwise (older
+    databases) it is aggregated during the same pass. Returns (total rows,
+    mapped rows, summary DataFrame).
+    """
+    columns = _table_columns(db_file, 'test_results')
+    everything = ChunkWriter(paths['test_results'], fmt, columns)
+    mapped = ChunkWriter(paths['mapped'], fmt, columns)
+    parts = []
+    try:
+        for chunk in _chunks(db_file, 'test_results', chunksize):
+            everything.write(chunk)
+            hits = chunk[chunk['No. of ideal func'].notna()]
+            mapped.write(hits)
+            if stored_summary:
+                continue
+            # Partial aggregates per chunk; combined below without revisiting rows
+            parts.append(hits.groupby('No. of ideal func')['Delta Y'].agg(['count', 'sum', 'min', 'max']))
+    finally:
+        everything.close()
+        mapped.close()
+
+    if stored_summary:
+        stats = _stored_summary(db_file)
+    else:
+        stats = pd.concat(parts) if parts else pd.DataFrame(columns=['count', 'sum', 'min', 'max'])
+        stats = stats.groupby(level=0).agg({'count': 'sum', 'sum': 'sum', 'min': 'min', 'max': 'max'})
+    summary = pd.DataFrame({
+        'Ideal_Function': stats.index,
+        'Mapped_Points': stats['count'].astype(int).to_numpy(),
+        'Avg_Deviation': (stats['sum'] / stats['count']).round(4).to_numpy(),
+        'Max_Deviation': stats['max'].round(4).to_numpy(),
+        'Min_Deviation': stats['min'].round(4).to_numpy(),
+    }).sort_values(['Mapped_Points', 'Ideal_Function'], ascending=[False, True], ignore_index=True)
+    writer = ChunkWriter(paths['summary'], fmt)
+    writer.write(summary)
+    writer.close()
+    return everything.rows, mapped.rows, summary
+
+
+def export_all(db_file='assignment.db', out_dir='.', fmt='csv', chunksize=100_000, workers=3):
+    """Export training, ideal and test_results (plus mapped points and summary) in parallel"""
+    ext = FORMATS[fmt]
+    path = lambda name: os.path.join(out_dir, f'export_{name}{ext}')
+    os.makedirs(out_dir, exist_ok=True)
+
+    conn = sqlite3.connect(db_file)
+    try:
+        existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    finally:
+        conn.close()
+
+    with ThreadPoolExecutor(workers) as pool:
+        jobs = {table: pool.submit(export_table, db_file, table, path(table), fmt, chunksize)
+                for table in ('training', 'ideal') if table in existing}
+        if 'test_results' in existing:
+            paths = {'test_results': path('test_results'), 'mapped': path('mapped_points'),
+                     'summary': path('summary')}
+            results = pool.submit(export_results, db_file, paths, fmt, chunksize,
+                                  'mapping_summary' in existing)
+        for table, job in jobs.items():
+            print(f"✓ Exported {table}: {path(table)} ({job.result()} rows)")
+        if 'test_results' in existing:
+            total, mapped, summary = results.result()
+            print(f"✓ Exported test results: {paths['test_results']} ({total} rows)")
+            print(f"✓ Exported mapped points: {paths['mapped']} ({mapped} rows)")
+            print(f"✓ Exported summary statistics: {paths['summary']} ({len(summary)} functions)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the assignment database tables")
+    parser.add_argument('--db', default='assignment.db')
+    parser.add_argument('--out-dir', default='.')
+    parser.add_argument('--format', choices=FORMATS, default='csv',
+                        help="csv, gzip-compressed csv, or parquet (needs pyarrow)")
+    parser.add_argument('--chunksize', type=int, default=100_000)
+    parser.add_argument('--workers', type=int, default=3, help="tables exported concurrently")
+    args = parser.parse_args()
+
+    print("Exporting database tables...")
+    try:
+        export_all(args.db, args.out_dir, args.format, args.chunksize, args.workers)
+    except ImportError:
+        print("\n⚠ Parquet export needs pyarrow (pip install pyarrow)")
+        return
+    print("\n✅ Export complete! You can now open these files in Excel or any spreadsheet app.")
+
 
-print("Exporting database tables...")
-
-conn = sqlite3.connect('assignment.db')
-
-# Export training data
-training = pd.read_sql("SELECT * FROM training", conn)
-training.to_csv('export_training.csv', index=False)
-print(f"✓ Exported training data: export_training.csv ({len(training)} rows)")
-
-# Export ideal functions
-ideal = pd.read_sql("SELECT * FROM ideal", conn)
-ideal.to_csv('export_ideal.csv', index=False)
-print(f"✓ Exported ideal functions: export_ideal.csv ({len(ideal)} rows)")
-
-# Export test results
-test = pd.read_sql("SELECT * FROM test_results", conn)
-test.to_csv('export_test_results.csv', index=False)
-print(f"✓ Exported test results: export_test_results.csv ({len(test)} rows)")
-
-# Export mapped points only
-mapped = pd.read_sql("SELECT * FROM test_results WHERE [No. of ideal func] IS NOT NULL", conn)
-mapped.to_csv('export_mapped_points.csv', index=False)
-print(f"✓ Exported mapped points: export_mapped_points.csv ({len(mapped)} rows)")
-
-# Export summary
-summary = pd.read_sql("""
-    SELECT 
-        [No. of ideal func] as Ideal_Function,
-        COUNT(*) as Mapped_Points,
-        ROUND(AVG([Delta Y]), 4) as Avg_Deviation,
-        ROUND(MAX([Delta Y]), 4) as Max_Deviation,
-        ROUND(MIN([Delta Y]), 4) as Min_Deviation
-    FROM test_results 
-    WHERE [No. of ideal func] IS NOT NULL 
-    GROUP BY [No. of ideal func]
-    ORDER BY Mapped_Points DESC
-""", conn)
-summary.to_csv('export_summary.csv', index=False)
-print(f"✓ Exported summary statistics: export_summary.csv")
-
-# Try to create Excel file if openpyxl is available
-try:
-    with pd.ExcelWriter('assignment_results.xlsx', engine='openpyxl') as writer:
-        training.to_excel(writer, sheet_name='Training', index=False)
-        ideal.to_excel(writer, sheet_name='Ideal Functions', index=False)
-        test.to_excel(writer, sheet_name='Test Results', index=False)
-        mapped.to_excel(writer, sheet_name='Mapped Points', index=False)
-        summary.to_excel(writer, sheet_name='Summary', index=False)
-    print(f"\n✓ Created Excel workbook: assignment_results.xlsx")
-except ImportError:
-    print("\n⚠ Excel export skipped (install openpyxl: pip install openpyxl)")
-
-conn.close()
-print("\n✅ Export complete! You can now open these files in Excel or any spreadsheet app.")
+if __name__ == '__main__':
+    main()
@@ -2,9 +2,14 @@
 Interactive Database Query Tool
 Run this script to query the assignment.db interactively
 """
+import os
+import sys
 import pandas as pd
 import sqlite3
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'))
+from summary import ensure_summary
+
 def query_db(query):
     """Execute a SQL query and display results"""
     conn = sqlite3.connect('assignment.db')
@@ -28,12 +33,19 @@ def show_menu():
     print("4. Show only mapped test points")
     print("5. Show only unmapped test points")
     print("6. Show mapping statistics")
-    print("7. Show best fit mappings (Y1→Y42, Y2→Y41, Y3→Y11, Y4→Y48)")
+    print("7. Show best fit mappings (training → ideal function)")
     print("8. Custom SQL query")
     print("0. Exit")
     print("="*70)
 
 def main():
+    # Databases mapped before mapping_summary existed get it built once
+    conn = sqlite3.connect('assignment.db')
+    try:
+        ensure_summary(conn)
+    finally:
+        conn.close()
+
     queries = {
         '1': "SELECT * FROM training",
         '2': "SELECT X, Y1, Y2, Y3, Y4, Y5, Y6, Y7, Y8, Y9, Y10 FROM ideal",
@@ -42,31 +54,20 @@ def main():
         '5': "SELECT * FROM test_results WHERE [No. of ideal func] IS NULL",
         '6': """
             SELECT 
-                [No. of ideal func], 
-                COUNT(*) as count,
-                ROUND(AVG([Delta Y]), 4) as avg_deviation,
-                ROUND(MAX([Delta Y]), 4) as max_deviation
-            FROM test_results 
-            WHERE [No. of ideal func] IS NOT NULL 
-            GROUP BY [No. of ideal func]
+                [Ideal func] as [No. of ideal func], 
+                Points as count,
+                ROUND([Sum Delta] / Points, 4) as avg_deviation,
+                ROUND([Max Delta], 4) as max_deviation
+            FROM mapping_summary 
+            WHERE [Ideal func] IS NOT NULL AND Points > 0 
             ORDER BY count DESC
         """,
         '7': """
             SELECT 
-                'Y1 → Y42' as mapping, COUNT(*) as points 
-            FROM test_results WHERE [No. of ideal func] = 'Y42'
-            UNION ALL
-            SELECT 
-                'Y2 → Y41' as mapping, COUNT(*) as points 
-            FROM test_results WHERE [No. of ideal func] = 'Y41'
-            UNION ALL
-            SELECT 
-                'Y3 → Y11' as mapping, COUNT(*) as points 
-            FROM test_results WHERE [No. of ideal func] = 'Y11'
-            UNION ALL
-            SELECT 
-                'Y4 → Y48' as mapping, COUNT(*) as points 
-            FROM test_results WHERE [No. of ideal func] = 'Y48'
+                [Train func] || ' → ' || [Ideal func] as mapping, Points as points 
+            FROM mapping_summary 
+            WHERE [Train func] IS NOT NULL 
+            ORDER BY [Train func]
         """
     }
     
@@ -0,0 +1,108 @@
+"""
+Batch mapping of many test CSVs: a process pool maps the files, the calling
+process is the single SQLite writer.
+"""
+import argparse
+import glob
+import itertools
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from database import DatabaseManager
+from fitting import DataLoadError, FunctionFitter
+
+# Fitter of a worker process, built once by _init_worker
+_fitter = None
+
+
+def _init_worker(db_url, layout, compact, best_fits):
+    global _fitter
+    _fitter = FunctionFitter(DatabaseManager(db_url, layout, compact))
+    _fitter.best_fits = best_fits
+
+
+def _map_one(fitter, test_file):
+    """Return (file, results, None), or (file, None, message) when the file is unusable"""
+    try:
+        return test_file, fitter.map_file(test_file), None
+    except (OSError, ValueError, KeyError) as e:
+        return test_file, None, f"{type(e).__name__}: {e}"
+
+
+def _map_in_worker(test_file):
+    return _map_one(_fitter, test_file)
+
+
+def mapped_files(fitter, test_files, workers=1):
+    """Yield (file, results, error) per test file, in completion order when workers > 1.
+
+    Workers open their own connection to the same database and receive the
+    fitter's best fits, so nothing is refitted; the wide-layout ideal array is
+    shared through its memory-mapped cache file, which is built here first so
+    the workers never race to create it. At most two files per worker are in
+    flight and each result is released once yielded, so memory is bounded by
+    the caller's batching however many files there are.
+    """
+    if workers > 1 and fitter.db.in_memory:
+        raise ValueError("Worker processes read the database; map in-memory data with workers=1")
+    if workers <= 1:
+        for test_file in test_files:
+            yield _map_one(fitter, test_file)
+        return
+    if fitter.db.ideal_layout == 'wide':
+        fitter.db.ideal_table()
+    db_url = fitter.db.engine.url.render_as_string(hide_password=False)
+    with ProcessPoolExecutor(workers, initializer=_init_worker,
+                             initargs=(db_url, fitter.db.ideal_layout, fitter.db.compact,
+                                       fitter.best_fits)) as pool:
+        files = iter(test_files)
+        running = {pool.submit(_map_in_worker, test_file)
+                   for test_file in itertools.islice(files, 2 * workers)}
+        while running:
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for test_file in itertools.islice(files, len(done)):
+                running.add(pool.submit(_map_in_worker, test_file))
+            while done:
+                yield done.pop().result()
+
+
+def expand(paths):
+    """Test CSV files named by paths; directories contribute their *.csv files"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, '*.csv'))))
+        else:
+            files.append(path)
+    return files
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Map many test CSVs into test_results")
+    parser.add_argument('paths', nargs='+', help="test CSV files or directories of them")
+    parser.add_argument('--db', default='sqlite:///assignment.db')
+    parser.add_argument('--layout', choices=['wide', 'long'], default='wide')
+    parser.add_argument('--compact', action='store_true', help="float32 ideal catalog")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help="processes mapping files concurrently")
+    parser.add_argument('--batch-rows', type=int, default=500_000,
+                        help="result rows committed per transaction")
+    parser.add_argument('--quiet', action='store_true', help="only print the totals")
+    args = parser.parse_args(argv)
+
+    fitter = FunctionFitter(DatabaseManager(args.db, args.layout, args.compact))
+    try:
+        fitter.load_model()
+    except DataLoadError:
+        print("No stored fit model; fitting first")
+        fitter.select_best_ideals()
+
+    counts = fitter.map_files(expand(args.paths), args.workers, args.batch_rows,
+                              progress=None if args.quiet else print)
+    print(f"Files mapped: {counts['files']}, failed: {len(counts['failed'])}")
+    print(f"Total test points: {counts['total']}")
+    print(f"Mapped points: {counts['mapped']}")
+    return 1 if counts['failed'] else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,166 @@
+import hashlib
+import json
+import os
+import tempfile
+import numpy as np
+
+
+class XIndex:
+    """Sorted lookup from an X value to the first ideal table row holding it."""
+
+    def __init__(self, x):
+        self.keys, self.rows = np.unique(np.asarray(x, dtype=float), return_index=True)
+
+    def lookup(self, x):
+        """Return the row offset of every X value, or -1 where it is not in the table."""
+        x = np.asarray(x, dtype=float)
+        if not len(self.keys):
+            return np.full(len(x), -1)
+        pos = np.minimum(np.searchsorted(self.keys, x), len(self.keys) - 1)
+        return np.where(self.keys[pos] == x, self.rows[pos], -1)
+
+
+class IdealTable:
+    """Column names plus one float array holding the whole ideal table.
+
+    The array is shared by every stage that needs ideal values; column blocks
+    are handed out as views whenever the requested columns are adjacent. A
+    compact (float32) table keeps X separately in float64 so X lookups stay exact.
+    """
+
+    def __init__(self, columns, values, x=None):
+        self.columns = list(columns)
+        self.values = values
+        self.x = x
+        self._positions = {col: i for i, col in enumerate(self.columns)}
+        self._index = None
+        self._digest = None
+
+    @classmethod
+    def from_frame(cls, df, dtype=np.float64):
+        values = np.ascontiguousarray(df.to_numpy(dtype=dtype))
+        if np.dtype(dtype) == np.float64 or 'X' not in df:
+            return cls(df.columns, values)
+        return cls(df.columns, values, df['X'].to_numpy(dtype=float))
+
+    def y_columns(self):
+        return [col for col in self.columns if col.startswith('Y')]
+
+    def column(self, name):
+        if name == 'X' and self.x is not None:
+            return self.x
+        return self.values[:, self._positions[name]]
+
+    def block(self, names):
+        """Return the values of the given columns, as a view when they are adjacent."""
+        pos = [self._positions[name] for name in names]
+        if pos and pos == list(range(pos[0], pos[0] + len(pos))):
+            return self.values[:, pos[0]:pos[0] + len(pos)]
+        return self.values[:, pos]
+
+    def gather(self, rows, names):
+        """Return the values at the given row offsets for the given columns only."""
+        pos = [self._positions[name] for name in names]
+        return self.values[np.asarray(rows)[:, None], pos]
+
+    def digest(self):
+        """SHA-256 of the column names and values, computed once per table."""
+        if self._digest is None:
+            h = hashlib.sha256(json.dumps(self.columns).encode())
+            if self.values.dtype != np.float64:
+                h.update(self.values.dtype.str.encode())
+            # Hash the array buffers in place; tobytes() would copy the whole table
+            h.update(np.ascontiguousarray(self.values))
+            if self.x is not None:
+                h.update(np.ascontiguousarray(self.x))
+            self._digest = h.hexdigest()
+        return self._digest
+
+    @property
+    def index(self):
+        """X index of the table, built on first use."""
+        if self._index is None:
+            self._index = XIndex(self.column('X'))
+        return self._index
+
+
+def cache_path(db_file, compact=False):
+    """Return the .npy cache path next to a SQLite file, or None for in-memory databases."""
+    if not db_file or db_file == ':memory:':
+        return None
+    return os.path.splitext(db_file)[0] + ('.ideal32.npy' if compact else '.ideal.npy')
+
+
+def _x_path(path):
+    return path[:-len('.npy')] + '.x.npy'
+
+
+def load(path, stamp=None):
+    """Memory-map a cached ideal table, or return None when there is no cache.
+
+    With a stamp, a cache published under a different stamp counts as missing.
+    """
+    if not path or not os.path.exists(path) or not os.path.exists(path + '.json'):
+        return None
+    with open(path + '.json') as f:
+        meta = json.load(f)
+    if stamp is not None and meta.get('stamp') != stamp:
+        return None
+    columns = meta['columns']
+    x = np.load(_x_path(path), mmap_mode='r') if os.path.exists(_x_path(path)) else None
+    return IdealTable(columns, np.load(path, mmap_mode='r'), x)
+
+
+def staging_path(path, suffix='.npy'):
+    """Create an empty temporary file next to path and return its name.
+
+    Every writer gets its own file, so processes building the same cache at
+    once never write into each other's staging data.
+    """
+    fd, name = tempfile.mkstemp(suffix=suffix, prefix=os.path.basename(path) + '.',
+                                dir=os.path.dirname(path) or '.')
+    os.close(fd)
+    return name
+
+
+def save(path, table, stamp=None):
+    """Write the table atomically so processes still mapping the old file are unaffected."""
+    try:
+        staged = staging_path(path)
+        np.save(staged, np.ascontiguousarray(table.values))
+    except OSError:
+        remove(path)
+        return False
+    return publish(path, table, staged, stamp)
+
+
+def publish(path, table, staged, stamp=None):
+    """Move the values already written to the staged file into place, with the
+    table's columns, separate X and the stamp of the source it was built from."""
+    meta = x_staged = None
+    try:
+        meta = staging_path(path, '.json')
+        with open(meta, 'w') as f:
+            json.dump({'columns': table.columns, 'stamp': stamp}, f)
+        if table.x is not None:
+            x_staged = staging_path(path)
+            np.save(x_staged, np.ascontiguousarray(table.x))
+            os.replace(x_staged, _x_path(path))
+        os.replace(staged, path)
+        os.replace(meta, path + '.json')
+    except OSError:
+        # A reader still holds the old file open (Windows); keep the in-process copy only
+        for name in (staged, meta, x_staged):
+            if name and os.path.exists(name):
+                os.remove(name)
+        remove(path)
+        return False
+    return True
+
+
+def remove(path):
+    for name in (path, path + '.json', _x_path(path)):
+        try:
+            os.remove(name)
+        except OSError:
+            pass
@@ -0,0 +1,203 @@
+"""
+Command line entry point with one subcommand per pipeline step:
+
+    python src/cli.py load | fit | map | plot | report
+
+Modules are imported inside the subcommands, so each one pays only for what it
+uses: report needs nothing beyond sqlite3, and only plot loads Bokeh.
+"""
+import argparse
+import os
+import sys
+import metrics
+
+SQLITE_PREFIX = 'sqlite:///'
+
+
+def positive_int(text):
+    """argparse type for counts that must be at least 1"""
+    value = int(text)
+    if value < 1:
+        raise argparse.ArgumentTypeError(f"must be >= 1, got {value}")
+    return value
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Ideal-function selection pipeline")
+    parser.add_argument('--db', default='sqlite:///assignment.db')
+    parser.add_argument('--layout', choices=['wide', 'long'], default='wide')
+    parser.add_argument('--compact', action='store_true', help="float32 ideal catalog")
+    parser.add_argument('--metrics', default=None,
+                        help="write per-stage timings to this .json or .csv file")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    load = commands.add_parser('load', help="load the training and ideal CSVs")
+    load.add_argument('--train', default='data/train.csv')
+    load.add_argument('--ideal', default='data/ideal.csv')
+    load.add_argument('--bulk', action='store_true',
+                      help="load the CSVs with the bulk executemany path")
+    load.add_argument('--parse-workers', type=int, default=1,
+                      help="threads used to parse each input CSV")
+
+    fit = commands.add_parser('fit', help="select and persist the best ideal functions")
+    fit.add_argument('--workers', type=int, default=1,
+                     help="processes used to fit ideal-function shards")
+    fit.add_argument('--method', choices=['matrix', 'prune'], default='matrix',
+                     help="best-fit search: full SSD matrix or early-abandoning search")
+    fit.add_argument('--top-k', type=positive_int, default=1,
+                     help="rank this many candidate ideal functions per training column")
+    fit.add_argument('--criterion', choices=['ssd', 'sad', 'max_dev'], default='ssd',
+                     help="metric that ranks the ideal functions")
+    fit.add_argument('--no-cache', action='store_true', help="ignore the fit cache")
+
+    map_ = commands.add_parser('map', help="map test CSVs or single points with the stored fits")
+    map_.add_argument('files', nargs='*', default=[], help="test CSVs (default: data/test.csv)")
+    map_.add_argument('--point', nargs=2, type=float, action='append', metavar=('X', 'Y'),
+                      help="map one point and print it instead of writing test_results")
+    map_.add_argument('--chunksize', type=int, default=None,
+                      help="stream a single test file in chunks of this many rows")
+    map_.add_argument('--workers', type=int, default=1,
+                      help="processes mapping several files concurrently")
+
+    plot = commands.add_parser('plot', help="write visualization.html")
+    plot.add_argument('--max-points', type=int, default=None,
+                      help="downsample each plot to this many points and render with WebGL")
+    plot.add_argument('--density', type=int, default=None, metavar='BINS',
+                      help="draw test points as a BINS x BINS density image instead of markers")
+
+    commands.add_parser('report', help="print the stored fits and mapping summary")
+    return parser.parse_args(argv)
+
+
+def _database(args):
+    from database import DatabaseManager
+    return DatabaseManager(args.db, args.layout, args.compact)
+
+
+def _fitter(args):
+    """FunctionFitter using the persisted model, fitting only when none is stored"""
+    from fitting import DataLoadError, FunctionFitter
+    fitter = FunctionFitter(_database(args))
+    try:
+        fitter.load_model()
+    except DataLoadError:
+        print("No stored fit model; fitting first")
+        fitter.select_best_ideals()
+    return fitter
+
+
+def cmd_load(args):
+    db = _database(args)
+    with metrics.stage('load_training'):
+        db.load_training(args.train, bulk=args.bulk, workers=args.parse_workers)
+    with metrics.stage('load_ideal'):
+        db.load_ideal(args.ideal, bulk=args.bulk, workers=args.parse_workers)
+    print(f"Loaded {args.train} and {args.ideal}")
+
+
+def cmd_fit(args):
+    from fitting import FunctionFitter
+    fitter = FunctionFitter(_database(args))
+    with metrics.stage('select_best_ideals'):
+        best = fitter.select_best_ideals(workers=args.workers, method=args.method, k=args.top_k,
+                                         use_cache=not args.no_cache, criterion=args.criterion)
+    for train_col, info in best.items():
+        print(f"{train_col} -> {info['col']} (SSD: {info['ssd']:.6f}, SAD: {info['sad']:.6f}, "
+              f"Max Dev: {info['max_dev']:.6f})")
+
+
+def cmd_map(args):
+    fitter = _fitter(args)
+    if args.point:
+        import pandas as pd
+        test_df = pd.DataFrame(args.point, columns=['X', 'Y'])
+        results = fitter.map_points(test_df, fitter._mapping_table(test_df))
+        for x, y, delta, name in results.itertuples(index=False):
+            print(f"({x}, {y}) -> {name} (Delta Y: {delta:.6f})" if isinstance(name, str)
+                  else f"({x}, {y}) -> unmapped")
+        return
+
+    files = args.files or ['data/test.csv']
+    with metrics.stage('map_test_data') as timing:
+        if len(files) > 1:
+            counts = fitter.map_files(files, workers=args.workers, progress=None)
+        elif args.chunksize:
+            counts = fitter.stream_test_data(files[0], chunksize=args.chunksize, progress=None)
+        else:
+            results = fitter.map_test_data(files[0])
+            counts = {'total': len(results), 'mapped': int(results['No. of ideal func'].notna().sum())}
+        timing['rows'] = counts['total']
+    for test_file, error in counts.get('failed', {}).items():
+        print(f"Skipped {test_file}: {error}")
+    print(f"Total test points: {counts['total']}")
+    print(f"Mapped points: {counts['mapped']}")
+    print(f"Unmapped points: {counts['total'] - counts['mapped']}")
+
+
+def cmd_plot(args):
+    from sqlalchemy import create_engine
+    from visualizer import Visualizer
+    with metrics.stage('plot_all'):
+        Visualizer(create_engine(args.db)).plot_all(args.max_points, args.density)
+
+
+def cmd_report(args):
+    """Print best_fits and mapping_summary through sqlite3 alone"""
+    import sqlite3
+    from summary import ensure_summary
+    if not args.db.startswith(SQLITE_PREFIX):
+        raise SystemExit(f"report needs a {SQLITE_PREFIX}<file> database, got {args.db}")
+    path = args.db[len(SQLITE_PREFIX):]
+    if not os.path.exists(path):
+        raise SystemExit(f"No database at {path}; run load first")
+    conn = sqlite3.connect(path)
+    try:
+        ensure_summary(conn)
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        fits = conn.execute('SELECT train_func, ideal_func, ssd, max_dev FROM best_fits '
+                            'ORDER BY position').fetchall() if 'best_fits' in tables else []
+        summary = conn.execute(
+            'SELECT "Ideal func", "Train func", Points, "Sum Delta", "Max Delta" '
+            'FROM mapping_summary ORDER BY Points DESC').fetchall() if 'mapping_summary' in tables else []
+    finally:
+        conn.close()
+
+    print("=== Best Fitting Ideal Functions ===")
+    if not fits:
+        print("No stored fit model; run fit first")
+    for train_col, ideal_col, ssd, max_dev in fits:
+        print(f"{train_col} -> {ideal_col} (SSD: {ssd:.6f}, Max Dev: {max_dev:.6f})")
+
+    print("\n=== Test Data Mapping ===")
+    if not summary:
+        print("No test results; run map first")
+        return
+    total = sum(row[2] for row in summary)
+    unmapped = sum(row[2] for row in summary if row[0] is None)
+    print(f"Total test points: {total}")
+    print(f"Mapped points: {total - unmapped}")
+    print(f"Unmapped points: {unmapped}")
+    for ideal_col, train_cols, points, total_delta, max_delta in summary:
+        if ideal_col is not None and points:
+            print(f"{ideal_col} ({train_cols or '-'}): {points} points, "
+                  f"avg Delta Y {total_delta / points:.4f}, max {max_delta:.4f}")
+
+
+COMMANDS = {'load': cmd_load, 'fit': cmd_fit, 'map': cmd_map, 'plot': cmd_plot, 'report': cmd_report}
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    timer = metrics.StageTimer()
+    metrics.activate(timer)
+    try:
+        COMMANDS[args.command](args)
+    finally:
+        metrics.activate(None)
+    if args.metrics:
+        timer.write(args.metrics)
+        print(f"Metrics saved to {args.metrics}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,8 +1,20 @@
-from sqlalchemy import create_engine, Column, Float, String, Integer
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine, inspect, Column, Float, String, Integer, Index
+from sqlalchemy.orm import declarative_base, sessionmaker
 import pandas as pd
+import numpy as np
+import functools
+import hashlib
+import itertools
+import json
+import os
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import List
+import cache
+import metrics
+from cache import IdealTable
+from numeric_csv import read_frame, read_numeric
+from summary import ensure_summary
 
 Base = declarative_base()
 
@@ -18,6 +30,62 @@ class IdealFunction(Base):
     __tablename__ = 'ideal'
     X = Column(Float, primary_key=True)
 
+class TableStamp(Base):
+    """Change counter of a table, bumped by triggers on every write to it, and the
+    content digest computed at that count; the ideal array cache records the
+    counter it was built at"""
+    __tablename__ = 'table_stamps'
+    name = Column(String(32), primary_key=True)
+    version = Column(Integer, nullable=False)
+    digest = Column(String(64))
+
+class SourceFile(Base):
+    """CSV file a table was last loaded from, and the table's counter after that load"""
+    __tablename__ = 'source_files'
+    table_name = Column(String(32), primary_key=True)
+    path = Column(String)
+    size = Column(Integer)
+    mtime_ns = Column(Integer)
+    version = Column(Integer)
+
+class IdealPoint(Base):
+    """One (function, X, Y) sample of the long-format ideal catalog"""
+    __tablename__ = 'ideal_long'
+    __table_args__ = (Index('ix_ideal_long_function_x', 'function_id', 'X'),)
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    function_id = Column(String(32))
+    X = Column(Float)
+    Y = Column(Float)
+
+class IdealCatalog(Base):
+    """Function names of the long-format ideal catalog, in CSV column order"""
+    __tablename__ = 'ideal_catalog'
+    position = Column(Integer, primary_key=True)
+    function_id = Column(String(32))
+
+class FitCacheEntry(Base):
+    """Fit result memoized under a hash of the inputs and fitting parameters"""
+    __tablename__ = 'fit_cache'
+    key = Column(String(64), primary_key=True)
+    result = Column(String)
+    created = Column(Float)
+    last_used = Column(Float)
+
+class BestFit(Base):
+    """Persisted fit model: the ideal function selected for one training column"""
+    __tablename__ = 'best_fits'
+    position = Column(Integer, primary_key=True)
+    train_func = Column(String(32))
+    ideal_func = Column(String(32))
+    ssd = Column(Float)
+    max_dev = Column(Float)
+    threshold = Column(Float)
+    input_hash = Column(String(64))
+    created = Column(Float)
+    sad = Column(Float)
+    criterion = Column(String(16))
+    fit_key = Column(String(64))
+
 class TestResult(Base):
     __tablename__ = 'test_results'
     id = Column(Integer, primary_key=True, autoincrement=True)
@@ -26,25 +94,686 @@ class TestResult(Base):
     delta_y = Column(Float)
     ideal_func = Column(String(10))
 
+# Writes counted by the stamp_<table>_<event> triggers
+STAMP_EVENTS = ('INSERT', 'UPDATE', 'DELETE')
+
+# Fit results kept in fit_cache before the least recently used are evicted
+FIT_CACHE_SIZE = 32
+
+# Functions per query when reading the long-format catalog (SQLite caps bound parameters)
+LONG_BATCH = 500
+
+# SQLite settings used only while a bulk load runs; restored afterwards
+BULK_PRAGMAS = {'journal_mode': 'MEMORY', 'synchronous': 'OFF', 'cache_size': '-262144'}
+
+
+def deferrable(write):
+    """Mark a SQLite write that in-memory mode queues for flush() instead of running"""
+    @functools.wraps(write)
+    def wrapper(self, *args, **kwargs):
+        if self.in_memory:
+            self._pending.append(functools.partial(write, self, *args, **kwargs))
+            return None
+        return write(self, *args, **kwargs)
+    return wrapper
+
+
 class DatabaseManager:
-    def __init__(self, db_path='sqlite:///assignment.db'):
+    def __init__(self, db_path='sqlite:///assignment.db', ideal_layout='wide', compact=False,
+                 in_memory=False):
+        if ideal_layout not in ('wide', 'long'):
+            raise ValueError(f"Unknown ideal layout: {ideal_layout}")
+        if compact and ideal_layout != 'wide':
+            raise ValueError("Compact mode applies to the wide ideal array cache only")
+        if in_memory and ideal_layout != 'wide':
+            raise ValueError("In-memory mode keeps the ideal catalog as one wide array")
+        self.ideal_layout = ideal_layout
+        # float32 ideal array (half the memory); reductions still run in float64
+        self.compact = compact
+        self.ideal_dtype = np.float32 if compact else np.float64
         self.engine = create_engine(db_path)
         self.Session = sessionmaker(bind=self.engine)
-        Base.metadata.create_all(self.engine)
+        self._prepare_schema()
+        self.ideal_cache_path = cache.cache_path(self.engine.url.database, compact)
+        self._ideal = None
+        # In-memory mode: loaded and computed tables stay in self.frames for the
+        # next stage, and the SQLite writes queue in self._pending until flush()
+        self.in_memory = in_memory
+        self.frames = {}
+        self._pending = []
+        self._model = None
+        self._sink = None
 
-    def load_training(self, file):
+    def _prepare_schema(self):
+        """Create missing tables and columns and backfill mapping_summary.
+
+        On SQLite a database that is already current costs one read of
+        sqlite_master and of the best_fits columns; nothing is written and no
+        write lock is taken, so read-only workers and CLI calls stay cheap.
+        """
+        if self.engine.dialect.name != 'sqlite':
+            Base.metadata.create_all(self.engine)
+            self._add_missing_columns(BestFit)
+            return
+        conn = self.engine.raw_connection()
+        try:
+            cursor = conn.cursor()
+            tables = {row[0] for row in cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            columns = {row[1] for row in cursor.execute('PRAGMA table_info(best_fits)')}
+            cursor.close()
+            if not (set(Base.metadata.tables) <= tables
+                    and {col.name for col in BestFit.__table__.columns} <= columns):
+                Base.metadata.create_all(self.engine)
+                self._add_missing_columns(BestFit)
+            # Results written before mapping_summary existed get their summary once
+            ensure_summary(conn)
+        finally:
+            conn.close()
+
+    def _add_missing_columns(self, model):
+        """Add model columns that a database file created by an older version lacks"""
+        table = model.__table__
+        present = {col['name'] for col in inspect(self.engine).get_columns(table.name)}
+        missing = [col for col in table.columns if col.name not in present]
+        if missing:
+            with self.engine.begin() as conn:
+                for col in missing:
+                    conn.exec_driver_sql(f'ALTER TABLE {table.name} ADD COLUMN {col.name} '
+                                         f'{col.type.compile(self.engine.dialect)}')
+
+    def load_training(self, file, bulk=False, workers=1):
         """Load training data from a single CSV file with multiple Y columns"""
-        df = pd.read_csv(file)
-        # Standardize column names to uppercase
-        df.columns = df.columns.str.upper()
-        df.to_sql('training', self.engine, if_exists='replace', index=False)
-
-    def load_ideal(self, file):
-        """Load ideal functions from CSV file"""
-        df = pd.read_csv(file)
-        # Standardize column names to uppercase
-        df.columns = df.columns.str.upper()
-        df.to_sql('ideal', self.engine, if_exists='replace', index=False)
+        with metrics.stage('parse_csv') as timing:
+            df = read_frame(file, workers)
+            timing['rows'] = len(df)
+        if self.in_memory:
+            self.frames['training'] = df
+        with metrics.stage('to_sql', rows=len(df)):
+            self._write_table('training', df, bulk)
+        if not self.in_memory:
+            self._record_source('training', file)
+        self.clear_fit_stats()
+        self.clear_model()
+
+    def load_ideal(self, file, bulk=False, workers=1):
+        """Load ideal functions from CSV file.
+
+        A wide float64 catalog on disk is parsed straight into the array cache
+        file, which then backs both the SQLite write and the in-process table.
+        """
+        staging = None
+        if self.ideal_layout == 'wide' and not self.compact and not self.in_memory and self.ideal_cache_path:
+            staging = cache.staging_path(self.ideal_cache_path)
+        try:
+            self._load_ideal(file, bulk, workers, staging)
+        finally:
+            # Publishing moves the staging file into place; any failure before that leaves it behind
+            if staging and os.path.exists(staging):
+                os.remove(staging)
+
+    def _load_ideal(self, file, bulk, workers, staging):
+        with metrics.stage('parse_csv') as timing:
+            columns, values = read_numeric(file, workers, mmap_path=staging)
+            timing['rows'] = len(values)
+        df = pd.DataFrame(values, columns=columns, copy=False)
+        self.clear_fit_stats()
+        self.clear_model()
+        with metrics.stage('to_sql', rows=len(df)):
+            if self.ideal_layout == 'long':
+                self._write_long(df)
+                self._record_source('ideal_long', file)
+                return
+            self._write_table('ideal', df, bulk)
+        with metrics.stage('array_cache', rows=len(df)):
+            self.invalidate_ideal_cache()
+            if staging:
+                values.flush()
+                self._store_ideal(IdealTable(columns, values), staged=staging,
+                                  stamp=self._record_source('ideal', file))
+                return
+            table = (IdealTable.from_frame(df, self.ideal_dtype) if self.compact
+                     else IdealTable(columns, values))
+            if self.in_memory:
+                self.frames['ideal'] = df
+                self._ideal = table
+                self._save_ideal_cache(table)
+            else:
+                self._store_ideal(table, stamp=self._record_source('ideal', file))
+
+    def frame(self, table):
+        """Return a table as a DataFrame, without touching SQLite when in-memory mode holds it"""
+        if table in self.frames:
+            return self.frames[table]
+        return pd.read_sql(table, self.engine)
+
+    def ideal_columns(self, names):
+        """Return the named ideal columns at full precision as a float64 array"""
+        if 'ideal' in self.frames:
+            return self.frames['ideal'][names].to_numpy(dtype=float)
+        quoted = ', '.join(f'"{name}"' for name in names)
+        return pd.read_sql(f'SELECT {quoted} FROM ideal', self.engine).to_numpy(dtype=float)
+
+    def flush(self, background=False):
+        """Replay the SQLite writes queued by in-memory mode, in order.
+
+        Returns the number of writes run. With background=True the writes run on
+        a single sink thread and a Future of that number is returned at once;
+        successive flushes stay ordered, and the thread is joined at interpreter
+        exit. A sqlite:///:memory: database is always written synchronously,
+        because each thread would get its own empty database.
+        """
+        pending, self._pending = self._pending, []
+
+        def run():
+            for write in pending:
+                write()
+            return len(pending)
+
+        if self.engine.url.database in (None, '', ':memory:'):
+            future = Future()
+            future.set_result(run())
+        else:
+            if self._sink is None:
+                self._sink = ThreadPoolExecutor(1, thread_name_prefix='sqlite-sink')
+            future = self._sink.submit(run)
+        return future if background else future.result()
+
+    def ideal_table(self):
+        """Return the ideal table as one shared float array, cached next to the database.
+
+        The cache file is used only while its stamp matches the ideal table's
+        change counter, so writes that bypass load_ideal trigger a rebuild.
+        """
+        if self._ideal is None:
+            stamp = self.table_stamp('ideal') if self.ideal_cache_path else None
+            table = cache.load(self.ideal_cache_path, stamp) if stamp is not None else None
+            if table is None and self.ideal_cache_path and stamp is None:
+                stamp = self.stamp_table('ideal')
+            if table is None:
+                table = self._store_ideal(IdealTable.from_frame(pd.read_sql('ideal', self.engine),
+                                                                self.ideal_dtype), stamp=stamp)
+            self._ideal = table
+        return self._ideal
+
+    def table_stamp(self, table):
+        """Return a table's change counter, or None when its triggers are missing
+        (never stamped, or dropped with the table when another writer recreated it)"""
+        with self.engine.connect() as conn:
+            triggers = conn.exec_driver_sql(
+                "SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND tbl_name = ? "
+                "AND name LIKE ?", (table, f'stamp_{table}_%')).scalar()
+            if triggers < len(STAMP_EVENTS):
+                return None
+            return conn.exec_driver_sql('SELECT version FROM table_stamps WHERE name = ?',
+                                        (table,)).scalar()
+
+    def stamp_table(self, table):
+        """Install the triggers counting writes to table if they are missing, bump its
+        counter (forgetting the stored digest) and return it"""
+        with self.engine.begin() as conn:
+            conn.exec_driver_sql('INSERT OR IGNORE INTO table_stamps (name, version) VALUES (?, 0)',
+                                 (table,))
+            for event in STAMP_EVENTS:
+                conn.exec_driver_sql(
+                    f'CREATE TRIGGER IF NOT EXISTS stamp_{table}_{event.lower()} AFTER {event} ON "{table}" '
+                    f"BEGIN UPDATE table_stamps SET version = version + 1, digest = NULL "
+                    f"WHERE name = '{table}'; END")
+            conn.exec_driver_sql('UPDATE table_stamps SET version = version + 1, digest = NULL '
+                                 'WHERE name = ?', (table,))
+            return conn.exec_driver_sql('SELECT version FROM table_stamps WHERE name = ?',
+                                        (table,)).scalar()
+
+    def table_digest(self, table, compute):
+        """Return compute(), a content hash of table, memoized in table_stamps until
+        the next write to the table"""
+        version = self.table_stamp(table)
+        if version is None:
+            version = self.stamp_table(table)
+        else:
+            with self.engine.connect() as conn:
+                digest = conn.exec_driver_sql(
+                    'SELECT digest FROM table_stamps WHERE name = ? AND version = ?',
+                    (table, version)).scalar()
+            if digest:
+                return digest
+        digest = compute()
+        with self.engine.begin() as conn:
+            # Not stored if a write moved the counter while the digest was computed
+            conn.exec_driver_sql('UPDATE table_stamps SET digest = ? WHERE name = ? AND version = ?',
+                                 (digest, table, version))
+        return digest
+
+    def _record_source(self, table, file):
+        """Stamp a freshly loaded table and remember the CSV it came from; returns the stamp"""
+        stat = os.stat(file)
+        version = self.stamp_table(table)
+        with self.engine.begin() as conn:
+            conn.execute(SourceFile.__table__.delete().where(SourceFile.table_name == table))
+            conn.execute(SourceFile.__table__.insert(), {
+                'table_name': table, 'path': os.path.abspath(file), 'size': stat.st_size,
+                'mtime_ns': stat.st_mtime_ns, 'version': version})
+        return version
+
+    def source_unchanged(self, table, file):
+        """True when table was last loaded from file, the file is unchanged since (same
+        size and mtime) and nothing else has written to the table; always False in
+        in-memory mode, whose stages need the loaded frames"""
+        if self.in_memory or not os.path.exists(file):
+            return False
+        with self.engine.connect() as conn:
+            row = conn.exec_driver_sql(
+                'SELECT path, size, mtime_ns, version FROM source_files WHERE table_name = ?',
+                (table,)).fetchone()
+        if row is None:
+            return False
+        stat = os.stat(file)
+        return (tuple(row[:3]) == (os.path.abspath(file), stat.st_size, stat.st_mtime_ns)
+                and row[3] == self.table_stamp(table))
+
+    def refresh_ideal(self):
+        """Forget the in-process ideal array so the next access reloads it from disk"""
+        self._ideal = None
+
+    def ideal_version(self):
+        """Return a cheap marker that changes whenever load_ideal replaces the catalog.
+
+        Wide layout: the ideal table's change counter plus the size and mtime of
+        the array cache file. Long layout: the catalog plus the row count and id
+        range of ideal_long.
+        """
+        if self.ideal_layout == 'wide':
+            if self.ideal_cache_path and os.path.exists(self.ideal_cache_path):
+                stat = os.stat(self.ideal_cache_path)
+                return (self.table_stamp('ideal'), stat.st_mtime_ns, stat.st_size)
+            return None
+        with self.engine.connect() as conn:
+            counts = conn.exec_driver_sql('SELECT COUNT(*), MIN(id), MAX(id) FROM ideal_long').fetchone()
+        return (tuple(self.ideal_functions()), tuple(counts))
+
+    def ideal_x_values(self, functions):
+        """Return the distinct X values stored for the given long-format functions"""
+        with self.engine.connect() as conn:
+            rows = conn.exec_driver_sql(
+                'SELECT DISTINCT X FROM ideal_long '
+                f'WHERE function_id IN ({", ".join("?" * len(functions))}) ORDER BY X',
+                tuple(functions)).fetchall()
+        return np.array([row[0] for row in rows], dtype=float)
+
+    def invalidate_ideal_cache(self):
+        """Drop the cached ideal arrays (full and compact); call this after writing the
+        ideal table directly"""
+        self._ideal = None
+        self._remove_ideal_caches()
+
+    @deferrable
+    def _remove_ideal_caches(self):
+        for compact in (False, True):
+            path = cache.cache_path(self.engine.url.database, compact)
+            if path:
+                cache.remove(path)
+
+    @deferrable
+    def _save_ideal_cache(self, table):
+        if self.ideal_cache_path:
+            cache.save(self.ideal_cache_path, table, self.stamp_table('ideal'))
+
+    def _store_ideal(self, table, staged=None, stamp=None):
+        """Publish table as the array cache and adopt the memory-mapped copy.
+
+        staged names the staging file already holding the values, if any; stamp
+        is the ideal table's change counter the values were read at.
+        """
+        if staged:
+            published = cache.publish(self.ideal_cache_path, table, staged, stamp)
+        else:
+            published = self.ideal_cache_path and cache.save(self.ideal_cache_path, table, stamp)
+        if published:
+            table = cache.load(self.ideal_cache_path, stamp)
+        self._ideal = table
+        return table
+
+    def _write_long(self, df):
+        """Store the ideal functions as indexed (function_id, X, Y) rows"""
+        functions = [col for col in df.columns if col != 'X']
+        points = df.melt(id_vars='X', value_vars=functions, var_name='function_id', value_name='Y')
+        catalog = pd.DataFrame({'position': range(len(functions)), 'function_id': functions})
+        with self.engine.begin() as conn:
+            # Row triggers would slow the reload; the table is restamped afterwards
+            for event in STAMP_EVENTS:
+                conn.exec_driver_sql(f'DROP TRIGGER IF EXISTS stamp_ideal_long_{event.lower()}')
+            conn.execute(IdealPoint.__table__.delete())
+            conn.execute(IdealCatalog.__table__.delete())
+            catalog.to_sql('ideal_catalog', conn, if_exists='append', index=False)
+            points[['function_id', 'X', 'Y']].to_sql('ideal_long', conn, if_exists='append',
+                                                   index=False, chunksize=50_000)
+
+    def ideal_functions(self):
+        """Return the function names of the long-format catalog"""
+        with self.engine.connect() as conn:
+            rows = conn.exec_driver_sql(
+                'SELECT function_id FROM ideal_catalog ORDER BY position').fetchall()
+        return [row[0] for row in rows]
+
+    def fetch_ideal(self, functions, xs):
+        """Return the given long-format functions evaluated at the given X values.
+
+        Row i of the returned IdealTable belongs to xs[i]; values missing from the
+        catalog are NaN. Only the requested (function, X) pairs are read, through
+        the composite index.
+        """
+        xs = np.asarray(xs, dtype=float)
+        keys, inverse = np.unique(xs, return_inverse=True)
+        grid = np.full((len(keys), len(functions)), np.nan)
+        positions = {name: i for i, name in enumerate(functions)}
+
+        with self.engine.connect() as conn:
+            conn.exec_driver_sql('CREATE TEMP TABLE IF NOT EXISTS wanted_x (X REAL PRIMARY KEY)')
+            conn.exec_driver_sql('DELETE FROM wanted_x')
+            if len(keys):
+                conn.exec_driver_sql('INSERT INTO wanted_x VALUES (?)', [(x,) for x in keys.tolist()])
+            for start in range(0, len(functions), LONG_BATCH):
+                batch = tuple(functions[start:start + LONG_BATCH])
+                # Newest rows first so the first row wins when an X value is duplicated
+                rows = conn.exec_driver_sql(
+                    'SELECT p.function_id, p.X, p.Y FROM ideal_long p '
+                    'JOIN wanted_x w ON w.X = p.X '
+                    f'WHERE p.function_id IN ({", ".join("?" * len(batch))}) '
+                    'ORDER BY p.id DESC', batch).fetchall()
+                if rows:
+                    names, x, y = zip(*rows)
+                    cols = [positions[name] for name in names]
+                    grid[np.searchsorted(keys, x), cols] = np.array(y, dtype=float)
+            conn.exec_driver_sql('DELETE FROM wanted_x')
+
+        values = np.column_stack([xs, grid[inverse]])
+        return IdealTable(['X'] + list(functions), values)
+
+    @deferrable
+    def _write_table(self, table, df, bulk):
+        if bulk:
+            self.bulk_insert(table, df)
+        else:
+            df.to_sql(table, self.engine, if_exists='replace', index=False)
+
+    def bulk_insert(self, table, df, chunksize=50_000, report=print):
+        """Replace a table with the frame's rows using chunked executemany in one transaction.
+
+        The SQLite pragmas in BULK_PRAGMAS are applied for the duration of the load
+        and the previous values restored afterwards. Returns the rows per second.
+        """
+        start = time.perf_counter()
+        types = ['REAL' if df[col].dtype.kind in 'fiub' else 'TEXT' for col in df.columns]
+        columns = ', '.join(f'"{col}" {kind}' for col, kind in zip(df.columns, types))
+        insert = f'INSERT INTO "{table}" VALUES ({", ".join("?" * len(df.columns))})'
+
+        conn = self.engine.raw_connection()
+        try:
+            cur = conn.cursor()
+            previous = {name: cur.execute(f'PRAGMA {name}').fetchone()[0] for name in BULK_PRAGMAS}
+            for name, value in BULK_PRAGMAS.items():
+                cur.execute(f'PRAGMA {name}={value}')
+            try:
+                cur.execute('BEGIN')
+                cur.execute(f'DROP TABLE IF EXISTS "{table}"')
+                cur.execute(f'CREATE TABLE "{table}" ({columns})')
+                for offset in range(0, len(df), chunksize):
+                    chunk = df.iloc[offset:offset + chunksize]
+                    rows = chunk.astype(object).where(chunk.notna(), None).itertuples(index=False, name=None)
+                    cur.executemany(insert, rows)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                for name, value in previous.items():
+                    cur.execute(f'PRAGMA {name}={value}')
+        finally:
+            conn.close()
+
+        elapsed = time.perf_counter() - start
+        rate = len(df) / elapsed if elapsed else float('inf')
+        if report:
+            report(f"Loaded {len(df)} rows into {table} in {elapsed:.2f}s ({rate:,.0f} rows/s)")
+        return rate
+
+    def training_digest(self):
+        """Return a content hash of the training table, memoized while it is unchanged"""
+        def compute():
+            df = self.frame('training')
+            h = hashlib.sha256(json.dumps(list(df.columns)).encode())
+            h.update(np.ascontiguousarray(df.to_numpy(dtype=float)).tobytes())
+            return h.hexdigest()
+        return compute() if self.in_memory else self.table_digest('training', compute)
+
+    def ideal_digest(self):
+        """Return a content hash of the ideal catalog in the active layout.
+
+        The hash is memoized in table_stamps while the table is unchanged, so a
+        repeated fit of the same data does not reread the catalog. In-memory
+        mode hashes the loaded array, and compact mode its float32 values.
+        """
+        if self.ideal_layout == 'long':
+            return self.table_digest('ideal_long', self._long_digest)
+        if self.in_memory or self.compact:
+            return self.ideal_table().digest()
+        return self.table_digest('ideal', lambda: self.ideal_table().digest())
+
+    def _long_digest(self):
+        """The catalog and the row count of every function, then the (X, Y) pairs in
+        storage order hashed as float64 buffers, so no per-row Python objects are
+        formatted"""
+        with self.engine.connect() as conn:
+            counts = conn.exec_driver_sql(
+                'SELECT function_id, COUNT(*) FROM ideal_long GROUP BY function_id ORDER BY MIN(id)').fetchall()
+        h = hashlib.sha256(json.dumps([self.ideal_functions(), [list(row) for row in counts]]).encode())
+        conn = self.engine.raw_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('SELECT X, Y FROM ideal_long ORDER BY id')
+            while rows := cursor.fetchmany(100_000):
+                values = np.fromiter(itertools.chain.from_iterable(rows), np.float64, 2 * len(rows))
+                h.update(values.tobytes())
+            cursor.close()
+        finally:
+            conn.close()
+        return h.hexdigest()
+
+    def cached_fit(self, key):
+        """Return the fit result stored under key (marking it recently used), or None.
+
+        In-memory mode does not look the cache up, but still fills it on flush().
+        """
+        if self.in_memory:
+            return None
+        with self.engine.begin() as conn:
+            row = conn.exec_driver_sql('SELECT result FROM fit_cache WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            conn.exec_driver_sql('UPDATE fit_cache SET last_used = ? WHERE key = ?', (time.time(), key))
+        return json.loads(row[0])
+
+    @deferrable
+    def store_fit(self, key, result, max_entries=FIT_CACHE_SIZE):
+        """Store a fit result and evict the least recently used beyond max_entries"""
+        now = time.time()
+        with self.engine.begin() as conn:
+            conn.exec_driver_sql('INSERT OR REPLACE INTO fit_cache VALUES (?, ?, ?, ?)',
+                                 (key, json.dumps(result), now, now))
+            conn.exec_driver_sql('DELETE FROM fit_cache WHERE key NOT IN '
+                                 '(SELECT key FROM fit_cache ORDER BY last_used DESC LIMIT ?)',
+                                 (max_entries,))
+
+    @deferrable
+    def append_training(self, df, fit_stats=None, replace_stats=False):
+        """Append new rows to the training table.
+
+        fit_stats, a (training columns, ideal columns, {column: matrix}) triple,
+        is stored in the same transaction, so the rows and the statistics that
+        include them are written together or not at all. With replace_stats the
+        fit_stats table is recreated first; otherwise its rows are overwritten.
+        """
+        with self.engine.begin() as conn:
+            df.to_sql('training', conn, if_exists='append', index=False)
+            if fit_stats is not None:
+                self._write_fit_stats(conn, *fit_stats, replace=replace_stats)
+
+    def _write_fit_stats(self, conn, train_cols, ideal_cols, matrices, replace):
+        """One fit_stats row per training column, each metric a float64 vector over ideal_cols"""
+        if replace:
+            conn.exec_driver_sql('DROP TABLE IF EXISTS fit_stats')
+        stats = ', '.join(f'"{column}" BLOB' for column in matrices)
+        conn.exec_driver_sql(f'CREATE TABLE IF NOT EXISTS fit_stats (position INTEGER PRIMARY KEY, '
+                             f'"Train func" TEXT, "Ideal funcs" TEXT, {stats})')
+        placeholders = ', '.join('?' * (len(matrices) + 3))
+        conn.exec_driver_sql(f'INSERT OR REPLACE INTO fit_stats VALUES ({placeholders})', [
+            (i, col, json.dumps(ideal_cols),
+             *(np.ascontiguousarray(matrix[i], dtype=float).tobytes() for matrix in matrices.values()))
+            for i, col in enumerate(train_cols)
+        ])
+
+    def load_fit_stats(self):
+        """Return the stored residual statistics as (training columns, ideal columns,
+        {column: matrix}), or None when there are none or they predate this layout"""
+        with self.engine.connect() as conn:
+            columns = [row[1] for row in conn.exec_driver_sql('PRAGMA table_info(fit_stats)')]
+            if 'Ideal funcs' not in columns:
+                return None
+            rows = conn.exec_driver_sql('SELECT * FROM fit_stats ORDER BY position').fetchall()
+        if not rows:
+            return None
+        return ([row[1] for row in rows], json.loads(rows[0][2]),
+                {column: np.array([np.frombuffer(row[i], dtype=float) for row in rows])
+                 for i, column in enumerate(columns[3:], 3)})
+
+    @deferrable
+    def clear_fit_stats(self):
+        """Drop the residual statistics; they describe tables that are being replaced"""
+        with self.engine.begin() as conn:
+            conn.exec_driver_sql('DROP TABLE IF EXISTS fit_stats')
+
+    @deferrable
+    def save_rankings(self, rankings):
+        """Store the top-k candidates per training column in fit_rankings"""
+        rows = [{'Train func': train_col, 'Rank': entry['rank'], 'Ideal func': entry['col'],
+                 'SSD': entry['ssd'], 'SAD': entry['sad'], 'Max Dev': entry['max_dev']}
+                for train_col, ranked in rankings.items() for entry in ranked]
+        columns = ['Train func', 'Rank', 'Ideal func', 'SSD', 'SAD', 'Max Dev']
+        pd.DataFrame(rows, columns=columns).to_sql('fit_rankings', self.engine,
+                                                   if_exists='replace', index=False)
+
+    def save_model(self, fits, input_hash=None, fit_key=None):
+        """Replace the persisted fit model with fits (dicts in training column order).
+
+        fit_key is the fit_cache key the fits were selected under, if any.
+        """
+        if self.in_memory:
+            self._model = (fits, input_hash)
+        self._write_model(fits, input_hash, fit_key)
+
+    @deferrable
+    def _write_model(self, fits, input_hash, fit_key=None):
+        now = time.time()
+        with self.engine.begin() as conn:
+            conn.execute(BestFit.__table__.delete())
+            if fits:
+                conn.execute(BestFit.__table__.insert(), [
+                    {**fit, 'position': position, 'input_hash': input_hash, 'fit_key': fit_key,
+                     'created': now}
+                    for position, fit in enumerate(fits)
+                ])
+
+    def clear_model(self):
+        """Drop the persisted fit model; it was fitted to tables that are being replaced"""
+        self._model = None
+        self._write_model([], None)
+
+    def load_model(self):
+        """Return (fits, input hash) of the persisted fit model, or None when none is stored"""
+        if self._model is not None:
+            return self._model
+        with self.engine.connect() as conn:
+            rows = conn.exec_driver_sql(
+                'SELECT train_func, ideal_func, ssd, sad, max_dev, threshold, criterion, input_hash '
+                'FROM best_fits ORDER BY position').fetchall()
+        if not rows:
+            return None
+        keys = ['train_func', 'ideal_func', 'ssd', 'sad', 'max_dev', 'threshold', 'criterion']
+        return [dict(zip(keys, row[:7])) for row in rows], rows[0][7]
+
+    def model_key(self):
+        """Return the fit_cache key of the persisted model, or None when it has none"""
+        if self.in_memory:
+            return None
+        with self.engine.connect() as conn:
+            row = conn.exec_driver_sql('SELECT fit_key FROM best_fits ORDER BY position LIMIT 1').fetchone()
+        return row[0] if row else None
+
+    def model_version(self):
+        """Return (input hash, created) of the persisted fit model; changes on every save"""
+        with self.engine.connect() as conn:
+            return tuple(conn.exec_driver_sql(
+                'SELECT input_hash, created FROM best_fits ORDER BY position LIMIT 1').fetchone() or ())
 
     def save_results(self, results_df):
-        results_df.to_sql('test_results', self.engine, if_exists='replace', index=False)
+        self.append_results(results_df, replace=True)
+
+    def append_results(self, results_df, replace=False):
+        """Write one chunk of test results in its own transaction"""
+        if self.in_memory:
+            held = None if replace else self.frames.get('test_results')
+            self.frames['test_results'] = results_df if held is None else pd.concat(
+                [held, results_df], ignore_index=True)
+        self._write_results(results_df, replace)
+
+    @deferrable
+    def _write_results(self, results_df, replace):
+        with self.engine.begin() as conn:
+            results_df.to_sql('test_results', conn, if_exists='replace' if replace else 'append',
+                              index=False)
+            self._update_summary(conn, results_df, replace)
+
+    def _update_summary(self, conn, results_df, replace):
+        """Fold a batch of results into mapping_summary inside the writing transaction.
+
+        One row per ideal function that is a persisted best fit (best_fits) or
+        received points, with the training columns it was selected for, its point
+        count and the sum, min and max of Delta Y; the row with a NULL ideal
+        function counts the unmapped points. Report tools read this table instead of scanning results.
+        """
+        stats = {}
+        if not replace and inspect(conn).has_table('mapping_summary'):
+            for name, *values in conn.exec_driver_sql(
+                    'SELECT "Ideal func", Points, "Sum Delta", "Min Delta", "Max Delta" '
+                    'FROM mapping_summary'):
+                stats[name] = values
+
+        groups = results_df.groupby('No. of ideal func', dropna=False)['Delta Y']
+        for name, (points, total, low, high) in groups.agg(['size', 'sum', 'min', 'max']).iterrows():
+            name = None if pd.isna(name) else name
+            before = stats.get(name)
+            if name is None:
+                total = low = high = None
+            elif before and before[0]:
+                total += before[1]
+                low, high = min(low, before[2]), max(high, before[3])
+            stats[name] = [int(points) + (before[0] if before else 0), total, low, high]
+
+        train_funcs = {}
+        for train_col, ideal_col in conn.exec_driver_sql(
+                'SELECT train_func, ideal_func FROM best_fits ORDER BY position'):
+            train_funcs.setdefault(ideal_col, []).append(train_col)
+            stats.setdefault(ideal_col, [0, None, None, None])
+        stats.setdefault(None, [0, None, None, None])
+
+        rows = [{'Ideal func': name, 'Train func': ', '.join(train_funcs[name]) if name in train_funcs else None,
+                 'Points': values[0], 'Sum Delta': values[1], 'Min Delta': values[2], 'Max Delta': values[3]}
+                for name, values in stats.items()]
+        summary = pd.DataFrame(rows, columns=['Ideal func', 'Train func', 'Points',
+                                              'Sum Delta', 'Min Delta', 'Max Delta'])
+        summary.to_sql('mapping_summary', conn, if_exists='replace', index=False)
+
+    def mapping_summary(self):
+        """Return mapping_summary with the average deviation per ideal function"""
+        summary = pd.read_sql('mapping_summary', self.engine)
+        summary['Avg Delta'] = summary['Sum Delta'] / summary['Points'].where(summary['Points'] > 0)
+        return summary
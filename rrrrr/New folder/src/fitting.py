@@ -2,72 +2,648 @@ import pandas as pd
 import numpy as np
 from database import DatabaseManager
 import math
+import heapq
+import hashlib
+import metrics
+from numeric_csv import iter_frames, read_frame
 
 class DataLoadError(Exception): pass
 
+# Upper bound on the number of float64 cells held by one broadcast block
+# (rows x train columns x ideal columns) while computing max deviations.
+BLOCK_CELLS = 4_000_000
+
+# A test point maps to a fitted function within this factor of its max training deviation
+THRESHOLD_FACTOR = math.sqrt(2)
+
+# Metrics of a (training, ideal) column pair, all computed in the one fused pass of
+# deviation_matrices(). name -> (reduction over axis 0 of |deviations| with NaN rows
+# zeroed, how the values of two sets of rows combine). Every entry can rank fits.
+METRICS = {
+    'ssd': (lambda dev: (dev * dev).sum(axis=0), np.add),
+    'sad': (lambda dev: dev.sum(axis=0), np.add),
+    'max_dev': (lambda dev: dev.max(axis=0, initial=0.0), np.maximum),
+}
+
+# fit_stats and fit_rankings column of each metric
+STAT_COLUMNS = {'ssd': 'SSD', 'sad': 'SAD', 'max_dev': 'Max Dev'}
+
+
+def _aligned(train, ideal):
+    """Trim both arrays to their common row count, as pandas index alignment does."""
+    n = min(len(train), len(ideal))
+    return np.asarray(train[:n], dtype=float), np.asarray(ideal[:n], dtype=float)
+
+
+def deviation_matrices(train, ideal, expand=True):
+    """Compute a (train columns x ideal columns) matrix for every metric in METRICS.
+
+    Rows are paired by position and rows where either value is NaN are skipped,
+    matching the pandas Series arithmetic the selection has always used. Each
+    block of absolute deviations is built once and reduced by every metric. The
+    SSD matrix uses the ||a||^2 + ||b||^2 - 2a'b expansion, so the heavy lifting
+    is a single matrix multiply; expand=False sums the squared residuals
+    directly instead, trading speed for freedom from cancellation error.
+    Returns {metric name: matrix}.
+    """
+    a, b = _aligned(train, ideal)
+    a_ok, b_ok = ~np.isnan(a), ~np.isnan(b)
+    a0, b0 = np.where(a_ok, a, 0.0), np.where(b_ok, b, 0.0)
+
+    if not expand:
+        ssd = np.zeros((a0.shape[1], b0.shape[1]))
+    elif a_ok.all() and b_ok.all():
+        ssd = (a0 * a0).sum(axis=0)[:, None] + (b0 * b0).sum(axis=0)[None, :]
+    else:
+        ssd = (a0 * a0).T @ b_ok.astype(float) + a_ok.T.astype(float) @ (b0 * b0)
+    if expand:
+        ssd -= 2.0 * (a0.T @ b0)
+        np.maximum(ssd, 0.0, out=ssd)
+
+    matrices = {'ssd': ssd} if expand else {}
+    rows, n_train = a0.shape
+    reductions = {name: reduce for name, (reduce, _) in METRICS.items() if name not in matrices}
+    matrices.update((name, np.zeros((n_train, b0.shape[1]))) for name in reductions)
+    block = max(1, BLOCK_CELLS // max(1, rows * n_train))
+    for start in range(0, b0.shape[1], block):
+        stop = start + block
+        dev = np.abs(a0[:, :, None] - b0[:, None, start:stop])
+        dev *= a_ok[:, :, None] & b_ok[:, None, start:stop]
+        for name, reduce in reductions.items():
+            matrices[name][:, start:stop] = reduce(dev)
+    return matrices
+
+
+def pair_metrics(a, b, length):
+    """Every metric of two aligned 1-D columns, reduced exactly as pandas sums a Series.
+
+    pandas sums over the union of both indexes with the unmatched rows zeroed, so
+    the deviations are padded to that length to reproduce its rounding bit for bit.
+    """
+    dev = np.zeros(length)
+    dev[:len(a)] = np.abs(a - b)
+    dev[np.isnan(dev)] = 0.0
+    return {name: float(reduce(dev)) for name, (reduce, _) in METRICS.items()}
+
+
+def _require_columns(count):
+    """Every search needs at least one candidate ideal function."""
+    if count == 0:
+        raise DataLoadError("ideal table has no Y columns")
+
+
+def pick_best(train, ideal, scores, k=1, criterion='ssd'):
+    """Return, per training column, the k best [(column index, exact score, metrics)],
+    best first, ranked by the criterion's score matrix.
+
+    The k-th smallest value of each row is found with a partial sort. The matrices
+    of deviation_matrices() carry rounding error, so every candidate within that
+    error of it is re-evaluated exactly with pair_metrics(); ties keep the earlier column.
+    """
+    _require_columns(scores.shape[1])
+    length = max(len(train), len(ideal))
+    a, b = _aligned(train, ideal)
+    if criterion == 'ssd':
+        ideal_sq = np.nansum(b ** 2, axis=0)
+    k = min(k, scores.shape[1])
+    picks = []
+    for i, row in enumerate(scores):
+        kth = np.partition(row, k - 1)[k - 1]
+        if criterion == 'ssd':
+            tol = 1e-9 * (np.nansum(a[:, i] ** 2) + ideal_sq + 1.0)
+        else:
+            tol = 1e-9 * (abs(kth) + 1.0)
+        candidates = np.flatnonzero(row <= kth + tol)
+        exact = [pair_metrics(a[:, i], b[:, j], length) for j in candidates]
+        score = np.array([metrics[criterion] for metrics in exact])
+        order = np.lexsort((candidates, score))[:k]
+        picks.append([(int(candidates[o]), exact[o][criterion], exact[o]) for o in order])
+    return picks
+
+
+def best_in_block(train, ideal, offset=0, k=1, criterion='ssd'):
+    """Return, per training column, the k best [(column index, score, metrics)] for one
+    block of ideal columns; column indexes are shifted by the block's offset."""
+    scores = deviation_matrices(train, ideal)[criterion]
+    return [[(offset + j, score, metrics) for j, score, metrics in ranked]
+            for ranked in pick_best(train, ideal, scores, k, criterion)]
+
+
+def merge_best(parts, k=1):
+    """Reduce per-block rankings to the overall k best per training column.
+
+    Ties are ordered by column index, so they keep the earliest column.
+    """
+    merged = []
+    for ranked in zip(*parts):
+        candidates = [candidate for block in ranked for candidate in block]
+        merged.append(sorted(candidates, key=lambda c: (c[1], c[0]))[:k])
+    return merged
+
+
+def _column_moments(values):
+    """Per-column mean and centred norm, the inputs of the SSD lower bound."""
+    mean = values.mean(axis=0)
+    return mean, np.linalg.norm(values - mean, axis=0)
+
+
+def _ssd_lower_bounds(n, moments_a, moments_b):
+    """Cheap lower bounds on SSD(a, b) from column means and centred norms.
+
+    SSD = n * (mean_a - mean_b)^2 + ||(a - mean_a) - (b - mean_b)||^2, and the second
+    term is at least (||a - mean_a|| - ||b - mean_b||)^2 by the triangle inequality.
+    """
+    (mean_a, spread_a), (mean_b, spread_b) = moments_a, moments_b
+    return n * (mean_a - mean_b) ** 2 + (spread_a - spread_b) ** 2
+
+
+def best_pruned(train, ideal, offset=0, k=1, criterion='ssd', block_rows=256):
+    """Same result as best_in_block(), found by an early-abandoning search.
+
+    Candidates are visited in order of their SSD lower bound and the k best so far
+    are kept in a bounded heap. The search stops once a bound exceeds the k-th best
+    SSD, and a candidate is abandoned as soon as its running sum of squares does.
+    The bounds hold for SSD only, so no other criterion can be searched this way.
+    """
+    if criterion != 'ssd':
+        raise ValueError("The prune search ranks by SSD only; use method='matrix'")
+    length = max(len(train), len(ideal))
+    a, b = _aligned(train, ideal)
+    has_nan = np.isnan(a).any() or np.isnan(b).any()
+    if not has_nan:
+        train_mean, train_spread = _column_moments(a)
+        ideal_moments = _column_moments(b)
+    # Slack so rounding in the bounds and partial sums never drops a tied candidate
+    slack = 1e-9
+
+    results = []
+    for i in range(a.shape[1]):
+        col = a[:, i]
+        if has_nan:
+            bounds = np.zeros(b.shape[1])
+        else:
+            bounds = _ssd_lower_bounds(len(col), (train_mean[i], train_spread[i]), ideal_moments)
+        # Max-heap of the k best (ssd, column) pairs, stored negated
+        heap = []
+        kept = {}
+
+        for j in np.argsort(bounds, kind='stable'):
+            worst = -heap[0][0] if len(heap) == k else np.inf
+            limit = worst * (1 + slack) + slack
+            if bounds[j] > limit:
+                break
+            running = 0.0
+            for start in range(0, len(col), block_rows):
+                sq = (col[start:start + block_rows] - b[start:start + block_rows, j]) ** 2
+                running += np.nansum(sq)
+                if running > limit:
+                    break
+            else:
+                metrics = pair_metrics(col, b[:, j], length)
+                entry = (-metrics['ssd'], -int(j))
+                if len(heap) < k:
+                    heapq.heappush(heap, entry)
+                elif entry > heap[0]:
+                    heapq.heapreplace(heap, entry)
+                else:
+                    continue
+                kept[int(j)] = metrics
+
+        results.append([(offset - neg_j, -neg_ssd, kept[-neg_j])
+                        for neg_ssd, neg_j in sorted(heap, reverse=True)])
+    return results
+
+
+# Search strategies selectable through select_best_ideals(method=...)
+SEARCHES = {'matrix': best_in_block, 'prune': best_pruned}
+
+
+def search_columns(train, ideal, offset=0, method='matrix', k=1, criterion='ssd'):
+    """Run the chosen search over ideal columns in the caller's process.
+
+    A compact (float32) catalog is upcast to float64 one column block at a time,
+    so every reduction accumulates in float64 while the float64 copy stays
+    within BLOCK_CELLS.
+    """
+    search = SEARCHES[method]
+    if ideal.dtype == np.float64 or ideal.shape[1] == 0:
+        return search(train, ideal, offset, k, criterion)
+    step = max(1, BLOCK_CELLS // max(1, len(ideal)))
+    return merge_best([search(train, ideal[:, start:start + step].astype(np.float64), offset + start,
+                              k, criterion)
+                       for start in range(0, ideal.shape[1], step)], k)
+
+
+def fit_block(train, ideal, offset=0, workers=1, method='matrix', k=1, criterion='ssd', pool=None):
+    """Run the chosen search on one block, sharded over a process pool when workers > 1.
+
+    pool, a parallel.FitPool built for train, is used instead of starting one.
+    """
+    if method not in SEARCHES:
+        raise ValueError(f"Unknown search method: {method}")
+    if criterion not in METRICS:
+        raise ValueError(f"Unknown selection criterion: {criterion}")
+    _require_columns(ideal.shape[1])
+    if pool is not None:
+        return pool.best(ideal, offset, method, k, criterion)
+    if workers > 1:
+        from parallel import best_parallel
+        return best_parallel(train, ideal, workers, offset, method, k, criterion)
+    return search_columns(train, ideal, offset, method, k, criterion)
+
+
 class FunctionFitter:
     def __init__(self, db: DatabaseManager):
         self.db = db
         self.best_fits = {}
+        self.rankings = {}
+        # Metric the current best fits were ranked by
+        self.criterion = 'ssd'
+
+    def select_best_ideals(self, workers=1, method='matrix', k=1, use_cache=True, criterion='ssd',
+                           verifiable=True):
+        """Pick the ideal function with the lowest criterion score for every training column.
+
+        criterion names a metric in METRICS (default: SSD). All metrics of the k
+        best candidates per training column are kept in self.rankings and stored
+        in the fit_rankings table. Results are memoized in fit_cache under a hash
+        of the training and ideal contents, the layout, k and the criterion;
+        workers and method do not change the result and are not part of the key.
+        The same hash is stored with the model for load_model(verify=True); with
+        use_cache=False and verifiable=False it is never computed, and the
+        stored model cannot be verified.
+        """
+        if criterion not in METRICS:
+            raise ValueError(f"Unknown selection criterion: {criterion}")
+        if k < 1:
+            raise ValueError("k must be >= 1")
+        self.criterion = criterion
+        input_hash = self._input_hash() if use_cache or verifiable else None
+        key = self._cache_key(input_hash, k, criterion) if use_cache else None
+        if use_cache:
+            cached = self.db.cached_fit(key)
+            if cached is not None:
+                # The stored model may already be this fit; then nothing is rewritten
+                stored = self.db.model_key() == key
+                self._restore_rankings(cached, save=not stored)
+                if not stored:
+                    self.save_model(input_hash, key)
+                return self.best_fits
 
-    def select_best_ideals(self):
-        train_df = pd.read_sql('training', self.db.engine)
-        ideal_df = pd.read_sql('ideal', self.db.engine)
+        with metrics.stage('read_training') as timing:
+            train_df = self.db.frame('training')
+            timing['rows'] = len(train_df)
 
         # Get the number of training columns dynamically
         train_cols = [col for col in train_df.columns if col.startswith('Y')]
-        
-        for col_name in train_cols:
-            train_y = train_df[col_name]
-            min_ssd = float('inf')
-            best_col = None
-            max_dev = 0
-
-            for col in [c for c in ideal_df.columns if c.startswith('Y')]:
-                ideal_y = ideal_df[col]
-                ssd = np.sum((train_y - ideal_y) ** 2)
-                if ssd < min_ssd:
-                    min_ssd = ssd
-                    best_col = col
-                    max_dev = np.max(np.abs(train_y - ideal_y))
+        train = train_df[train_cols].to_numpy(dtype=float)
 
+        with metrics.stage('fit') as timing:
+            if self.db.ideal_layout == 'long':
+                ideal_cols, best = self._best_from_long(train_df['X'], train, workers, method, k,
+                                                        criterion=criterion)
+            else:
+                table = self.db.ideal_table()
+                ideal_cols = table.y_columns()
+                best = fit_block(train, table.block(ideal_cols), workers=workers, method=method, k=k,
+                                 criterion=criterion)
+            timing['rows'] = len(train_cols) * len(ideal_cols)
+
+        self._store_rankings(train_cols, ideal_cols, best)
+        if use_cache:
+            self.db.store_fit(key, self.rankings)
+        self.save_model(input_hash, key)
+        return self.best_fits
+
+    def compare_precision(self, method='matrix', batch=500):
+        """Check the best fits of a compact (float32) run against float64 values.
+
+        The ideal table is re-read at full precision (from SQLite, or the loaded
+        frame in in-memory mode), batch columns at a time, and refitted with the
+        same criterion. Returns {training column: (compact choice, float64 choice)}
+        for every column whose choice differs; empty when they all agree.
+        """
+        train_df = self.db.frame('training')
+        train_cols = [col for col in train_df.columns if col.startswith('Y')]
+        train = train_df[train_cols].to_numpy(dtype=float)
+        ideal_cols = self.db.ideal_table().y_columns()
+        if not ideal_cols:
+            return {}
+
+        parts = []
+        for start in range(0, len(ideal_cols), batch):
+            names = ideal_cols[start:start + batch]
+            parts.append(search_columns(train, self.db.ideal_columns(names), start, method,
+                                        criterion=self.criterion))
+        full = {col: ideal_cols[ranked[0][0]] for col, ranked in zip(train_cols, merge_best(parts))}
+        return {col: (self.best_fits[col]['col'], full[col])
+                for col in train_cols if col in self.best_fits and self.best_fits[col]['col'] != full[col]}
+
+    def compare_criteria(self, batch=500):
+        """Best ideal function per training column under every criterion in METRICS.
+
+        Each batch of ideal columns gets one fused deviation_matrices() pass that
+        yields every metric matrix at once, so comparing the criteria costs about
+        one fit rather than one per criterion. Returns {criterion: {training
+        column: ideal column}}.
+        """
+        train_df = self.db.frame('training')
+        train_cols = [col for col in train_df.columns if col.startswith('Y')]
+        train = train_df[train_cols].to_numpy(dtype=float)
+        if self.db.ideal_layout == 'long':
+            ideal_cols = self.db.ideal_functions()
+            fetch = lambda names: self.db.fetch_ideal(names, train_df['X']).block(names)
+        else:
+            table = self.db.ideal_table()
+            ideal_cols = table.y_columns()
+            fetch = lambda names: np.asarray(table.block(names), dtype=float)
+        _require_columns(len(ideal_cols))
+
+        parts = {name: [] for name in METRICS}
+        for start in range(0, len(ideal_cols), batch):
+            block = fetch(ideal_cols[start:start + batch])
+            matrices = deviation_matrices(train, block)
+            for name, blocks in parts.items():
+                blocks.append([[(start + j, score, values) for j, score, values in ranked]
+                               for ranked in pick_best(train, block, matrices[name], 1, name)])
+        return {name: {col: ideal_cols[ranked[0][0]] for col, ranked in zip(train_cols, merge_best(blocks))}
+                for name, blocks in parts.items()}
+
+    def _input_hash(self):
+        """SHA-256 of the training contents, the ideal catalog and its layout"""
+        h = hashlib.sha256(self.db.ideal_layout.encode())
+        h.update(self.db.training_digest().encode())
+        h.update(self.db.ideal_digest().encode())
+        return h.hexdigest()
+
+    def _cache_key(self, input_hash, k, criterion='ssd'):
+        return hashlib.sha256(f'{input_hash}:{k}:{criterion}'.encode()).hexdigest()
+
+    def save_model(self, input_hash=None, fit_key=None):
+        """Persist best_fits with all their metrics, the criterion and the mapping
+        thresholds in the best_fits table"""
+        self.db.save_model([
+            {'train_func': train_col, 'ideal_func': info['col'], 'ssd': info['ssd'], 'sad': info['sad'],
+             'max_dev': info['max_dev'], 'threshold': info['max_dev'] * THRESHOLD_FACTOR,
+             'criterion': self.criterion}
+            for train_col, info in self.best_fits.items()
+        ], input_hash, fit_key)
+
+    def load_model(self, verify=False):
+        """Adopt the persisted best fits so mapping can start without refitting.
+
+        With verify=True the model's input hash must match the current training
+        and ideal tables; a stale or unverifiable model raises DataLoadError.
+        """
+        model = self.db.load_model()
+        if model is None:
+            raise DataLoadError("No fit model stored; run select_best_ideals first")
+        fits, input_hash = model
+        if verify and input_hash != self._input_hash():
+            raise DataLoadError("Stored fit model does not match the training and ideal tables")
+        self.best_fits = {fit['train_func']: {'col': fit['ideal_func'], 'ssd': fit['ssd'],
+                                              'sad': fit['sad'], 'max_dev': fit['max_dev']}
+                          for fit in fits}
+        self.criterion = fits[0]['criterion'] or 'ssd'
+        return self.best_fits
+
+    def update_fits(self, new_rows, k=1, criterion='ssd'):
+        """Fold new training rows into running statistics and re-derive the best fits.
+
+        For every (training, ideal) pair fit_stats keeps the running value of every
+        metric in METRICS, so only the new rows are compared with the catalog
+        and earlier training rows are never reread. Rows are paired with ideal
+        values by X. The first call after the tables were (re)loaded builds the
+        statistics from the whole training table. The statistics live in SQLite,
+        one row per training column, and are written in the transaction that
+        appends the rows, so this is not available in in-memory mode.
+        """
+        if self.db.in_memory:
+            raise ValueError("update_fits keeps its statistics in SQLite; use a persistent DatabaseManager")
+        if criterion not in METRICS:
+            raise ValueError(f"Unknown selection criterion: {criterion}")
+        if k < 1:
+            raise ValueError("k must be >= 1")
+        new_rows = new_rows.copy()
+        new_rows.columns = new_rows.columns.str.upper()
+        train_cols = [col for col in new_rows.columns if col.startswith('Y')]
+        stats = self.db.load_fit_stats()
+
+        # Statistics written before a metric existed are rebuilt from the whole table
+        rebuild = (stats is None or set(stats[0]) != set(train_cols)
+                   or not set(STAT_COLUMNS.values()) <= set(stats[2]))
+        if rebuild:
+            ideal_cols, matrices = self._residual_stats(
+                pd.concat([self.db.frame('training'), new_rows], ignore_index=True), train_cols)
+        else:
+            ideal_cols, matrices = self._residual_stats(new_rows, train_cols)
+            stored_train, stored_ideal, previous = stats
+            if set(stored_ideal) != set(ideal_cols):
+                raise DataLoadError("fit_stats does not match the ideal table; reload the data")
+            grid = np.ix_([stored_train.index(col) for col in train_cols],
+                          [stored_ideal.index(col) for col in ideal_cols])
+            for name, (_, combine) in METRICS.items():
+                matrices[name] = combine(matrices[name], previous[STAT_COLUMNS[name]][grid])
+
+        # Nothing is written until the new rows have been checked against the catalog
+        self.db.append_training(new_rows, (train_cols, ideal_cols, {
+            STAT_COLUMNS[name]: matrix for name, matrix in matrices.items()}), replace_stats=rebuild)
+
+        scores = matrices[criterion]
+        best = []
+        for i in range(len(train_cols)):
+            top = np.argpartition(scores[i], min(k, scores.shape[1]) - 1)[:k]
+            top = top[np.lexsort((top, scores[i, top]))]
+            best.append([(j, scores[i, j], {name: float(matrix[i, j]) for name, matrix in matrices.items()})
+                         for j in top])
+        self.criterion = criterion
+        self._store_rankings(train_cols, ideal_cols, best)
+        # Hashing the inputs would reread the whole training table; the model is
+        # stored unverifiable instead
+        self.save_model()
+        return self.best_fits
+
+    def _residual_stats(self, rows_df, train_cols):
+        """Every METRICS matrix of the given training rows against the whole catalog."""
+        x = rows_df['X'].to_numpy(dtype=float)
+        if self.db.ideal_layout == 'long':
+            ideal_cols = self.db.ideal_functions()
+            ideal = self.db.fetch_ideal(ideal_cols, x).block(ideal_cols)
+        else:
+            table = self.db.ideal_table()
+            ideal_cols = table.y_columns()
+            rows = table.index.lookup(x)
+            ideal = table.gather(np.maximum(rows, 0), ideal_cols)
+            ideal[rows < 0] = np.nan
+        _require_columns(len(ideal_cols))
+        train = rows_df[train_cols].to_numpy(dtype=float)
+        return ideal_cols, deviation_matrices(train, ideal, expand=False)
+
+    def _store_rankings(self, train_cols, ideal_cols, best):
+        """Record ranked (column index, score, metrics) candidates per training column."""
+        self._restore_rankings({
+            col_name: [{'rank': rank, 'col': ideal_cols[j], **values}
+                       for rank, (j, _, values) in enumerate(ranked, 1)]
+            for col_name, ranked in zip(train_cols, best)
+        })
+
+    def _restore_rankings(self, rankings, save=True):
+        """Adopt ranked candidates per training column; rank 1 becomes the best fit."""
+        for col_name, ranked in rankings.items():
+            self.rankings[col_name] = ranked
+            top = ranked[0]
             self.best_fits[col_name] = {
-                'col': best_col,
-                'ssd': min_ssd,
-                'max_dev': max_dev
+                'col': top['col'],
+                'ssd': top['ssd'],
+                'sad': top['sad'],
+                'max_dev': top['max_dev']
             }
-        return self.best_fits
+        if save:
+            self.db.save_rankings(self.rankings)
+
+    def margins(self):
+        """Criterion score gap between the runner-up and the best fit per training
+        column (None when fewer than two candidates were ranked)."""
+        return {col: ranked[1][self.criterion] - ranked[0][self.criterion] if len(ranked) > 1 else None
+                for col, ranked in self.rankings.items()}
+
+    def _best_from_long(self, train_x, train, workers=1, method='matrix', k=1, batch=1000,
+                        criterion='ssd'):
+        """Fit against the long-format catalog a batch of functions at a time.
+
+        Ideal values are fetched at the training X values only, so rows are paired
+        by X rather than by position. With workers > 1 one process pool serves
+        every batch.
+        """
+        functions = self.db.ideal_functions()
+        _require_columns(len(functions))
+        parts = []
+        pool = None
+        if workers > 1 and len(functions) > batch:
+            from parallel import FitPool
+            pool = FitPool(train, workers)
+        try:
+            for start in range(0, len(functions), batch):
+                names = functions[start:start + batch]
+                ideal = self.db.fetch_ideal(names, train_x).block(names)
+                parts.append(fit_block(train, ideal, offset=start, workers=workers, method=method, k=k,
+                                       criterion=criterion, pool=pool))
+        finally:
+            if pool is not None:
+                pool.close()
+        return functions, merge_best(parts, k)
 
     def map_test_data(self, test_file: str):
-        test_df = pd.read_csv(test_file)
-        # Standardize column names to uppercase
-        test_df.columns = test_df.columns.str.upper()
-        
-        ideal_df = pd.read_sql('ideal', self.db.engine)
-        results = []
-
-        for _, row in test_df.iterrows():
-            x, y = row['X'], row['Y']
-            assigned = None
-            delta = None
-
-            for train_key, info in self.best_fits.items():
-                col = info['col']
-                ideal_y = ideal_df.loc[ideal_df['X'] == x, col]
-                if ideal_y.empty:
-                    continue
-                ideal_val = ideal_y.values[0]
-                dev = abs(y - ideal_val)
-                threshold = info['max_dev'] * math.sqrt(2)
-                if dev <= threshold:
-                    if assigned is None or dev < delta:
-                        assigned = col
-                        delta = dev
-
-            results.append({
-                'X': x, 'Y': y, 'Delta Y': delta, 'No. of ideal func': assigned
-            })
-
-        results_df = pd.DataFrame(results)
-        self.db.save_results(results_df)
+        with metrics.stage('parse_csv') as timing:
+            test_df = read_frame(test_file)
+            timing['rows'] = len(test_df)
+
+        with metrics.stage('map', rows=len(test_df)):
+            results_df = self.map_points(test_df, self._mapping_table(test_df))
+        with metrics.stage('save_results', rows=len(results_df)):
+            self.db.save_results(results_df)
+        return results_df
+
+    def map_file(self, test_file):
+        """Map one test CSV without saving it; every row is tagged with the file path"""
+        test_df = read_frame(test_file)
+        results_df = self.map_points(test_df, self._mapping_table(test_df))
+        results_df['Source file'] = str(test_file)
         return results_df
+
+    def map_files(self, test_files, workers=1, batch_rows=500_000, progress=print):
+        """Map many test CSVs into test_results, tagged by source file.
+
+        With workers > 1 the files are mapped in a process pool while this process
+        stays the only writer, committing about batch_rows rows per transaction.
+        test_results is replaced by the first write. Files that cannot be read are
+        reported and skipped. Returns the file, point and failure counts.
+        """
+        from batch import mapped_files
+        pending, pending_rows, written = [], 0, False
+        counts = {'files': 0, 'total': 0, 'mapped': 0, 'failed': {}}
+
+        def flush():
+            nonlocal pending, pending_rows, written
+            with metrics.stage('save_results', rows=pending_rows):
+                self.db.append_results(pd.concat(pending, ignore_index=True), replace=not written)
+            pending, pending_rows, written = [], 0, True
+
+        for test_file, results_df, error in mapped_files(self, test_files, workers):
+            if error:
+                counts['failed'][str(test_file)] = error
+                if progress:
+                    progress(f"Skipped {test_file}: {error}")
+                continue
+            pending.append(results_df)
+            pending_rows += len(results_df)
+            counts['files'] += 1
+            counts['total'] += len(results_df)
+            counts['mapped'] += int(results_df['No. of ideal func'].notna().sum())
+            if pending_rows >= batch_rows:
+                flush()
+            if progress:
+                progress(f"Mapped {test_file} ({counts['files']} files, {counts['total']} points)")
+        if pending:
+            flush()
+        return counts
+
+    def stream_test_data(self, test_file: str, chunksize=100_000, progress=print):
+        """Map a test CSV in bounded chunks, appending each chunk to test_results.
+
+        Only one chunk of test points is held in memory at a time, so the file may
+        be larger than RAM. Returns the total and mapped point counts.
+        """
+        table = self.db.ideal_table() if self.db.ideal_layout == 'wide' else None
+        total = mapped = 0
+
+        n = -1
+        for n, test_df in enumerate(iter_frames(test_file, chunksize)):
+            results_df = self.map_points(test_df, table or self._mapping_table(test_df))
+            self.db.append_results(results_df, replace=(n == 0))
+
+            total += len(results_df)
+            mapped += int(results_df['No. of ideal func'].notna().sum())
+            if progress:
+                progress(f"Mapped {total} test points ({mapped} assigned)")
+        if n < 0:
+            # An empty file still replaces the results of the previous run
+            test_df = pd.DataFrame({'X': [], 'Y': []})
+            self.db.save_results(self.map_points(test_df, table or self._mapping_table(test_df)))
+        return {'total': total, 'mapped': mapped}
+
+    def _mapping_table(self, test_df):
+        """Ideal values needed to map test_df: the shared array, or for the long
+        layout just the fitted functions at the test X values."""
+        if self.db.ideal_layout == 'wide':
+            return self.db.ideal_table()
+        cols = [info['col'] for info in self.best_fits.values()]
+        return self.db.fetch_ideal(cols, np.unique(test_df['X'].to_numpy(dtype=float)))
+
+    def map_points(self, test_df, table):
+        """Assign every (X, Y) test point to its closest selected ideal function.
+
+        A point is assigned when its deviation from a selected ideal function is
+        within sqrt(2) times that function's max training deviation; among several
+        candidates the smallest deviation wins, the first fit on ties.
+        """
+        x = test_df['X'].to_numpy(dtype=float)
+        y = test_df['Y'].to_numpy(dtype=float)
+        cols = [info['col'] for info in self.best_fits.values()]
+        thresholds = np.array([info['max_dev'] * THRESHOLD_FACTOR for info in self.best_fits.values()])
+
+        rows = table.index.lookup(x)
+        found = rows >= 0
+        ideal_y = table.gather(np.where(found, rows, 0), cols)
+        dev = np.abs(y[:, None] - ideal_y)
+        ok = found[:, None] & (dev <= thresholds)
+
+        # A trailing "unassigned" column keeps argmin defined when nothing fits
+        dev = np.column_stack([np.where(ok, dev, np.inf), np.full(len(x), np.inf)])
+        best = np.where(ok.any(axis=1), dev.argmin(axis=1), len(cols))
+        delta = np.where(best < len(cols), dev[np.arange(len(x)), best], np.nan)
+        assigned = np.array(cols + [None], dtype=object)[best]
+
+        return pd.DataFrame({
+            'X': x, 'Y': y, 'Delta Y': delta, 'No. of ideal func': assigned
+        })
@@ -1,36 +1,150 @@
+import argparse
+import cProfile
+import os
+import tracemalloc
+import metrics
+from cli import positive_int
 from database import DatabaseManager
 from fitting import FunctionFitter
 from visualizer import Visualizer
 
-def main():
-    db = DatabaseManager()
-    
-    # Load training data (single file with multiple Y columns)
-    db.load_training('data/train.csv')
-    
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Select ideal functions and map test data")
+    parser.add_argument('--chunksize', type=int, default=None,
+                        help="stream the test file in chunks of this many rows")
+    parser.add_argument('--bulk', action='store_true',
+                        help="load the CSVs with the bulk executemany path")
+    parser.add_argument('--parse-workers', type=int, default=1,
+                        help="threads used to parse each input CSV")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="processes used to fit ideal-function shards")
+    parser.add_argument('--method', choices=['matrix', 'prune'], default='matrix',
+                        help="best-fit search: full SSD matrix or early-abandoning search")
+    parser.add_argument('--top-k', type=positive_int, default=1,
+                        help="rank this many candidate ideal functions per training column")
+    parser.add_argument('--criterion', choices=['ssd', 'sad', 'max_dev'], default='ssd',
+                        help="metric that ranks the ideal functions")
+    parser.add_argument('--compare-criteria', action='store_true',
+                        help="also report the best fits under every criterion from one fused pass")
+    parser.add_argument('--compact', action='store_true',
+                        help="keep the ideal catalog as float32 and check the fits against float64")
+    parser.add_argument('--max-points', type=int, default=None,
+                        help="downsample each plot to this many points and render with WebGL")
+    parser.add_argument('--density', type=int, default=None, metavar='BINS',
+                        help="draw test points as a BINS x BINS density image instead of markers")
+    parser.add_argument('--in-memory', action='store_true',
+                        help="pass data between stages in memory and write SQLite in the background at the end")
+    parser.add_argument('--no-persist', action='store_true',
+                        help="with --in-memory, skip writing SQLite altogether")
+    parser.add_argument('--metrics', default=None,
+                        help="write per-stage timings to this .json or .csv file")
+    parser.add_argument('--profile', action='store_true',
+                        help="also capture cProfile stats and per-stage tracemalloc peaks")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.profile and not args.metrics:
+        args.metrics = 'metrics.json'
+
+    timer = metrics.StageTimer(trace_memory=args.profile)
+    metrics.activate(timer)
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler:
+        tracemalloc.start()
+        profiler.enable()
+    try:
+        run_pipeline(args)
+    finally:
+        if profiler:
+            profiler.disable()
+            tracemalloc.stop()
+        metrics.activate(None)
+
+    print("\n=== Stage Timings ===")
+    print(timer.summary())
+    if args.metrics:
+        timer.write(args.metrics)
+        print(f"Metrics saved to {args.metrics}")
+    if profiler:
+        stats_file = os.path.splitext(args.metrics)[0] + '.prof'
+        profiler.dump_stats(stats_file)
+        print(f"Profile saved to {stats_file} (view with: python -m pstats {stats_file})")
+
+def run_pipeline(args):
+    db = DatabaseManager(compact=args.compact, in_memory=args.in_memory)
+
+    # Load training data (single file with multiple Y columns); files unchanged
+    # since the last run are not parsed again
+    with metrics.stage('load_training'):
+        if not db.source_unchanged('training', 'data/train.csv'):
+            db.load_training('data/train.csv', bulk=args.bulk, workers=args.parse_workers)
+
     # Load ideal functions
-    db.load_ideal('data/ideal.csv')
+    with metrics.stage('load_ideal'):
+        ideal_table = 'ideal' if db.ideal_layout == 'wide' else 'ideal_long'
+        if not db.source_unchanged(ideal_table, 'data/ideal.csv'):
+            db.load_ideal('data/ideal.csv', bulk=args.bulk, workers=args.parse_workers)
 
     # Find best fitting ideal functions
     fitter = FunctionFitter(db)
-    best = fitter.select_best_ideals()
+    with metrics.stage('select_best_ideals'):
+        best = fitter.select_best_ideals(workers=args.workers, method=args.method, k=args.top_k,
+                                         criterion=args.criterion)
     print("\n=== Best Fitting Ideal Functions ===")
     for train_col, info in best.items():
-        print(f"{train_col} -> {info['col']} (SSD: {info['ssd']:.6f}, Max Dev: {info['max_dev']:.6f})")
+        print(f"{train_col} -> {info['col']} (SSD: {info['ssd']:.6f}, SAD: {info['sad']:.6f}, "
+              f"Max Dev: {info['max_dev']:.6f})")
+    if args.top_k > 1:
+        print("\n=== Candidate Rankings ===")
+        margins = fitter.margins()
+        for train_col, ranked in fitter.rankings.items():
+            runners = ", ".join(f"#{e['rank']} {e['col']} ({e[args.criterion]:.6f})" for e in ranked)
+            margin = 'n/a' if margins[train_col] is None else f"{margins[train_col]:.6f}"
+            print(f"{train_col}: {runners} | margin: {margin}")
+    if args.compare_criteria:
+        with metrics.stage('compare_criteria'):
+            choices = fitter.compare_criteria()
+        print("\n=== Selection Criteria ===")
+        for train_col in best:
+            print(f"{train_col}: " + ", ".join(f"{name} -> {picks[train_col]}" for name, picks in choices.items()))
+    if args.compact:
+        with metrics.stage('compare_precision'):
+            differences = fitter.compare_precision(method=args.method)
+        print("\n=== Compact Precision Check ===")
+        if not differences:
+            print("All best fits match the float64 run")
+        for train_col, (compact_col, full_col) in differences.items():
+            print(f"{train_col}: float32 -> {compact_col}, float64 -> {full_col}")
 
     # Map test data to ideal functions
-    results = fitter.map_test_data('data/test.csv')
-    mapped_count = results['No. of ideal func'].notna().sum()
+    with metrics.stage('map_test_data') as timing:
+        if args.chunksize:
+            counts = fitter.stream_test_data('data/test.csv', chunksize=args.chunksize)
+            total, mapped_count = counts['total'], counts['mapped']
+        else:
+            results = fitter.map_test_data('data/test.csv')
+            total, mapped_count = len(results), results['No. of ideal func'].notna().sum()
+        timing['rows'] = total
     print(f"\n=== Test Data Mapping ===")
-    print(f"Total test points: {len(results)}")
+    print(f"Total test points: {total}")
     print(f"Mapped points: {mapped_count}")
-    print(f"Unmapped points: {len(results) - mapped_count}")
+    print(f"Unmapped points: {total - mapped_count}")
+
+    # In-memory mode: persist while the plot renders
+    sink = db.flush(background=True) if args.in_memory and not args.no_persist else None
 
     # Generate visualization
-    viz = Visualizer(db.engine)
-    viz.plot_all()
+    viz = Visualizer(db.engine, db.frames)
+    with metrics.stage('plot_all'):
+        viz.plot_all(args.max_points, args.density)
     print("\n=== Visualization ===")
     print("Saved to visualization.html")
 
+    if sink:
+        with metrics.stage('sqlite_sink'):
+            writes = sink.result()
+        print(f"\n=== SQLite Sink ===\nPersisted {writes} deferred writes to assignment.db")
+
 if __name__ == "__main__":
     main()
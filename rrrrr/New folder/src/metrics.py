@@ -0,0 +1,98 @@
+import csv
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# Timer receiving stage() calls from the library code; None disables instrumentation
+_active = None
+
+
+class StageTimer:
+    """Nested wall-clock stage timers with row counts and throughput.
+
+    With trace_memory=True (tracemalloc already running) every stage also records
+    the peak traced memory reached while it ran.
+    """
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.records = []
+        self._stack = []
+
+    @contextmanager
+    def stage(self, name, rows=None):
+        record = {'stage': '/'.join([r['name'] for r in self._stack] + [name]),
+                  'name': name, 'depth': len(self._stack), 'rows': rows, 'peak': 0}
+        if self.trace_memory:
+            if self._stack:
+                parent = self._stack[-1]
+                parent['peak'] = max(parent['peak'], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        self._stack.append(record)
+        self.records.append(record)
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['seconds'] = time.perf_counter() - start
+            self._stack.pop()
+            if self.trace_memory:
+                record['peak'] = max(record['peak'], tracemalloc.get_traced_memory()[1])
+                if self._stack:
+                    self._stack[-1]['peak'] = max(self._stack[-1]['peak'], record['peak'])
+
+    def rows(self):
+        """Return the stage records in start order, ready for JSON or CSV"""
+        out = []
+        for record in self.records:
+            seconds = record.get('seconds', 0.0)
+            rows = record['rows']
+            out.append({
+                'stage': record['stage'],
+                'depth': record['depth'],
+                'seconds': round(seconds, 6),
+                'rows': rows,
+                'rows_per_second': round(rows / seconds, 1) if rows and seconds else None,
+                'peak_mb': round(record['peak'] / 2 ** 20, 3) if self.trace_memory else None,
+            })
+        return out
+
+    def write(self, path):
+        """Write the records as CSV when path ends in .csv, otherwise as JSON"""
+        rows = self.rows()
+        if path.endswith('.csv'):
+            with open(path, 'w', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=list(rows[0]) if rows else ['stage'])
+                writer.writeheader()
+                writer.writerows(rows)
+        else:
+            with open(path, 'w') as f:
+                json.dump({'created': time.time(), 'stages': rows}, f, indent=2)
+
+    def summary(self):
+        lines = []
+        for row in self.rows():
+            rate = f"  {row['rows_per_second']:,.0f} rows/s" if row['rows_per_second'] else ''
+            lines.append(f"{'  ' * row['depth']}{row['stage'].rsplit('/', 1)[-1]:<24}"
+                         f"{row['seconds']:9.3f}s{rate}")
+        return '\n'.join(lines)
+
+
+def activate(timer):
+    """Route stage() calls to timer (or switch instrumentation off with None)"""
+    global _active
+    _active = timer
+
+
+@contextmanager
+def stage(name, rows=None):
+    """Time a block under the active timer; a no-op when none is active.
+
+    The yielded dict accepts a 'rows' count filled in once it is known.
+    """
+    if _active is None:
+        yield {}
+        return
+    with _active.stage(name, rows) as record:
+        yield record
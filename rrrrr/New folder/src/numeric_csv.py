@@ -0,0 +1,153 @@
+"""
+Reader for the all-numeric CSV files (train, ideal, test).
+
+The header is parsed on its own and the rows go chunk by chunk straight into
+one preallocated, contiguous float64 array, optionally a memory-mapped .npy
+file, so no whole-file DataFrame is built and nothing is copied afterwards.
+"""
+import csv
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+
+# Cells parsed per chunk; bounds the temporary frame built by the C parser
+CHUNK_CELLS = 250_000
+
+# Bytes read at a time while counting rows
+SCAN_BYTES = 1 << 24
+
+
+class _ByteRange(io.RawIOBase):
+    """Read-only stream over bytes [start, end) of a file"""
+
+    def __init__(self, path, start, end):
+        self._file = open(path, 'rb')
+        self._file.seek(start)
+        self._left = end - start
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        n = self._file.readinto(memoryview(buffer)[:self._left])
+        self._left -= n
+        return n
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+
+def read_header(path):
+    """Return the upper-cased column names and the byte offset of the first data row"""
+    with open(path, 'rb') as f:
+        line = f.readline()
+        start = f.tell()
+    columns = next(csv.reader([line.decode('utf-8-sig')]), [])
+    if not columns:
+        raise ValueError(f"{path} has no header row")
+    return [name.upper() for name in columns], start
+
+
+def _split(path, start, size, parts):
+    """Cut the data bytes into about parts ranges that begin at line starts"""
+    bounds = [start]
+    step = (size - start) // parts + 1
+    with open(path, 'rb') as f:
+        for k in range(1, parts):
+            f.seek(start + k * step)
+            f.readline()
+            if f.tell() >= size:
+                break
+            bounds.append(max(bounds[-1], f.tell()))
+    bounds.append(size)
+    return [(a, b) for a, b in zip(bounds, bounds[1:]) if b > a]
+
+
+def _count_rows(path, start, end):
+    """Number of lines in a byte range, including a last line without a newline"""
+    count, last = 0, b'\n'
+    with open(path, 'rb') as f:
+        f.seek(start)
+        left = end - start
+        while left > 0:
+            block = f.read(min(SCAN_BYTES, left))
+            if not block:
+                break
+            count += block.count(b'\n')
+            last = block[-1:]
+            left -= len(block)
+    return count + (last != b'\n')
+
+
+def _parse_range(path, start, end, width, out, row, chunk_rows):
+    """Parse the rows of a byte range into out from row on; returns the rows written"""
+    written = 0
+    with io.BufferedReader(_ByteRange(path, start, end), SCAN_BYTES) as f:
+        with pd.read_csv(f, header=None, names=range(width), dtype=np.float64,
+                         chunksize=chunk_rows) as reader:
+            for chunk in reader:
+                out[row + written:row + written + len(chunk)] = chunk.to_numpy()
+                written += len(chunk)
+    return written
+
+
+def read_numeric(path, workers=1, mmap_path=None, chunk_rows=None):
+    """Parse an all-numeric CSV into (upper-cased column names, float64 array).
+
+    The data rows are counted first, so the array is allocated once at its
+    final size, in memory or as a .npy file at mmap_path that is returned
+    memory-mapped, and every chunk of rows is parsed straight into its slice.
+    With workers > 1, newline-aligned byte ranges are parsed on that many
+    threads. Non-numeric fields raise ValueError; empty fields become NaN.
+    """
+    columns, start = read_header(path)
+    chunk_rows = chunk_rows or max(1, CHUNK_CELLS // len(columns))
+    ranges = _split(path, start, os.path.getsize(path), max(1, workers))
+    counts = [_count_rows(path, a, b) for a, b in ranges]
+    offsets = np.concatenate([[0], np.cumsum(counts, dtype=np.int64)])
+    shape = (int(offsets[-1]), len(columns))
+    if mmap_path:
+        out = np.lib.format.open_memmap(mmap_path, mode='w+', dtype=np.float64, shape=shape)
+    else:
+        out = np.empty(shape)
+
+    def parse(i):
+        return _parse_range(path, *ranges[i], len(columns), out, int(offsets[i]), chunk_rows)
+
+    if workers > 1 and len(ranges) > 1:
+        with ThreadPoolExecutor(workers) as pool:
+            written = list(pool.map(parse, range(len(ranges))))
+    else:
+        written = [parse(i) for i in range(len(ranges))]
+
+    if written != counts:
+        # Blank lines were counted but not parsed: close the gaps they left
+        row = 0
+        for offset, n in zip(offsets, written):
+            out[row:row + n] = out[offset:offset + n]
+            row += n
+        if not mmap_path:
+            return columns, out[:row]
+        trimmed = np.array(out[:row])
+        del out
+        np.save(mmap_path, trimmed)
+        out = np.load(mmap_path, mmap_mode='r+')
+    return columns, out
+
+
+def read_frame(path, workers=1):
+    """read_numeric as a DataFrame that wraps the parsed array without copying it"""
+    columns, values = read_numeric(path, workers)
+    return pd.DataFrame(values, columns=columns, copy=False)
+
+
+def iter_frames(path, chunksize):
+    """Yield the rows of an all-numeric CSV as float64 DataFrames of chunksize rows"""
+    columns, start = read_header(path)
+    with io.BufferedReader(_ByteRange(path, start, os.path.getsize(path)), SCAN_BYTES) as f:
+        with pd.read_csv(f, header=None, names=columns, dtype=np.float64,
+                         chunksize=chunksize) as reader:
+            yield from reader
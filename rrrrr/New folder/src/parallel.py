@@ -0,0 +1,95 @@
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+from fitting import merge_best, search_columns
+
+
+def _share(array, shm=None):
+    """Copy an array into shared memory; returns (block, spec).
+
+    shm is reused when it is large enough, otherwise a new block is created
+    (the caller releases the old one). float32 (compact) arrays stay float32;
+    anything else is stored as float64.
+    """
+    array = np.ascontiguousarray(array, dtype=np.float32 if array.dtype == np.float32 else float)
+    if shm is None or shm.size < array.nbytes:
+        shm = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+    return shm, (shm.name, array.shape, array.dtype.str)
+
+
+def _release(shm):
+    shm.close()
+    shm.unlink()
+
+
+def _attach(spec):
+    name, shape, dtype = spec
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _fit_shard(train_spec, ideal_spec, start, stop, method, k, criterion):
+    """Worker: k best fits of every training column within ideal columns [start, stop)."""
+    train_shm, train = _attach(train_spec)
+    ideal_shm, ideal = _attach(ideal_spec)
+    try:
+        return search_columns(train, ideal[:, start:stop], start, method, k, criterion)
+    finally:
+        del train, ideal
+        train_shm.close()
+        ideal_shm.close()
+
+
+class FitPool:
+    """Process pool and shared training block kept for a series of ideal blocks.
+
+    The long layout fits the catalog one batch of functions at a time; the
+    workers, the training block and the ideal block's shared memory are set up
+    once and reused by every batch. Use as a context manager.
+    """
+
+    def __init__(self, train, workers):
+        self.workers = workers
+        self._train_shm, self._train_spec = _share(train)
+        self._ideal_shm = None
+        self._pool = ProcessPoolExecutor(workers)
+
+    def best(self, ideal, offset=0, method='matrix', k=1, criterion='ssd'):
+        """Split the ideal columns into shards, fit them in the pool and reduce."""
+        n_cols = ideal.shape[1]
+        bounds = np.linspace(0, n_cols, min(self.workers, max(1, n_cols)) + 1).astype(int)
+        shm, ideal_spec = _share(ideal, self._ideal_shm)
+        if shm is not self._ideal_shm:
+            if self._ideal_shm is not None:
+                _release(self._ideal_shm)
+            self._ideal_shm = shm
+        futures = [self._pool.submit(_fit_shard, self._train_spec, ideal_spec, int(a), int(b), method, k,
+                                     criterion)
+                   for a, b in zip(bounds, bounds[1:]) if b > a]
+        parts = [future.result() for future in futures]
+        return [[(offset + j, score, metrics) for j, score, metrics in ranked]
+                for ranked in merge_best(parts, k)]
+
+    def close(self):
+        self._pool.shutdown()
+        for shm in (self._train_shm, self._ideal_shm):
+            if shm is not None:
+                _release(shm)
+        self._ideal_shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def best_parallel(train, ideal, workers, offset=0, method='matrix', k=1, criterion='ssd'):
+    """Split the ideal columns into shards, fit them in a process pool and reduce.
+
+    Both arrays are placed in shared memory once; workers only receive the block
+    names and their column range, never pickled data.
+    """
+    with FitPool(train, workers) as pool:
+        return pool.best(ideal, offset, method, k, criterion)
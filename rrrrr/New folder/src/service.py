@@ -0,0 +1,217 @@
+"""
+Resident mapping service: keeps the best fits and the fitted ideal columns in
+memory and maps batches of (X, Y) points sent as JSON lines.
+
+Requests, one JSON object per line:
+    {"points": [[x, y], ...], "id": <optional, echoed back>}
+    {"cmd": "ping"} | {"cmd": "fits"} | {"cmd": "reload"}
+Mapping replies carry one entry per point in "ideal" and "delta" (null when a
+point is not assigned).
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import sys
+import numpy as np
+import pandas as pd
+from cache import IdealTable
+from database import DatabaseManager
+from fitting import DataLoadError, FunctionFitter
+
+
+class MappingService:
+    """Best fits plus a compact X/ideal-column table, reloaded when the ideal catalog
+    or the persisted fit model changes."""
+
+    def __init__(self, db: DatabaseManager, poll_interval=2.0):
+        self.db = db
+        self.fitter = FunctionFitter(db)
+        self.poll_interval = poll_interval
+        self.table = None
+        self.version = None
+        self._reload_lock = asyncio.Lock()
+        self.reload()
+
+    def _load(self):
+        """Load the persisted fit model (refitting only when it is missing or stale)
+        and build a mapping table for it; returns (fitter, table, version) without
+        touching the ones serving requests"""
+        self.db.refresh_ideal()
+        fitter = FunctionFitter(self.db)
+        try:
+            fitter.load_model(verify=True)
+        except DataLoadError:
+            fitter.select_best_ideals()
+        cols = [info['col'] for info in fitter.best_fits.values()]
+        if self.db.ideal_layout == 'wide':
+            ideal = self.db.ideal_table()
+            values = np.column_stack([ideal.column('X')] + [ideal.column(col) for col in cols])
+            table = IdealTable(['X'] + cols, values)
+        else:
+            xs = self.db.ideal_x_values(cols)
+            fetched = self.db.fetch_ideal(cols, xs)
+            table = IdealTable(fetched.columns, np.ascontiguousarray(fetched.values))
+        # Build the X index now rather than on the first request
+        _ = table.index
+        return fitter, table, self._version()
+
+    def reload(self):
+        """Rebuild the resident fits and mapping table"""
+        self.fitter, self.table, self.version = self._load()
+
+    async def reload_async(self):
+        """reload() for the serving loops: the load, and any refit, runs on a worker
+        thread so other clients are still answered, and the result is swapped in on
+        the event loop between requests"""
+        async with self._reload_lock:
+            loaded = await asyncio.get_running_loop().run_in_executor(None, self._load)
+            self.fitter, self.table, self.version = loaded
+
+    def _version(self):
+        return self.db.ideal_version(), self.db.model_version()
+
+    def reload_if_changed(self):
+        """Reload when the ideal catalog or the fit model was replaced since the last load;
+        returns True if so"""
+        if self._version() == self.version:
+            return False
+        self.reload()
+        return True
+
+    def map(self, points):
+        """Map a list of [x, y] pairs; returns the ideal function name and deviation per point"""
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        result = self.fitter.map_points(pd.DataFrame({'X': points[:, 0], 'Y': points[:, 1]}),
+                                        self.table)
+        delta = result['Delta Y'].to_numpy()
+        return {
+            'ideal': [name if isinstance(name, str) else None
+                      for name in result['No. of ideal func'].tolist()],
+            'delta': [None if math.isnan(d) else d for d in delta.tolist()],
+        }
+
+    def _answer(self, request):
+        if 'points' in request:
+            return self.map(request['points'])
+        if request.get('cmd') == 'ping':
+            return {'ok': True}
+        if request.get('cmd') == 'fits':
+            return {'fits': self.fitter.best_fits}
+        if request.get('cmd') == 'reload':
+            self.reload()
+            return {'ok': True}
+        return {'error': f"Unknown request: {sorted(request)}"}
+
+    @staticmethod
+    def _error(request, e):
+        """Error reply for a request that raised; the service itself keeps running"""
+        if isinstance(e, (ValueError, TypeError, KeyError)):
+            return {'error': str(e)}
+        # Database or file trouble, e.g. a table dropped by another process
+        print(f"Request {request} failed: {type(e).__name__}: {e}", file=sys.stderr)
+        return {'error': f"{type(e).__name__}: {e}"}
+
+    def handle(self, request):
+        """Answer one decoded request; errors are reported in the reply, never raised"""
+        try:
+            reply = self._answer(request)
+        except Exception as e:
+            reply = self._error(request, e)
+        if 'id' in request:
+            reply['id'] = request['id']
+        return reply
+
+    async def handle_async(self, request):
+        """handle() for the serving loops, with reload running off the event loop"""
+        if request.get('cmd') != 'reload':
+            return self.handle(request)
+        try:
+            await self.reload_async()
+            reply = {'ok': True}
+        except Exception as e:
+            reply = self._error(request, e)
+        if 'id' in request:
+            reply['id'] = request['id']
+        return reply
+
+    @staticmethod
+    def _decode(line):
+        """Return (request, None), or (None, error reply) for a malformed line"""
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            return None, {'error': f"Invalid JSON: {e}"}
+        if not isinstance(request, dict):
+            return None, {'error': "Request must be a JSON object"}
+        return request, None
+
+    def handle_line(self, line):
+        request, error = self._decode(line)
+        return json.dumps(error or self.handle(request))
+
+    async def handle_line_async(self, line):
+        request, error = self._decode(line)
+        return json.dumps(error or await self.handle_async(request))
+
+    async def watch(self):
+        """Poll the ideal catalog and model versions and hot-reload between requests"""
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                if self._version() != self.version:
+                    await self.reload_async()
+                    print("Ideal table changed; fits reloaded", file=sys.stderr)
+            except Exception as e:
+                # A load in progress elsewhere; keep serving the old table and retry later
+                print(f"Reload failed: {e}", file=sys.stderr)
+
+    async def serve_client(self, reader, writer):
+        try:
+            while line := await reader.readline():
+                if line.strip():
+                    writer.write((await self.handle_line_async(line)).encode() + b'\n')
+                    await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve_socket(self, path):
+        if os.path.exists(path):
+            os.remove(path)
+        server = await asyncio.start_unix_server(self.serve_client, path=path)
+        print(f"Mapping service listening on {path}", file=sys.stderr)
+        async with server:
+            await asyncio.gather(server.serve_forever(), self.watch())
+
+    async def serve_stdio(self):
+        loop = asyncio.get_running_loop()
+        watcher = asyncio.ensure_future(self.watch())
+        try:
+            while line := await loop.run_in_executor(None, sys.stdin.readline):
+                if line.strip():
+                    sys.stdout.write(await self.handle_line_async(line) + '\n')
+                    sys.stdout.flush()
+        finally:
+            watcher.cancel()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve ideal-function mapping over JSON lines")
+    parser.add_argument('--db', default='sqlite:///assignment.db')
+    parser.add_argument('--layout', choices=['wide', 'long'], default='wide')
+    parser.add_argument('--compact', action='store_true', help="float32 ideal catalog")
+    parser.add_argument('--socket', help="Unix socket path (default: stdin/stdout)")
+    parser.add_argument('--poll', type=float, default=2.0,
+                        help="seconds between checks for a reloaded ideal table")
+    args = parser.parse_args(argv)
+
+    service = MappingService(DatabaseManager(args.db, args.layout, args.compact), args.poll)
+    try:
+        asyncio.run(service.serve_socket(args.socket) if args.socket else service.serve_stdio())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""
+Backfill of the mapping_summary table for databases whose test results were
+written before the table existed.
+
+Only a DB-API connection is needed, so DatabaseManager and the sqlite3-only
+report tools share it without importing pandas or SQLAlchemy.
+"""
+
+CREATE = ('CREATE TABLE mapping_summary ("Ideal func" TEXT, "Train func" TEXT, Points INTEGER, '
+          '"Sum Delta" REAL, "Min Delta" REAL, "Max Delta" REAL)')
+
+# Same rows DatabaseManager._update_summary keeps: every ideal function with
+# points or a best fit, and a NULL row counting the unmapped points
+FILL = """
+    INSERT INTO mapping_summary
+    WITH points AS (
+        SELECT "No. of ideal func" AS name, COUNT(*) AS n, SUM("Delta Y") AS total,
+               MIN("Delta Y") AS low, MAX("Delta Y") AS high
+        FROM test_results GROUP BY "No. of ideal func"
+    ), fits AS (
+        SELECT ideal_func, group_concat(train_func, ', ') AS train
+        FROM ({best_fits}) GROUP BY ideal_func
+    ), names AS (
+        SELECT name FROM points UNION SELECT ideal_func FROM fits UNION SELECT NULL
+    )
+    SELECT names.name, fits.train, COALESCE(points.n, 0),
+           CASE WHEN names.name IS NOT NULL THEN points.total END,
+           CASE WHEN names.name IS NOT NULL THEN points.low END,
+           CASE WHEN names.name IS NOT NULL THEN points.high END
+    FROM names
+    LEFT JOIN points ON points.name IS names.name
+    LEFT JOIN fits ON fits.ideal_func = names.name
+"""
+
+
+def _tables(cursor):
+    return {row[0] for row in cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+
+def ensure_summary(conn):
+    """Build mapping_summary from test_results with one GROUP BY when it is missing.
+
+    conn is a DB-API connection to a SQLite database. Returns True when the
+    table was created; databases without mapped results are left alone.
+    """
+    cursor = conn.cursor()
+    try:
+        tables = _tables(cursor)
+        if 'mapping_summary' in tables or 'test_results' not in tables:
+            return False
+        columns = {row[1] for row in cursor.execute('PRAGMA table_info(test_results)')}
+        if not {'Delta Y', 'No. of ideal func'} <= columns:
+            return False
+        best_fits = ('SELECT ideal_func, train_func FROM best_fits ORDER BY position'
+                     if 'best_fits' in tables else
+                     'SELECT NULL AS ideal_func, NULL AS train_func WHERE 0')
+        # Another process may be backfilling too; only the first one builds the table
+        cursor.execute('BEGIN IMMEDIATE')
+        if 'mapping_summary' in _tables(cursor):
+            conn.rollback()
+            return False
+        cursor.execute(CREATE)
+        cursor.execute(FILL.format(best_fits=best_fits))
+        conn.commit()
+        return True
+    finally:
+        cursor.close()
@@ -1,49 +1,214 @@
 from bokeh.plotting import figure, output_file, save
 from bokeh.layouts import column
-from bokeh.models import HoverTool
+from bokeh.models import HoverTool, LogColorMapper
+from bokeh.palettes import Greens256, Reds256
+import numpy as np
 import pandas as pd
+import metrics
+
+WIDTH, HEIGHT = 800, 400
+
+
+def _finite(x, y):
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    keep = np.isfinite(x) & np.isfinite(y)
+    return x[keep], y[keep]
+
+
+def _cells(values, count):
+    """Equal-width bin number (0..count-1) of every value"""
+    low, span = values.min(), values.max() - values.min()
+    if span == 0:
+        return np.zeros(len(values), dtype=np.int64)
+    return np.minimum(((values - low) / span * count).astype(np.int64), count - 1)
+
+
+def minmax_downsample(x, y, budget):
+    """Reduce a series to at most budget points, keeping its envelope.
+
+    X is split into budget // 2 equal-width buckets and the lowest and highest Y
+    of each bucket are kept, in their original order, so peaks and troughs
+    survive at any zoom level down to one bucket per pixel column.
+    """
+    x, y = _finite(x, y)
+    if len(x) <= budget:
+        return x, y
+    buckets = _cells(x, max(1, budget // 2))
+    order = np.lexsort((y, buckets))
+    sorted_buckets = buckets[order]
+    starts = np.flatnonzero(np.r_[True, sorted_buckets[1:] != sorted_buckets[:-1]])
+    ends = np.r_[starts[1:], len(order)] - 1
+    keep = np.unique(np.r_[order[starts], order[ends]])
+    return x[keep], y[keep]
+
+
+def thin_scatter(x, y, budget, width=WIDTH, height=HEIGHT, seed=0):
+    """Reduce a scatter to at most budget points, one per occupied pixel cell.
+
+    Points sharing a screen pixel are indistinguishable, so only the first of
+    each is kept; if more cells are occupied than the budget allows, a
+    reproducible random subset of them is drawn.
+    """
+    x, y = _finite(x, y)
+    if len(x) <= budget:
+        return x, y
+    cells = _cells(x, width) * height + _cells(y, height)
+    _, keep = np.unique(cells, return_index=True)
+    if len(keep) > budget:
+        keep = np.sort(np.random.default_rng(seed).choice(keep, budget, replace=False))
+    return x[keep], y[keep]
+
+
+def density_grids(engine, bins, chunksize=500_000):
+    """Count test_results points per cell of a bins x bins grid, mapped and unmapped apart.
+
+    The table is read in chunks of X, Y and a mapped flag only, so memory stays
+    bounded whatever the number of test points. Returns (mapped, unmapped,
+    (x_min, x_max, y_min, y_max)), or None when there are no finite points.
+    """
+    # Raw DB-API cursor: SQLAlchemy row objects cost more to convert than the binning itself
+    conn = engine.raw_connection()
+    try:
+        cur = conn.cursor()
+        bounds = cur.execute('SELECT MIN(X), MAX(X), MIN(Y), MAX(Y) FROM test_results').fetchone()
+        if bounds[0] is None or bounds[2] is None:
+            return None
+        cur.execute('SELECT X, Y, "No. of ideal func" IS NOT NULL FROM test_results')
+        chunks = (np.array(rows, dtype=float) for rows in iter(lambda: cur.fetchmany(chunksize), []))
+        return _bin_points(chunks, bounds, bins)
+    finally:
+        conn.close()
+
+
+def frame_density_grids(test, bins):
+    """density_grids for a test_results frame that is already in memory"""
+    chunk = np.column_stack([test['X'].to_numpy(dtype=float), test['Y'].to_numpy(dtype=float),
+                             test['No. of ideal func'].notna().to_numpy(dtype=float)])
+    if not len(chunk) or np.isnan(chunk[:, 0]).all() or np.isnan(chunk[:, 1]).all():
+        return None
+    bounds = (np.nanmin(chunk[:, 0]), np.nanmax(chunk[:, 0]), np.nanmin(chunk[:, 1]), np.nanmax(chunk[:, 1]))
+    return _bin_points([chunk], bounds, bins)
+
+
+def _bin_points(chunks, bounds, bins):
+    """Histogram (X, Y, mapped flag) row chunks into mapped and unmapped grids"""
+    x_min, x_max, y_min, y_max = bounds
+    # Pad degenerate ranges so histogram2d still gets increasing edges
+    if x_max == x_min:
+        x_min, x_max = x_min - 0.5, x_max + 0.5
+    if y_max == y_min:
+        y_min, y_max = y_min - 0.5, y_max + 0.5
+    edges = (np.linspace(x_min, x_max, bins + 1), np.linspace(y_min, y_max, bins + 1))
+    mapped = np.zeros((bins, bins))
+    unmapped = np.zeros((bins, bins))
+    for chunk in chunks:
+        is_mapped = chunk[:, 2] > 0
+        mapped += np.histogram2d(chunk[is_mapped, 0], chunk[is_mapped, 1], edges)[0]
+        unmapped += np.histogram2d(chunk[~is_mapped, 0], chunk[~is_mapped, 1], edges)[0]
+    return mapped, unmapped, (x_min, x_max, y_min, y_max)
+
 
 class Visualizer:
-    def __init__(self, db_engine):
+    def __init__(self, db_engine, frames=None):
         self.engine = db_engine
+        # Tables handed over in memory (DatabaseManager.frames); the rest are read from SQLite
+        self.frames = frames or {}
+
+    def _table(self, name):
+        if name in self.frames:
+            return self.frames[name]
+        return pd.read_sql(name, self.engine)
 
-    def plot_all(self):
+    def plot_all(self, max_points=None, density_bins=None):
+        """Plot training data and mapped test points into visualization.html.
+
+        With max_points set, every series is downsampled so each figure embeds at
+        most that many points, and the figures render through WebGL. With
+        density_bins set, the test points are drawn as mapped/unmapped density
+        images of that resolution instead of markers.
+        """
         output_file("visualization.html")
         
-        train = pd.read_sql('training', self.engine)
-        ideal = pd.read_sql('ideal', self.engine)
-        test = pd.read_sql('test_results', self.engine)
+        with metrics.stage('read_tables') as timing:
+            train = self._table('training')
+            test = None if density_bins else self._table('test_results')
+            timing['rows'] = len(train) + (0 if test is None else len(test))
 
+        backend = 'webgl' if max_points else 'canvas'
         p1 = figure(title="Training Data with Best Ideal Functions", 
-                   width=800, height=400,
+                   width=WIDTH, height=HEIGHT, output_backend=backend,
                    x_axis_label='X', y_axis_label='Y')
         
         colors = ['blue', 'red', 'green', 'orange']
-        for i in range(1, 5):
-            p1.circle(train['X'], train[f'Y{i}'], 
+        with metrics.stage('downsample', rows=timing.get('rows')):
+            series = []
+            for i in range(1, 5):
+                x, y = train['X'], train[f'Y{i}']
+                if max_points:
+                    x, y = minmax_downsample(x, y, max(2, max_points // 4))
+                series.append((i, x, y))
+
+            points = []
+            if test is not None:
+                mapped = test[test['No. of ideal func'].notna()]
+                unmapped = test[test['No. of ideal func'].isna()]
+                for part in (mapped, unmapped):
+                    x, y = part['X'], part['Y']
+                    if max_points:
+                        # Split the budget in proportion so the mapped share stays visible
+                        x, y = thin_scatter(x, y, max(1, max_points * len(part) // max(1, len(test))))
+                    points.append((x, y))
+
+        for i, x, y in series:
+            p1.circle(x, y, 
                      legend_label=f'Train Y{i}', 
                      color=colors[i-1], size=5, alpha=0.6)
 
         p2 = figure(title="Test Points Mapping", 
-                   width=800, height=400,
+                   width=WIDTH, height=HEIGHT, output_backend=backend,
                    x_axis_label='X', y_axis_label='Y')
         
-        mapped = test[test['No. of ideal func'].notna()]
-        unmapped = test[test['No. of ideal func'].isna()]
-        
-        if not mapped.empty:
-            p2.circle(mapped['X'], mapped['Y'], 
-                     size=6, color='green', legend_label='Mapped', alpha=0.7)
-        
-        if not unmapped.empty:
-            p2.circle(unmapped['X'], unmapped['Y'], 
-                     size=6, color='red', legend_label='Unmapped', alpha=0.7)
+        if density_bins:
+            self._plot_density(p2, density_bins)
+            hover2 = HoverTool(tooltips=[("X", "$x"), ("Y", "$y"), ("Points", "@image")])
+        else:
+            (mapped_x, mapped_y), (unmapped_x, unmapped_y) = points
+            
+            if len(mapped_x):
+                p2.circle(mapped_x, mapped_y, 
+                         size=6, color='green', legend_label='Mapped', alpha=0.7)
+            
+            if len(unmapped_x):
+                p2.circle(unmapped_x, unmapped_y, 
+                         size=6, color='red', legend_label='Unmapped', alpha=0.7)
+            hover2 = HoverTool(tooltips=[("X", "@x"), ("Y", "@y")])
 
         hover1 = HoverTool(tooltips=[("X", "@x"), ("Y", "@y")])
-        hover2 = HoverTool(tooltips=[("X", "@x"), ("Y", "@y")])
         p1.add_tools(hover1)
         p2.add_tools(hover2)
 
         layout = column(p1, p2)
-        save(layout)
+        with metrics.stage('render', rows=timing.get('rows')):
+            save(layout)
         print("Visualization saved to visualization.html")
+
+    def _plot_density(self, fig, bins):
+        """Add mapped (green) and unmapped (red) test point densities as image glyphs"""
+        with metrics.stage('density'):
+            if 'test_results' in self.frames:
+                grids = frame_density_grids(self.frames['test_results'], bins)
+            else:
+                grids = density_grids(self.engine, bins)
+        if grids is None:
+            return
+        mapped, unmapped, (x_min, x_max, y_min, y_max) = grids
+        for counts, palette, label in ((unmapped, Reds256, 'Unmapped'), (mapped, Greens256, 'Mapped')):
+            if not counts.any():
+                continue
+            # Empty cells are NaN so they stay transparent; the log scale keeps sparse cells visible
+            image = np.where(counts > 0, counts, np.nan).T
+            mapper = LogColorMapper(palette=palette[::-1][64:], low=1, high=counts.max(),
+                                    nan_color=(0, 0, 0, 0))
+            fig.image(image=[image], x=x_min, y=y_min, dw=x_max - x_min, dh=y_max - y_min,
+                      color_mapper=mapper, alpha=0.8, legend_label=label)
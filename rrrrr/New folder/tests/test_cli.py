@@ -0,0 +1,52 @@
+import pytest
+import subprocess
+import sys
+import os
+
+SRC = os.path.join(os.path.dirname(__file__), '..', 'src')
+DATA = os.path.join(os.path.dirname(__file__), '..', 'data')
+sys.path.insert(0, SRC)
+
+import cli
+
+
+class TestCli:
+    '''Test the subcommand CLI'''
+
+    def test_pipeline_subcommands(self, tmp_path, capsys):
+        '''Test load, fit, map and report reproduce the main.py results'''
+        db = ['--db', f"sqlite:///{tmp_path / 'cli.db'}"]
+        cli.main(db + ['load', '--train', os.path.join(DATA, 'train.csv'),
+                       '--ideal', os.path.join(DATA, 'ideal.csv')])
+        cli.main(db + ['fit'])
+        cli.main(db + ['map', os.path.join(DATA, 'test.csv')])
+        capsys.readouterr()
+
+        cli.main(db + ['report'])
+        out = capsys.readouterr().out
+        for line in ['Y1 -> Y42', 'Y2 -> Y41', 'Y3 -> Y11', 'Y4 -> Y48',
+                     'Total test points: 100', 'Mapped points: 48']:
+            assert line in out
+
+        cli.main(db + ['map', '--point', '0.0', '1e6'])
+        assert capsys.readouterr().out.strip() == '(0.0, 1000000.0) -> unmapped'
+        with pytest.raises(SystemExit):
+            cli.parse_args(db + ['fit', '--top-k', '0'])
+    
+    def test_report_imports_no_heavy_modules(self, tmp_path):
+        '''Test report runs on sqlite3 alone, without pandas, SQLAlchemy or Bokeh'''
+        url = f"sqlite:///{tmp_path / 'cli.db'}"
+        cli.main(['--db', url, 'load', '--train', os.path.join(DATA, 'train.csv'),
+                  '--ideal', os.path.join(DATA, 'ideal.csv')])
+        cli.main(['--db', url, 'fit'])
+
+        check = (f"import sys, cli; cli.main(['--db', {url!r}, 'report']); "
+                 "print(sorted(m for m in ('pandas', 'sqlalchemy', 'bokeh', 'numpy') if m in sys.modules))")
+        out = subprocess.run([sys.executable, '-c', check], cwd=tmp_path, capture_output=True,
+                             text=True, env={**os.environ, 'PYTHONPATH': os.path.abspath(SRC)})
+        assert 'Y1 -> Y42' in out.stdout
+        assert out.stdout.strip().splitlines()[-1] == '[]'
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
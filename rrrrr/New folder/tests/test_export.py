@@ -0,0 +1,110 @@
+import pytest
+import pandas as pd
+import numpy as np
+import sys
+import os
+import sqlite3
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from database import DatabaseManager
+from export_db import FORMATS, export_all, export_table
+
+
+def _read(path, fmt):
+    if fmt == 'parquet':
+        return pd.read_parquet(path)
+    return pd.read_csv(path)
+
+
+def _results():
+    '''Test results whose first rows are all unmapped'''
+    rng = np.random.default_rng(3)
+    x = rng.uniform(0, 10, 60)
+    functions = [None] * 20 + list(rng.choice(['Y7', 'Y9', 'Y12'], 30)) + [None] * 10
+    return pd.DataFrame({
+        'X': x,
+        'Y': x + rng.uniform(-0.3, 0.3, 60),
+        'Delta Y': [None if f is None else d for f, d in zip(functions, rng.uniform(0, 0.3, 60))],
+        'No. of ideal func': functions,
+    })
+
+
+class TestExport:
+    '''Test the chunked table export'''
+
+    @pytest.mark.parametrize('fmt', list(FORMATS))
+    @pytest.mark.parametrize('stored', [True, False])
+    def test_round_trip(self, tmp_path, fmt, stored):
+        '''Test every table, the mapped subset and the summary survive an export'''
+        if fmt == 'parquet':
+            pytest.importorskip('pyarrow')
+        db_file = tmp_path / 'export.db'
+        db = DatabaseManager(f"sqlite:///{db_file}")
+        x = np.arange(10.0)
+        training = pd.DataFrame({'X': x, 'Y1': x * 2})
+        ideal = pd.DataFrame({'X': x, 'Y1': x, 'Y2': -x})
+        training.to_sql('training', db.engine, if_exists='replace', index=False)
+        ideal.to_sql('ideal', db.engine, if_exists='replace', index=False)
+        results = _results()
+        if stored:
+            db.save_results(results)
+        else:
+            # A database from before mapping_summary existed
+            results.to_sql('test_results', db.engine, if_exists='replace', index=False)
+        db.engine.dispose()
+
+        out = tmp_path / 'out'
+        export_all(str(db_file), str(out), fmt, chunksize=15)
+        path = lambda name: out / f'export_{name}{FORMATS[fmt]}'
+
+        pd.testing.assert_frame_equal(_read(path('training'), fmt), training)
+        pd.testing.assert_frame_equal(_read(path('ideal'), fmt), ideal)
+        exported = _read(path('test_results'), fmt)
+        assert exported['No. of ideal func'].isna().sum() == 30
+        np.testing.assert_allclose(exported[['X', 'Y']], results[['X', 'Y']])
+        np.testing.assert_allclose(exported['Delta Y'], results['Delta Y'].astype(float))
+        mapped = _read(path('mapped_points'), fmt)
+        hits = results[results['No. of ideal func'].notna()]
+        assert mapped['No. of ideal func'].tolist() == hits['No. of ideal func'].tolist()
+        np.testing.assert_allclose(mapped['Delta Y'], hits['Delta Y'].astype(float))
+
+        summary = _read(path('summary'), fmt).set_index('Ideal_Function')
+        expected = hits.astype({'Delta Y': float}).groupby('No. of ideal func')['Delta Y']
+        assert summary['Mapped_Points'].to_dict() == expected.count().to_dict()
+        np.testing.assert_allclose(summary['Avg_Deviation'], expected.mean()[summary.index].round(4))
+        np.testing.assert_allclose(summary['Max_Deviation'], expected.max()[summary.index].round(4))
+        assert list(summary['Mapped_Points']) == sorted(summary['Mapped_Points'], reverse=True)
+    
+    def test_empty_table_keeps_header(self, tmp_path):
+        '''Test an empty table still exports its columns'''
+        db_file = tmp_path / 'empty.db'
+        db = DatabaseManager(f"sqlite:///{db_file}")
+        pd.DataFrame({'X': [1.0], 'Y1': [2.0]}).iloc[:0].to_sql('training', db.engine, if_exists='replace', index=False)
+        db.engine.dispose()
+        export_all(str(db_file), str(tmp_path), 'csv')
+        assert list(pd.read_csv(tmp_path / 'export_training.csv').columns) == ['X', 'Y1']
+        columns = list(pd.read_csv(tmp_path / 'export_test_results.csv').columns)
+        assert 'X' in columns
+        assert list(pd.read_csv(tmp_path / 'export_mapped_points.csv').columns) == columns
+        assert pd.read_csv(tmp_path / 'export_summary.csv').empty
+    
+    def test_untyped_columns_keep_their_values(self, tmp_path):
+        '''Test Parquet columns declared without a type take the type of their data'''
+        pytest.importorskip('pyarrow')
+        db_file = tmp_path / 'untyped.db'
+        with sqlite3.connect(db_file) as conn:
+            conn.execute('CREATE TABLE extra (X, label, empty)')
+            conn.executemany('INSERT INTO extra VALUES (?, ?, ?)', [(1.5, 'a', None), (2.5, 'b', None)])
+        conn.close()
+        out = tmp_path / 'extra.parquet'
+        assert export_table(str(db_file), 'extra', str(out), 'parquet', chunksize=1) == 2
+        exported = pd.read_parquet(out)
+        assert exported['X'].tolist() == [1.5, 2.5]
+        assert exported['label'].tolist() == ['a', 'b']
+        assert exported['empty'].dtype == float
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
@@ -3,11 +3,16 @@ import pandas as pd
 import numpy as np
 import sys
 import os
+import sqlite3
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
 
 from database import DatabaseManager
-from fitting import FunctionFitter
+import cache
+import database
+import fitting
+from fitting import METRICS, FunctionFitter, best_in_block, best_pruned
+from cache import IdealTable
 
 
 class TestDatabaseManager:
@@ -18,6 +23,160 @@ class TestDatabaseManager:
         db = DatabaseManager('sqlite:///:memory:')
         assert db.engine is not None
         assert db.Session is not None
+    
+    def test_ideal_cache_invalidated_by_load_ideal(self, tmp_path, monkeypatch):
+        '''Test the ideal array cache is memory-mapped and rebuilt on reload'''
+        db = DatabaseManager(f"sqlite:///{tmp_path / 'cache.db'}")
+        ideal_file = tmp_path / 'ideal.csv'
+
+        pd.DataFrame({'x': [1.0, 2.0], 'y1': [1.0, 2.0]}).to_csv(ideal_file, index=False)
+        db.load_ideal(str(ideal_file))
+        table = db.ideal_table()
+        assert isinstance(table.values, np.memmap)
+        assert table.columns == ['X', 'Y1']
+        assert os.path.exists(tmp_path / 'cache.ideal.npy')
+        assert sorted(os.listdir(tmp_path)) == ['cache.db', 'cache.ideal.npy', 'cache.ideal.npy.json',
+                                                'ideal.csv']
+
+        # A load that fails after parsing leaves no staging file behind
+        def disk_full(*args):
+            raise OSError("disk full")
+        with monkeypatch.context() as patch:
+            patch.setattr(db, '_write_table', disk_full)
+            with pytest.raises(OSError):
+                db.load_ideal(str(ideal_file))
+        assert sorted(os.listdir(tmp_path)) == ['cache.db', 'cache.ideal.npy', 'cache.ideal.npy.json',
+                                                'ideal.csv']
+
+        pd.DataFrame({'x': [1.0, 2.0], 'y1': [5.0, 6.0]}).to_csv(ideal_file, index=False)
+        db.load_ideal(str(ideal_file))
+        assert list(db.ideal_table().column('Y1')) == [5.0, 6.0]
+
+        # A fresh manager picks up the cache file instead of re-reading SQLite
+        reopened = DatabaseManager(f"sqlite:///{tmp_path / 'cache.db'}")
+        assert list(reopened.ideal_table().column('Y1')) == [5.0, 6.0]
+
+        # Writes that bypass load_ideal make the cache stale and get it rebuilt
+        pd.DataFrame({'X': [1.0, 2.0], 'Y1': [7.0, 8.0]}).to_sql('ideal', db.engine, if_exists='replace',
+                                                                 index=False)
+        assert list(DatabaseManager(f"sqlite:///{tmp_path / 'cache.db'}").ideal_table().column('Y1')) == [7.0, 8.0]
+        with db.engine.begin() as conn:
+            conn.exec_driver_sql('UPDATE ideal SET Y1 = 9.0 WHERE X = 2.0')
+        assert list(DatabaseManager(f"sqlite:///{tmp_path / 'cache.db'}").ideal_table().column('Y1')) == [7.0, 9.0]
+        stamp = db.ideal_version()
+        assert list(DatabaseManager(f"sqlite:///{tmp_path / 'cache.db'}").ideal_table().column('Y1')) == [7.0, 9.0]
+        assert db.ideal_version() == stamp
+    
+    def test_concurrent_cache_writers(self, tmp_path):
+        '''Test writers building the same ideal cache at once each stage their own file'''
+        from concurrent.futures import ThreadPoolExecutor
+        path = str(tmp_path / 'shared.ideal.npy')
+        values = np.arange(200_000.0).reshape(-1, 4)
+        table = IdealTable(['X', 'Y1', 'Y2', 'Y3'], values)
+        with ThreadPoolExecutor(8) as pool:
+            assert all(pool.map(lambda _: cache.save(path, table), range(16)))
+        assert np.array_equal(cache.load(path).values, values)
+        assert sorted(os.listdir(tmp_path)) == ['shared.ideal.npy', 'shared.ideal.npy.json']
+    
+    def test_long_layout_digest_tracks_contents(self):
+        '''Test the long-layout digest changes with any stored value, not just the row count'''
+        db = DatabaseManager('sqlite:///:memory:', 'long')
+        x = np.arange(5.0)
+        db._write_long(pd.DataFrame({'X': x, 'Y1': x, 'Y2': -x}))
+        first = db.ideal_digest()
+        assert db.ideal_digest() == first
+
+        # Same shape, so the reloaded rows get the same ids
+        db._write_long(pd.DataFrame({'X': x, 'Y1': x, 'Y2': x}))
+        assert db.ideal_digest() != first
+        db._write_long(pd.DataFrame({'X': x, 'Y2': x, 'Y1': -x}))
+        assert db.ideal_digest() != first
+        db._write_long(pd.DataFrame({'X': x, 'Y1': x, 'Y2': -x}))
+        assert db.ideal_digest() == first
+    
+    def test_bulk_load_matches_to_sql(self, tmp_path):
+        '''Test the bulk loader stores the same rows and restores the pragmas'''
+        db = DatabaseManager(f"sqlite:///{tmp_path / 'bulk.db'}")
+        train_file = tmp_path / 'train.csv'
+        pd.DataFrame({
+            'x': [1.0, 2.0, 3.0],
+            'y1': [0.5, np.nan, 1.5],
+            'y2': [2.0, 3.0, 4.0]
+        }).to_csv(train_file, index=False)
+
+        db.load_training(str(train_file), bulk=True, workers=2)
+
+        stored = pd.read_sql('training', db.engine)
+        assert list(stored.columns) == ['X', 'Y1', 'Y2']
+        assert stored['Y2'].tolist() == [2.0, 3.0, 4.0]
+        assert stored['Y1'].isna().tolist() == [False, True, False]
+        with db.engine.connect() as conn:
+            assert conn.exec_driver_sql('PRAGMA synchronous').scalar() == 2
+    
+    def test_mapping_summary_maintained_on_write(self):
+        '''Test mapping_summary matches a full aggregation after replace and append writes'''
+        db = DatabaseManager('sqlite:///:memory:')
+        db.save_model([{'train_func': 'Y1', 'ideal_func': 'Y7', 'ssd': 1.0, 'max_dev': 0.5, 'threshold': 0.7},
+                       {'train_func': 'Y2', 'ideal_func': 'Y9', 'ssd': 2.0, 'max_dev': 0.5, 'threshold': 0.7},
+                       {'train_func': 'Y3', 'ideal_func': 'Y7', 'ssd': 3.0, 'max_dev': 0.5, 'threshold': 0.7}])
+        rng = np.random.default_rng(0)
+        results = pd.DataFrame({'X': rng.random(300), 'Y': rng.random(300),
+                                'Delta Y': rng.random(300),
+                                'No. of ideal func': rng.choice(['Y7', 'Y5', None], 300)})
+        results.loc[results['No. of ideal func'].isna(), 'Delta Y'] = np.nan
+
+        db.save_results(results.iloc[:50])
+        for start in range(0, 300, 100):
+            db.append_results(results.iloc[start:start + 100], replace=start == 0)
+
+        summary = db.mapping_summary().set_index('Ideal func', drop=False)
+        expected = results.groupby('No. of ideal func')['Delta Y'].agg(['size', 'sum', 'min', 'max'])
+        for name, row in expected.iterrows():
+            assert summary.loc[name, 'Points'] == row['size']
+            assert summary.loc[name, 'Sum Delta'] == pytest.approx(row['sum'])
+            assert summary.loc[name, 'Min Delta'] == row['min']
+            assert summary.loc[name, 'Max Delta'] == row['max']
+        assert summary.loc['Y7', 'Train func'] == 'Y1, Y3'
+        assert pd.isna(summary.loc['Y5', 'Train func'])
+        assert summary.loc['Y9', 'Points'] == 0
+        assert summary.loc[summary['Ideal func'].isna(), 'Points'].item() == results['No. of ideal func'].isna().sum()
+    
+    def test_mapping_summary_backfilled_for_older_databases(self, tmp_path):
+        '''Test a database with results but no mapping_summary gets the same summary on open'''
+        db = DatabaseManager(f"sqlite:///{tmp_path / 'old.db'}")
+        db.save_model([{'train_func': 'Y1', 'ideal_func': 'Y7', 'ssd': 1.0, 'max_dev': 0.5, 'threshold': 0.7},
+                       {'train_func': 'Y2', 'ideal_func': 'Y9', 'ssd': 2.0, 'max_dev': 0.5, 'threshold': 0.7},
+                       {'train_func': 'Y3', 'ideal_func': 'Y7', 'ssd': 3.0, 'max_dev': 0.5, 'threshold': 0.7}])
+        rng = np.random.default_rng(1)
+        results = pd.DataFrame({'X': rng.random(200), 'Y': rng.random(200),
+                                'Delta Y': rng.random(200),
+                                'No. of ideal func': rng.choice(['Y7', 'Y5', None], 200)})
+        results.loc[results['No. of ideal func'].isna(), 'Delta Y'] = np.nan
+        db.save_results(results)
+        maintained = db.mapping_summary()
+        with db.engine.begin() as conn:
+            conn.exec_driver_sql('DROP TABLE mapping_summary')
+        db.engine.dispose()
+
+        backfilled = DatabaseManager(f"sqlite:///{tmp_path / 'old.db'}").mapping_summary()
+        order = lambda df: df.sort_values('Ideal func', na_position='first', ignore_index=True)
+        pd.testing.assert_frame_equal(order(backfilled), order(maintained))
+    
+    def test_current_schema_opens_without_ddl(self, tmp_path, monkeypatch):
+        '''Test reopening a current database skips create_all and the column inspection'''
+        url = f"sqlite:///{tmp_path / 'schema.db'}"
+        DatabaseManager(url).engine.dispose()
+        with monkeypatch.context() as patch:
+            patch.setattr(database.Base.metadata, 'create_all', lambda *args: pytest.fail("create_all"))
+            patch.setattr(DatabaseManager, '_add_missing_columns', lambda *args: pytest.fail("inspected"))
+            DatabaseManager(url).engine.dispose()
+
+        # A best_fits table from before a column existed is still migrated
+        with sqlite3.connect(tmp_path / 'schema.db') as conn:
+            conn.execute('ALTER TABLE best_fits DROP COLUMN fit_key')
+        db = DatabaseManager(url)
+        with db.engine.connect() as conn:
+            assert 'fit_key' in [row[1] for row in conn.exec_driver_sql('PRAGMA table_info(best_fits)')]
 
 
 class TestFunctionFitter:
@@ -47,6 +206,352 @@ class TestFunctionFitter:
         assert best['Y1']['col'] == 'Y1'
         assert best['Y1']['ssd'] < 0.01
     
+    @pytest.mark.parametrize('method', ['matrix', 'prune'])
+    def test_ideal_table_without_functions(self, method):
+        '''Test an ideal table with only X raises DataLoadError instead of an IndexError'''
+        db = DatabaseManager('sqlite:///:memory:')
+        pd.DataFrame({'X': [1.0, 2.0], 'Y1': [1.0, 2.0]}).to_sql('training', db.engine, if_exists='replace',
+                                                                 index=False)
+        pd.DataFrame({'X': [1.0, 2.0]}).to_sql('ideal', db.engine, if_exists='replace', index=False)
+        with pytest.raises(fitting.DataLoadError, match='no Y columns'):
+            FunctionFitter(db).select_best_ideals(method=method, use_cache=False)
+        with pytest.raises(fitting.DataLoadError, match='no Y columns'):
+            FunctionFitter(db).compare_criteria()
+    
+    def test_select_best_ideals_matches_pairwise_loop(self):
+        '''Test the matrix engine picks the same fits as a pairwise SSD loop'''
+        db = DatabaseManager('sqlite:///:memory:')
+        rng = np.random.default_rng(0)
+
+        train = pd.DataFrame(rng.normal(size=(30, 4)).round(2),
+                             columns=['Y1', 'Y2', 'Y3', 'Y4'])
+        ideal = pd.DataFrame(rng.normal(size=(30, 20)).round(1),
+                             columns=[f'Y{i}' for i in range(1, 21)])
+        ideal['Y9'] = ideal['Y4']  # tie: the first column must win
+        train.insert(0, 'X', np.arange(30.0))
+        ideal.insert(0, 'X', np.arange(30.0))
+
+        train.to_sql('training', db.engine, if_exists='replace', index=False)
+        ideal.to_sql('ideal', db.engine, if_exists='replace', index=False)
+
+        best = FunctionFitter(db).select_best_ideals()
+
+        for train_col in ['Y1', 'Y2', 'Y3', 'Y4']:
+            ssds = {col: np.sum((train[train_col] - ideal[col]) ** 2)
+                    for col in ideal.columns[1:]}
+            expected = min(ssds, key=ssds.get)
+            assert best[train_col]['col'] == expected
+            assert best[train_col]['ssd'] == ssds[expected]
+            assert best[train_col]['max_dev'] == np.max(
+                np.abs(train[train_col] - ideal[expected]))
+
+    def test_select_best_ideals_parallel_matches_serial(self):
+        '''Test sharded fitting across worker processes gives the serial result'''
+        db = DatabaseManager('sqlite:///:memory:')
+        rng = np.random.default_rng(1)
+
+        train = pd.DataFrame(rng.normal(size=(25, 4)), columns=['Y1', 'Y2', 'Y3', 'Y4'])
+        ideal = pd.DataFrame(rng.normal(size=(25, 40)),
+                             columns=[f'Y{i}' for i in range(1, 41)])
+        train.insert(0, 'X', np.arange(25.0))
+        ideal.insert(0, 'X', np.arange(25.0))
+        train.to_sql('training', db.engine, if_exists='replace', index=False)
+        ideal.to_sql('ideal', db.engine, if_exists='replace', index=False)
+
+        serial = dict(FunctionFitter(db).select_best_ideals())
+        parallel = FunctionFitter(db).select_best_ideals(workers=3, use_cache=False)
+
+        assert parallel == serial
+
+    def test_pruned_search_matches_matrix_search(self):
+        '''Test the early-abandoning search returns the matrix search winners'''
+        rng = np.random.default_rng(2)
+        ideal = rng.normal(size=(60, 200)).round(1)
+        ideal[:, 150] = ideal[:, 40]  # tie: the first column must win
+        train = ideal[:, [40, 7, 199]] + rng.normal(size=(60, 3)) * 0.1
+        train[5, 1] = np.nan
+
+        assert best_pruned(train, ideal) == best_in_block(train, ideal)
+        assert best_pruned(train, ideal)[0][0][0] == 40
+        assert best_pruned(train, ideal, k=4) == best_in_block(train, ideal, k=4)
+    
+    def test_pruned_search_hand_checked(self):
+        '''Test the early-abandoning search against SSDs worked out by hand'''
+        train = np.array([[1.0], [2.0], [3.0]])
+        ideal = np.array([[0.0, 1.0, 1.0, 2.0, 1.0],
+                          [0.0, 2.0, 2.0, 3.0, 2.0],
+                          [0.0, 4.0, 3.0, 4.0, 3.0]])
+        # SSDs 14, 1, 0, 3, 0; the tie between columns 2 and 4 goes to the first
+        ranked = best_pruned(train, ideal, offset=10, k=3, block_rows=1)[0]
+        assert [(j, ssd) for j, ssd, _ in ranked] == [(12, 0.0), (14, 0.0), (11, 1.0)]
+        assert ranked[2][2] == {'ssd': 1.0, 'sad': 1.0, 'max_dev': 1.0}
+
+        # The row with a missing training value drops out: SSDs 10, 1, 0, 2, 0
+        train[1, 0] = np.nan
+        ranked = best_pruned(train, ideal, k=5)[0]
+        assert [(j, ssd) for j, ssd, _ in ranked] == [(2, 0.0), (4, 0.0), (1, 1.0), (3, 2.0), (0, 10.0)]
+
+    def test_top_k_rankings_persisted(self):
+        '''Test top-k selection ranks candidates and stores them in fit_rankings'''
+        db = DatabaseManager('sqlite:///:memory:')
+
+        train = pd.DataFrame({'X': [1.0, 2.0, 3.0], 'Y1': [1.0, 2.0, 3.0]})
+        ideal = pd.DataFrame({
+            'X': [1.0, 2.0, 3.0],
+            'Y1': [5.0, 5.0, 5.0],
+            'Y2': [1.0, 2.0, 3.5],
+            'Y3': [1.0, 2.0, 3.0],
+            'Y4': [0.0, 2.0, 3.0]
+        })
+        train.to_sql('training', db.engine, if_exists='replace', index=False)
+        ideal.to_sql('ideal', db.engine, if_exists='replace', index=False)
+
+        fitter = FunctionFitter(db)
+        best = fitter.select_best_ideals(k=3)
+
+        assert best['Y1'] == {'col': 'Y3', 'ssd': 0.0, 'sad': 0.0, 'max_dev': 0.0}
+        assert [entry['col'] for entry in fitter.rankings['Y1']] == ['Y3', 'Y2', 'Y4']
+        assert fitter.margins()['Y1'] == pytest.approx(0.25)
+        stored = pd.read_sql('fit_rankings', db.engine)
+        assert stored['Ideal func'].tolist() == ['Y3', 'Y2', 'Y4']
+        assert stored['Rank'].tolist() == [1, 2, 3]
+        assert fitter.select_best_ideals(k=3, method='prune', use_cache=False) == best
+        for k in (0, -1):
+            with pytest.raises(ValueError, match='k must be >= 1'):
+                fitter.select_best_ideals(k=k)
+    
+    def test_selection_criteria_from_one_pass(self):
+        '''Test every criterion ranks by its own metric and all metrics are persisted'''
+        db = DatabaseManager('sqlite:///:memory:')
+        rng = np.random.default_rng(4)
+        x = np.arange(50.0)
+        train = pd.DataFrame({'X': x, 'Y1': np.sin(x / 5), 'Y2': x / 25})
+        ideal = pd.DataFrame(rng.normal(size=(50, 30)) * 0.5, columns=[f'Y{i}' for i in range(1, 31)])
+        ideal['Y5'] = train['Y1'] + 0.3  # small SSD, large SAD
+        ideal['Y6'] = train['Y1'] + np.where(x == 10, 2.0, 0.05)  # one outlier: large max deviation
+        ideal['Y8'] = train['Y1'] + np.where(x < 4, 1.05, 0.0)  # few errors: smallest SAD
+        ideal['Y7'] = train['Y2'] + 0.1
+        ideal.insert(0, 'X', x)
+        train.to_sql('training', db.engine, if_exists='replace', index=False)
+        ideal.to_sql('ideal', db.engine, if_exists='replace', index=False)
+
+        fitter = FunctionFitter(db)
+        choices = fitter.compare_criteria(batch=7)
+        for criterion, picks in choices.items():
+            best = FunctionFitter(db).select_best_ideals(k=2, criterion=criterion)
+            assert {col: info['col'] for col, info in best.items()} == picks
+            for col, info in best.items():
+                dev = (train[col] - ideal[info['col']]).abs()
+                assert info['ssd'] == np.sum(dev ** 2)
+                assert info['sad'] == pytest.approx(dev.sum())
+                assert info['max_dev'] == dev.max()
+                scores = {name: METRICS[criterion][0]((train[col] - ideal[name]).abs().to_numpy())
+                          for name in ideal.columns[1:]}
+                assert info[criterion] == pytest.approx(min(scores.values()))
+        assert choices['ssd']['Y1'] == 'Y6' and choices['sad']['Y1'] == 'Y8'
+        assert choices['max_dev']['Y1'] == 'Y5'
+        assert set(choices) == {'ssd', 'sad', 'max_dev'}
+
+        stored = pd.read_sql('best_fits', db.engine)
+        assert stored['criterion'].tolist() == ['max_dev', 'max_dev']
+        assert stored['sad'].notna().all()
+        assert pd.read_sql('fit_rankings', db.engine).columns.tolist() == [
+            'Train func', 'Rank', 'Ideal func', 'SSD', 'SAD', 'Max Dev']
+        reloaded = FunctionFitter(db)
+        reloaded.load_model()
+        assert reloaded.criterion == 'max_dev' and reloaded.best_fits['Y1']['col'] == 'Y5'
+        with pytest.raises(ValueError):
+            fitter.select_best_ideals(criterion='sad', method='prune')
+        with pytest.raises(ValueError):
+            fitter.select_best_ideals(criterion='r2')
+
+    def test_update_fits_matches_full_refit(self):
+        '''Test incremental refits from running statistics match a full refit'''
+        db = DatabaseManager('sqlite:///:memory:')
+        rng = np.random.default_rng(3)
+
+        ideal = pd.DataFrame(rng.normal(size=(40, 12)),
+                             columns=[f'Y{i}' for i in range(1, 13)])
+        ideal.insert(0, 'X', np.arange(40.0))
+        ideal.to_sql('ideal', db.engine, if_exists='replace', index=False)
+        train = pd.DataFrame({'X': np.arange(40.0)})
+        for i, col in enumerate([3, 8, 11, 1], 1):
+            train[f'Y{i}'] = ideal[f'Y{col}'] + rng.normal(size=40) * 0.1
+
+        fitter = FunctionFitter(db)
+        fitter.update_fits(train.iloc[:15])
+        assert db.load_fit_stats() is not None
+        fitter.update_fits(train.iloc[15:30])
+        incremental = dict(fitter.update_fits(train.iloc[30:]))
+        with db.engine.connect() as conn:
+            assert conn.exec_driver_sql('SELECT COUNT(*) FROM fit_stats').scalar() == 4
+
+        full = FunctionFitter(db).select_best_ideals()
+        assert len(pd.read_sql('training', db.engine)) == 40
+        for col, info in full.items():
+            assert incremental[col]['col'] == info['col']
+            assert incremental[col]['ssd'] == pytest.approx(info['ssd'])
+            assert incremental[col]['max_dev'] == pytest.approx(info['max_dev'])
+
+        # Rows that fail validation are not appended and leave the statistics as they were
+        stats = db.load_fit_stats()
+        ideal.drop(columns='Y12').to_sql('ideal', db.engine, if_exists='replace', index=False)
+        db.refresh_ideal()
+        with pytest.raises(fitting.DataLoadError):
+            fitter.update_fits(pd.DataFrame({'X': [40.0], 'Y1': [0.0], 'Y2': [0.0], 'Y3': [0.0], 'Y4': [0.0]}))
+        assert len(pd.read_sql('training', db.engine)) == 40
+        np.testing.assert_array_equal(db.load_fit_stats()[2]['SSD'], stats[2]['SSD'])
+
+    def test_persisted_model_loads_without_refit(self, monkeypatch):
+        '''Test a new fitter maps from the stored model and detects stale inputs'''
+        db = DatabaseManager('sqlite:///:memory:')
+        x = np.arange(10.0)
+        pd.DataFrame({'X': x, 'Y1': x * 2 + 0.1, 'Y2': -x}).to_sql(
+            'training', db.engine, if_exists='replace', index=False)
+        pd.DataFrame({'X': x, 'Y1': -x, 'Y2': x * 2, 'Y3': x}).to_sql(
+            'ideal', db.engine, if_exists='replace', index=False)
+        fitted = dict(FunctionFitter(db).select_best_ideals())
+
+        stored = pd.read_sql('best_fits', db.engine)
+        assert stored['train_func'].tolist() == ['Y1', 'Y2']
+        assert stored['threshold'].tolist() == pytest.approx(stored['max_dev'] * np.sqrt(2))
+
+        fitter = FunctionFitter(db)
+        monkeypatch.setattr(fitting, 'fit_block', lambda *args, **kwargs: pytest.fail("refit"))
+        assert fitter.load_model(verify=True) == fitted
+        assert list(fitter.best_fits) == ['Y1', 'Y2']
+
+        pd.DataFrame({'X': x, 'Y1': x, 'Y2': x}).to_sql(
+            'training', db.engine, if_exists='replace', index=False)
+        with pytest.raises(fitting.DataLoadError):
+            FunctionFitter(db).load_model(verify=True)
+        with pytest.raises(fitting.DataLoadError):
+            FunctionFitter(DatabaseManager('sqlite:///:memory:')).load_model()
+    
+    @pytest.mark.parametrize('in_memory', [False, True])
+    def test_reloading_data_drops_the_model(self, tmp_path, in_memory):
+        '''Test fits made for the old training or ideal data are not kept after a reload'''
+        db = DatabaseManager(f"sqlite:///{tmp_path / 'reload.db'}", in_memory=in_memory)
+        train_file, ideal_file = tmp_path / 'train.csv', tmp_path / 'ideal.csv'
+        x = np.arange(10.0)
+        pd.DataFrame({'x': x, 'y1': x + 0.1}).to_csv(train_file, index=False)
+        pd.DataFrame({'x': x, 'y1': -x, 'y42': x}).to_csv(ideal_file, index=False)
+        for load, path in [(db.load_training, train_file), (db.load_ideal, ideal_file)]:
+            db.load_training(str(train_file))
+            db.load_ideal(str(ideal_file))
+            FunctionFitter(db).select_best_ideals()
+            assert FunctionFitter(db).load_model()['Y1']['col'] == 'Y42'
+
+            load(str(path))
+            db.flush()
+            with pytest.raises(fitting.DataLoadError):
+                FunctionFitter(db).load_model()
+            assert pd.read_sql('best_fits', db.engine).empty
+    
+    @pytest.mark.parametrize('workers', [1, 2])
+    def test_compact_mode_matches_float64(self, tmp_path, monkeypatch, workers):
+        '''Test float32 storage gives the float64 fits and mapping on the project data'''
+        data = os.path.join(os.path.dirname(__file__), '..', 'data')
+        full = DatabaseManager(f"sqlite:///{tmp_path / 'full.db'}")
+        full.load_training(os.path.join(data, 'train.csv'))
+        full.load_ideal(os.path.join(data, 'ideal.csv'))
+        expected = FunctionFitter(full)
+        expected.select_best_ideals(use_cache=False)
+
+        compact = DatabaseManager(f"sqlite:///{tmp_path / 'full.db'}", compact=True)
+        assert compact.ideal_table().values.dtype == np.float32
+        assert compact.ideal_table().column('X').dtype == np.float64
+        assert os.path.exists(tmp_path / 'full.ideal32.npy')
+
+        monkeypatch.setattr(fitting, 'BLOCK_CELLS', 400 * 7)  # several column blocks
+        fitter = FunctionFitter(compact)
+        fitter.select_best_ideals(workers=workers, use_cache=False)
+        assert {c: f['col'] for c, f in fitter.best_fits.items()} == \
+            {c: f['col'] for c, f in expected.best_fits.items()}
+        for col, info in fitter.best_fits.items():
+            assert info['ssd'] == pytest.approx(expected.best_fits[col]['ssd'], rel=1e-5)
+        assert fitter.compare_precision() == {}
+
+        test_df = pd.read_csv(os.path.join(data, 'test.csv'))
+        test_df.columns = test_df.columns.str.upper()
+        got = fitter.map_points(test_df, compact.ideal_table())
+        want = expected.map_points(test_df, full.ideal_table())
+        assert got['No. of ideal func'].fillna('-').tolist() == want['No. of ideal func'].fillna('-').tolist()
+    
+    def test_compare_precision_reports_rounding_flip(self):
+        '''Test the precision check reports a choice decided below float32 resolution'''
+        db = DatabaseManager('sqlite:///:memory:', compact=True)
+        x = np.arange(3.0)
+        pd.DataFrame({'X': x, 'Y1': np.ones(3)}).to_sql('training', db.engine, index=False,
+                                                       if_exists='replace')
+        pd.DataFrame({'X': x, 'Y1': np.full(3, 1 + 3e-8), 'Y2': np.full(3, 1 + 2e-8)}).to_sql(
+            'ideal', db.engine, index=False, if_exists='replace')
+        fitter = FunctionFitter(db)
+        fitter.select_best_ideals(use_cache=False)
+        assert fitter.compare_precision() == {'Y1': ('Y1', 'Y2')}
+    
+    def test_fit_cache_hits_and_evicts(self, monkeypatch):
+        '''Test unchanged inputs reuse the cached fit and old entries are evicted'''
+        db = DatabaseManager('sqlite:///:memory:')
+        train = pd.DataFrame({'X': [1.0, 2.0, 3.0], 'Y1': [1.0, 2.0, 3.1]})
+        ideal = pd.DataFrame({'X': [1.0, 2.0, 3.0], 'Y1': [1.0, 2.0, 3.0], 'Y2': [0.0, 0.0, 0.0]})
+        train.to_sql('training', db.engine, if_exists='replace', index=False)
+        ideal.to_sql('ideal', db.engine, if_exists='replace', index=False)
+
+        first = dict(FunctionFitter(db).select_best_ideals())
+
+        def fail(*args, **kwargs):
+            raise AssertionError('fit should have come from fit_cache')
+        monkeypatch.setattr(fitting, 'fit_block', fail)
+        assert FunctionFitter(db).select_best_ideals() == first
+
+        monkeypatch.undo()
+        for k in (2, 3):
+            FunctionFitter(db).select_best_ideals(k=k)
+        with db.engine.connect() as conn:
+            assert conn.exec_driver_sql('SELECT COUNT(*) FROM fit_cache').scalar() == 3
+        db.store_fit('other', {}, max_entries=2)
+        with db.engine.connect() as conn:
+            assert conn.exec_driver_sql('SELECT COUNT(*) FROM fit_cache').scalar() == 2
+
+        # Without the cache or a verifiable model the input hash is never computed
+        monkeypatch.setattr(FunctionFitter, '_input_hash', lambda *args: pytest.fail("hashed"))
+        assert FunctionFitter(db).select_best_ideals(use_cache=False, verifiable=False) == first
+        monkeypatch.undo()
+        with pytest.raises(fitting.DataLoadError):
+            FunctionFitter(db).load_model(verify=True)
+    
+    def test_unchanged_sources_skip_reload_and_rehash(self, tmp_path, monkeypatch):
+        '''Test a repeated run over unchanged files neither reloads, rehashes nor rewrites'''
+        db_url = f"sqlite:///{tmp_path / 'rerun.db'}"
+        train_file, ideal_file = str(tmp_path / 'train.csv'), str(tmp_path / 'ideal.csv')
+        pd.DataFrame({'x': [1.0, 2.0, 3.0], 'y1': [1.0, 2.0, 3.1]}).to_csv(train_file, index=False)
+        pd.DataFrame({'x': [1.0, 2.0, 3.0], 'y1': [1.0, 2.0, 3.0], 'y2': [0.0, 0.0, 0.0]}).to_csv(
+            ideal_file, index=False)
+        db = DatabaseManager(db_url)
+        assert not db.source_unchanged('training', train_file)
+        db.load_training(train_file)
+        db.load_ideal(ideal_file)
+        first = dict(FunctionFitter(db).select_best_ideals())
+
+        db = DatabaseManager(db_url)
+        assert db.source_unchanged('training', train_file)
+        assert db.source_unchanged('ideal', ideal_file)
+        for name in ('frame', 'ideal_table', 'save_model', 'save_rankings'):
+            monkeypatch.setattr(db, name, lambda *args, **kwargs: pytest.fail("touched the tables"))
+        assert FunctionFitter(db).select_best_ideals() == first
+        monkeypatch.undo()
+
+        # Writes to the table or the file both force a reload and a new hash
+        digest = db.training_digest()
+        with db.engine.begin() as conn:
+            conn.exec_driver_sql('UPDATE training SET Y1 = 0.0')
+        assert not db.source_unchanged('training', train_file)
+        assert db.training_digest() != digest
+        assert FunctionFitter(db).select_best_ideals()['Y1']['col'] == 'Y2'
+        os.utime(ideal_file, ns=(0, 0))
+        assert not db.source_unchanged('ideal', ideal_file)
+
     def test_map_test_data(self):
         '''Test mapping test data to ideal functions'''
         db = DatabaseManager('sqlite:///:memory:')
@@ -82,6 +587,220 @@ class TestFunctionFitter:
         finally:
             if os.path.exists('temp_test.csv'):
                 os.remove('temp_test.csv')
+    
+    def test_map_points_thresholds_and_missing_x(self):
+        '''Test mapping skips unknown X values and deviations above the threshold'''
+        fitter = FunctionFitter(DatabaseManager('sqlite:///:memory:'))
+        fitter.best_fits = {
+            'Y1': {'col': 'Y1', 'ssd': 0.0, 'max_dev': 1.0},
+            'Y2': {'col': 'Y2', 'ssd': 0.0, 'max_dev': 1.0},
+        }
+        ideal = pd.DataFrame({
+            'X': [3.0, 1.0, 2.0],
+            'Y1': [30.0, 10.0, 20.0],
+            'Y2': [31.0, 10.5, 20.0]
+        })
+        test = pd.DataFrame({
+            'X': [1.0, 2.0, 3.0, 9.0],
+            'Y': [10.4, 20.0, 35.0, 1.0]
+        })
+
+        results = fitter.map_points(test, IdealTable.from_frame(ideal))
+
+        assert list(results['No. of ideal func'].iloc[:2]) == ['Y2', 'Y1']
+        assert results['Delta Y'].iloc[0] == pytest.approx(0.1)
+        assert results['No. of ideal func'].iloc[2:].isna().all()
+        assert results['Delta Y'].iloc[2:].isna().all()
+    
+    def test_stream_test_data(self, tmp_path):
+        '''Test chunked mapping appends every chunk to test_results'''
+        db = DatabaseManager('sqlite:///:memory:')
+
+        ideal = pd.DataFrame({
+            'X': [1.0, 2.0, 3.0],
+            'Y1': [1.0, 2.0, 3.0]
+        })
+        ideal.to_sql('ideal', db.engine, if_exists='replace', index=False)
+
+        test_file = tmp_path / 'test.csv'
+        pd.DataFrame({
+            'x': [1.0, 2.0, 3.0, 1.0, 2.0],
+            'y': [1.0, 2.5, 3.0, 9.0, 2.0]
+        }).to_csv(test_file, index=False)
+
+        fitter = FunctionFitter(db)
+        fitter.best_fits = {'Y1': {'col': 'Y1', 'ssd': 0.0, 'max_dev': 0.1}}
+        messages = []
+        counts = fitter.stream_test_data(str(test_file), chunksize=2,
+                                         progress=messages.append)
+
+        stored = pd.read_sql('test_results', db.engine)
+        assert counts == {'total': 5, 'mapped': 3}
+        assert len(messages) == 3
+        assert len(stored) == 5
+        assert stored['No. of ideal func'].notna().sum() == 3
+
+        # A file with only a header leaves no results from the previous run behind
+        pd.DataFrame({'x': [], 'y': []}).to_csv(test_file, index=False)
+        assert fitter.stream_test_data(str(test_file), progress=None) == {'total': 0, 'mapped': 0}
+        assert pd.read_sql('test_results', db.engine).empty
+        assert db.mapping_summary()['Points'].sum() == 0
+    
+    @pytest.mark.parametrize('workers, compact', [(1, False), (2, False), (2, True)])
+    def test_map_files_tags_sources(self, tmp_path, workers, compact):
+        '''Test batch mapping matches per-file mapping and skips unreadable files'''
+        db = DatabaseManager(f"sqlite:///{tmp_path / 'batch.db'}", compact=compact)
+        x = np.arange(20.0)
+        pd.DataFrame({'X': x, 'Y1': x + 0.1}).to_sql('training', db.engine, if_exists='replace', index=False)
+        pd.DataFrame({'X': x, 'Y1': x, 'Y2': -x}).to_sql('ideal', db.engine, if_exists='replace', index=False)
+        fitter = FunctionFitter(db)
+        fitter.select_best_ideals()
+
+        rng = np.random.default_rng(0)
+        files = []
+        for i in range(5):
+            files.append(str(tmp_path / f'test{i}.csv'))
+            test_x = rng.integers(0, 25, 30).astype(float)
+            pd.DataFrame({'x': test_x, 'y': test_x + rng.uniform(-0.2, 0.2, 30)}).to_csv(
+                files[-1], index=False)
+        broken = str(tmp_path / 'broken.csv')
+        pd.DataFrame({'a': [1]}).to_csv(broken, index=False)
+
+        counts = fitter.map_files(files + [broken, str(tmp_path / 'missing.csv')],
+                                  workers=workers, batch_rows=40, progress=None)
+
+        stored = pd.read_sql('test_results', db.engine)
+        assert counts['files'] == 5 and counts['total'] == 150
+        assert sorted(counts['failed']) == [broken, str(tmp_path / 'missing.csv')]
+        assert sorted(stored['Source file'].unique()) == files
+        for test_file in files:
+            expected = fitter.map_file(test_file)
+            got = stored[stored['Source file'] == test_file].reset_index(drop=True)
+            pd.testing.assert_frame_equal(got.drop(columns='No. of ideal func'),
+                                          expected.drop(columns='No. of ideal func'))
+            assert got['No. of ideal func'].fillna('-').tolist() == \
+                expected['No. of ideal func'].fillna('-').tolist()
+        assert 0 < counts['mapped'] < 150
+        assert counts['mapped'] == stored['No. of ideal func'].notna().sum()
+        assert db.mapping_summary()['Points'].sum() == 150
+        # Workers share the catalog the parent uses instead of building their own
+        assert os.path.exists(tmp_path / 'batch.ideal32.npy') == compact
+        assert os.path.exists(tmp_path / 'batch.ideal.npy') != compact
+    
+    @pytest.mark.parametrize('workers', [1, 2])
+    def test_map_files_hand_checked(self, tmp_path, workers):
+        '''Test batch mapping assigns hand-checked points to the expected functions'''
+        db = DatabaseManager(f"sqlite:///{tmp_path / 'batch.db'}")
+        x = np.arange(10.0)
+        pd.DataFrame({'X': x, 'Y1': x, 'Y2': -x}).to_sql('ideal', db.engine, if_exists='replace', index=False)
+        fitter = FunctionFitter(db)
+        # Thresholds are 0.1 * sqrt(2) ~ 0.141 for both fits
+        fitter.best_fits = {'Y1': {'col': 'Y1', 'ssd': 0.0, 'sad': 0.0, 'max_dev': 0.1},
+                            'Y2': {'col': 'Y2', 'ssd': 0.0, 'sad': 0.0, 'max_dev': 0.1}}
+        first, second = str(tmp_path / 'first.csv'), str(tmp_path / 'second.csv')
+        # 1.1 is 0.1 off Y1; 2.5 is too far from both; X = 30 is not in the catalog
+        pd.DataFrame({'x': [1.0, 2.0, 30.0], 'y': [1.1, 2.5, 30.0]}).to_csv(first, index=False)
+        # -4.05 is 0.05 off Y2; 3.0 lies exactly on Y1
+        pd.DataFrame({'x': [4.0, 3.0], 'y': [-4.05, 3.0]}).to_csv(second, index=False)
+
+        counts = fitter.map_files([first, second], workers=workers, progress=None)
+        assert counts == {'files': 2, 'total': 5, 'mapped': 3, 'failed': {}}
+        stored = pd.read_sql('test_results', db.engine)
+        stored = stored.sort_values(['Source file', 'X'], ignore_index=True)
+        assert stored['Source file'].tolist() == [first] * 3 + [second] * 2
+        assert stored['No. of ideal func'].fillna('-').tolist() == ['Y1', '-', '-', 'Y1', 'Y2']
+        np.testing.assert_allclose(stored['Delta Y'], [0.1, np.nan, np.nan, 0.0, 0.05])
+    
+    def test_in_memory_pipeline_defers_sqlite(self, tmp_path, monkeypatch):
+        '''Test in-memory mode fits and maps without SQLite reads and persists on flush'''
+        data = os.path.join(os.path.dirname(__file__), '..', 'data')
+        reference = DatabaseManager(f"sqlite:///{tmp_path / 'reference.db'}")
+        reference.load_training(os.path.join(data, 'train.csv'))
+        reference.load_ideal(os.path.join(data, 'ideal.csv'))
+        reference_fitter = FunctionFitter(reference)
+        expected_fits = reference_fitter.select_best_ideals()
+        expected = reference_fitter.map_test_data(os.path.join(data, 'test.csv'))
+
+        db = DatabaseManager(f"sqlite:///{tmp_path / 'memory.db'}", in_memory=True)
+        monkeypatch.setattr(pd, 'read_sql', lambda *args, **kwargs: pytest.fail("read SQLite"))
+        db.load_training(os.path.join(data, 'train.csv'))
+        db.load_ideal(os.path.join(data, 'ideal.csv'))
+        fitter = FunctionFitter(db)
+        assert fitter.select_best_ideals() == expected_fits
+        results = fitter.map_test_data(os.path.join(data, 'test.csv'))
+        pd.testing.assert_frame_equal(results, expected)
+        assert db.frames['test_results'] is results
+        assert FunctionFitter(db).load_model() == expected_fits
+        monkeypatch.undo()
+
+        assert not os.path.exists(tmp_path / 'memory.ideal.npy')
+        assert pd.read_sql('best_fits', db.engine).empty
+        assert db.flush(background=True).result() > 0
+        assert db.flush() == 0
+        stored = pd.read_sql('test_results', db.engine)
+        assert len(stored) == 100 and stored['No. of ideal func'].notna().sum() == 48
+        assert pd.read_sql('best_fits', db.engine)['ideal_func'].tolist() == ['Y42', 'Y41', 'Y11', 'Y48']
+        assert db.mapping_summary()['Points'].sum() == 100
+        assert os.path.exists(tmp_path / 'memory.ideal.npy')
+
+        with pytest.raises(ValueError):
+            fitter.update_fits(pd.DataFrame({'X': [0.0], 'Y1': [0.0]}))
+        with pytest.raises(ValueError):
+            DatabaseManager('sqlite:///:memory:', 'long', in_memory=True)
+    
+    def test_long_layout_matches_wide_layout(self, tmp_path):
+        '''Test fitting and mapping give the same answers for both ideal layouts'''
+        ideal_file = tmp_path / 'ideal.csv'
+        train_file = tmp_path / 'train.csv'
+        test_file = tmp_path / 'test.csv'
+        pd.DataFrame({
+            'x': [1.0, 2.0, 3.0, 4.0],
+            'y1': [1.0, 2.0, 3.0, 4.0],
+            'y2': [2.0, 4.0, 6.0, 8.0],
+            'y3': [0.0, 0.0, 0.0, 0.0]
+        }).to_csv(ideal_file, index=False)
+        pd.DataFrame({
+            'x': [1.0, 2.0, 3.0, 4.0],
+            'y1': [2.1, 3.9, 6.2, 7.8],
+            'y2': [0.1, -0.1, 0.2, 0.0]
+        }).to_csv(train_file, index=False)
+        pd.DataFrame({'x': [1.0, 3.0, 4.0], 'y': [2.0, 0.1, 5.0]}).to_csv(test_file, index=False)
+
+        outcomes = []
+        for layout in ('wide', 'long'):
+            db = DatabaseManager('sqlite:///:memory:', ideal_layout=layout)
+            db.load_training(str(train_file))
+            db.load_ideal(str(ideal_file))
+            fitter = FunctionFitter(db)
+            outcomes.append((fitter.select_best_ideals(), fitter.map_test_data(str(test_file))))
+
+        (wide_fits, wide_results), (long_fits, long_results) = outcomes
+        assert wide_fits == long_fits
+        assert wide_fits['Y1']['col'] == 'Y2'
+        assert wide_fits['Y2']['col'] == 'Y3'
+        pd.testing.assert_frame_equal(wide_results, long_results)
+    
+    def test_long_layout_batches_share_one_pool(self, tmp_path, monkeypatch):
+        '''Test parallel long-layout batches reuse one process pool and match the serial fit'''
+        import parallel
+        db = DatabaseManager('sqlite:///:memory:', ideal_layout='long')
+        x = np.arange(6.0)
+        pd.DataFrame({'x': x, **{f'y{i}': x * i for i in range(1, 6)}}).to_csv(tmp_path / 'ideal.csv', index=False)
+        db.load_ideal(str(tmp_path / 'ideal.csv'))
+        train = np.column_stack([x * 3 - 0.1, x * 5 - 0.2])
+        started = []
+
+        class Pool(parallel.ProcessPoolExecutor):
+            def __init__(self, *args, **kwargs):
+                started.append(self)
+                super().__init__(*args, **kwargs)
+
+        monkeypatch.setattr(parallel, 'ProcessPoolExecutor', Pool)
+        fitter = FunctionFitter(db)
+        serial = fitter._best_from_long(pd.Series(x), train, batch=2, k=2)
+        assert fitter._best_from_long(pd.Series(x), train, workers=2, batch=2, k=2) == serial
+        assert len(started) == 1
+        assert [[serial[0][j] for j, _, _ in ranked] for ranked in serial[1]] == [['Y3', 'Y2'], ['Y5', 'Y4']]
 
 
 if __name__ == '__main__':
@@ -0,0 +1,45 @@
+import pytest
+import json
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import metrics
+
+
+class TestStageTimer:
+    '''Test StageTimer instrumentation'''
+
+    def test_nested_stages_and_rows(self, tmp_path):
+        '''Test nested stages record their path, depth and throughput'''
+        timer = metrics.StageTimer()
+        metrics.activate(timer)
+        try:
+            with metrics.stage('load'):
+                with metrics.stage('parse_csv') as timing:
+                    timing['rows'] = 10
+        finally:
+            metrics.activate(None)
+
+        rows = timer.rows()
+        assert [row['stage'] for row in rows] == ['load', 'load/parse_csv']
+        assert [row['depth'] for row in rows] == [0, 1]
+        assert rows[1]['rows'] == 10
+        assert rows[1]['rows_per_second'] > 0
+
+        timer.write(str(tmp_path / 'metrics.json'))
+        with open(tmp_path / 'metrics.json') as f:
+            assert len(json.load(f)['stages']) == 2
+        timer.write(str(tmp_path / 'metrics.csv'))
+        with open(tmp_path / 'metrics.csv') as f:
+            assert f.readline().startswith('stage,depth,seconds')
+
+    def test_stage_is_noop_without_timer(self):
+        '''Test stage() does nothing when instrumentation is off'''
+        with metrics.stage('anything') as timing:
+            timing['rows'] = 5
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
@@ -0,0 +1,52 @@
+import pytest
+import pandas as pd
+import numpy as np
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from numeric_csv import iter_frames, read_numeric
+
+DATA = os.path.join(os.path.dirname(__file__), '..', 'data')
+
+
+class TestNumericCsv:
+    '''Test the preallocated numeric CSV reader'''
+
+    @pytest.mark.parametrize('name', ['train.csv', 'ideal.csv', 'test.csv'])
+    def test_matches_pandas(self, name, tmp_path):
+        '''Test every chunking, worker and mmap variant gives pandas' values'''
+        path = os.path.join(DATA, name)
+        expected = pd.read_csv(path)
+        for kwargs in [{}, {'chunk_rows': 7}, {'workers': 3, 'chunk_rows': 11},
+                       {'mmap_path': str(tmp_path / 'out.npy')}]:
+            columns, values = read_numeric(path, **kwargs)
+            assert columns == list(expected.columns.str.upper())
+            assert values.dtype == np.float64 and values.flags['C_CONTIGUOUS']
+            assert np.array_equal(values, expected.to_numpy(), equal_nan=True)
+        assert np.array_equal(np.load(tmp_path / 'out.npy'), expected.to_numpy())
+
+        chunks = list(iter_frames(path, 30))
+        assert [len(chunk) for chunk in chunks][0] == min(30, len(expected))
+        assert np.array_equal(pd.concat(chunks).to_numpy(), expected.to_numpy())
+    
+    def test_blank_lines_missing_values_and_errors(self, tmp_path):
+        '''Test blank lines are dropped, empty fields become NaN and text is rejected'''
+        path = tmp_path / 'gaps.csv'
+        path.write_text('x,y\n1,2\n\n3,\n4,5')
+        for kwargs in [{}, {'workers': 3}, {'mmap_path': str(tmp_path / 'gaps.npy')}]:
+            columns, values = read_numeric(str(path), **kwargs)
+            assert columns == ['X', 'Y']
+            assert np.array_equal(values, [[1, 2], [3, np.nan], [4, 5]], equal_nan=True)
+        assert np.load(tmp_path / 'gaps.npy').shape == (3, 2)
+
+        path.write_text('x,y\n')
+        assert read_numeric(str(path))[1].shape == (0, 2)
+        path.write_text('x,y\n1,a\n')
+        with pytest.raises(ValueError):
+            read_numeric(str(path))
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
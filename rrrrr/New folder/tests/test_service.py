@@ -0,0 +1,139 @@
+import pytest
+import asyncio
+import json
+import pandas as pd
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from database import DatabaseManager
+from fitting import FunctionFitter
+from service import MappingService
+
+
+def write_data(tmp_path, ideal_y2):
+    train_file, ideal_file = tmp_path / 'train.csv', tmp_path / 'ideal.csv'
+    pd.DataFrame({'x': [1.0, 2.0, 3.0], 'y1': [1.0, 2.1, 2.9]}).to_csv(train_file, index=False)
+    pd.DataFrame({'x': [1.0, 2.0, 3.0], 'y1': [1.0, 2.0, 3.0],
+                  'y2': ideal_y2}).to_csv(ideal_file, index=False)
+    return str(train_file), str(ideal_file)
+
+
+class TestMappingService:
+    '''Test the resident mapping service'''
+
+    @pytest.mark.parametrize('layout', ['wide', 'long'])
+    def test_map_matches_fitter(self, tmp_path, layout):
+        '''Test service replies match map_points on the full ideal table'''
+        db = DatabaseManager(f"sqlite:///{tmp_path / 'svc.db'}", ideal_layout=layout)
+        train_file, ideal_file = write_data(tmp_path, [5.0, 6.0, 7.0])
+        db.load_training(train_file)
+        db.load_ideal(ideal_file)
+        service = MappingService(db)
+
+        points = [[1.0, 1.05], [2.0, 9.0], [4.0, 4.0], [3.0, 3.0]]
+        reply = json.loads(service.handle_line(json.dumps({'id': 7, 'points': points})))
+
+        test_df = pd.DataFrame(points, columns=['X', 'Y'])
+        expected = service.fitter.map_points(test_df, service.fitter._mapping_table(test_df))
+        assert reply['id'] == 7
+        assert reply['ideal'] == ['Y1', None, None, 'Y1']
+        assert reply['ideal'] == [name if pd.notna(name) else None
+                                  for name in expected['No. of ideal func']]
+        assert reply['delta'][0] == pytest.approx(0.05)
+    
+    def test_hot_reload_after_load_ideal(self, tmp_path):
+        '''Test a reloaded ideal table is picked up without restarting'''
+        db = DatabaseManager(f"sqlite:///{tmp_path / 'svc.db'}")
+        train_file, ideal_file = write_data(tmp_path, [5.0, 6.0, 7.0])
+        db.load_training(train_file)
+        db.load_ideal(ideal_file)
+        service = MappingService(db)
+        assert service.fitter.best_fits['Y1']['col'] == 'Y1'
+        assert not service.reload_if_changed()
+
+        # Another process replaces the ideal table; Y2 now fits the training data exactly
+        write_data(tmp_path, [1.0, 2.1, 2.9])
+        DatabaseManager(f"sqlite:///{tmp_path / 'svc.db'}").load_ideal(ideal_file)
+        assert service.reload_if_changed()
+        assert service.fitter.best_fits['Y1']['col'] == 'Y2'
+    
+    def test_starts_from_persisted_model(self, tmp_path, monkeypatch):
+        '''Test a new service adopts the stored fit model instead of refitting'''
+        db = DatabaseManager(f"sqlite:///{tmp_path / 'svc.db'}")
+        train_file, ideal_file = write_data(tmp_path, [5.0, 6.0, 7.0])
+        db.load_training(train_file)
+        db.load_ideal(ideal_file)
+        FunctionFitter(db).select_best_ideals()
+
+        monkeypatch.setattr(FunctionFitter, 'select_best_ideals',
+                            lambda *args, **kwargs: pytest.fail("refit"))
+        service = MappingService(DatabaseManager(f"sqlite:///{tmp_path / 'svc.db'}"))
+        assert service.fitter.best_fits['Y1']['col'] == 'Y1'
+        assert not service.reload_if_changed()
+    
+    def test_socket_clients_and_errors(self, tmp_path):
+        '''Test concurrent socket clients and malformed requests'''
+        db = DatabaseManager(f"sqlite:///{tmp_path / 'svc.db'}")
+        train_file, ideal_file = write_data(tmp_path, [5.0, 6.0, 7.0])
+        db.load_training(train_file)
+        db.load_ideal(ideal_file)
+        service = MappingService(db)
+        path = str(tmp_path / 'svc.sock')
+
+        async def client(lines):
+            reader, writer = await asyncio.open_unix_connection(path)
+            replies = []
+            for line in lines:
+                writer.write(line.encode() + b'\n')
+                await writer.drain()
+                replies.append(json.loads(await reader.readline()))
+            writer.close()
+            return replies
+
+        async def run():
+            server = await asyncio.start_unix_server(service.serve_client, path=path)
+            async with server:
+                return await asyncio.gather(
+                    client(['{"points": [[1.0, 1.0]]}', '{"cmd": "ping"}']),
+                    client(['not json', '{"cmd": "nope"}', '{"points": [[1.0]]}']))
+
+        first, second = asyncio.run(run())
+        assert first == [{'ideal': ['Y1'], 'delta': [0.0]}, {'ok': True}]
+        assert all('error' in reply for reply in second)
+    
+    def test_reload_errors_and_refit_off_loop(self, tmp_path, monkeypatch):
+        '''Test a failing reload is answered with an error and a refit runs on a worker thread'''
+        import threading
+        db = DatabaseManager(f"sqlite:///{tmp_path / 'svc.db'}")
+        train_file, ideal_file = write_data(tmp_path, [5.0, 6.0, 7.0])
+        db.load_training(train_file)
+        db.load_ideal(ideal_file)
+        service = MappingService(db)
+
+        threads = []
+        refit = FunctionFitter.select_best_ideals
+        def record(fitter, *args, **kwargs):
+            threads.append(threading.current_thread())
+            return refit(fitter, *args, **kwargs)
+        monkeypatch.setattr(FunctionFitter, 'select_best_ideals', record)
+        with db.engine.begin() as conn:
+            conn.exec_driver_sql('DELETE FROM best_fits')
+        reply = asyncio.run(service.handle_async({'cmd': 'reload', 'id': 1}))
+        assert reply == {'ok': True, 'id': 1}
+        assert threads and threads[0] is not threading.main_thread()
+        assert service.fitter.best_fits['Y1']['col'] == 'Y1'
+
+        with db.engine.begin() as conn:
+            conn.exec_driver_sql('DELETE FROM best_fits')
+            conn.exec_driver_sql('DROP TABLE ideal')
+        for answer in (service.handle, lambda r: asyncio.run(service.handle_async(r))):
+            reply = answer({'cmd': 'reload', 'id': 2})
+            assert reply['id'] == 2 and 'error' in reply
+        # The old table keeps serving
+        assert service.handle({'points': [[1.0, 1.0]]}) == {'ideal': ['Y1'], 'delta': [0.0]}
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
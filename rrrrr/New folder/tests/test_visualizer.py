@@ -0,0 +1,113 @@
+import pytest
+import pandas as pd
+import numpy as np
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from database import DatabaseManager
+from visualizer import Visualizer, density_grids, frame_density_grids, minmax_downsample, thin_scatter
+
+
+class TestDownsampling:
+    '''Test the large-data downsamplers'''
+
+    def test_minmax_keeps_envelope_within_budget(self):
+        '''Test min/max bucketing keeps the extremes and X order'''
+        x = np.linspace(0, 100, 100_000)
+        y = np.sin(x) + np.where(np.arange(len(x)) == 54_321, 10.0, 0.0)
+        y[7] = np.nan
+
+        dx, dy = minmax_downsample(x, y, 500)
+        assert len(dx) <= 500
+        assert np.all(np.diff(dx) > 0)
+        assert dy.max() == np.nanmax(y)
+        assert dy.min() == np.nanmin(y)
+
+        small_x, small_y = minmax_downsample(x[:10], y[:10], 500)
+        assert len(small_x) == 9  # only the NaN is dropped
+    
+    def test_thin_scatter_bounded_and_reproducible(self):
+        '''Test scatter thinning respects the budget and keeps duplicates out'''
+        rng = np.random.default_rng(1)
+        x, y = rng.normal(size=200_000), rng.normal(size=200_000)
+
+        tx, ty = thin_scatter(x, y, 1_000)
+        assert len(tx) == 1_000
+        assert np.array_equal(tx, thin_scatter(x, y, 1_000)[0])
+
+        # Many copies of a few points collapse to one per pixel cell
+        dx, dy = thin_scatter(np.repeat([0.0, 1.0], 5_000), np.repeat([0.0, 1.0], 5_000), 100)
+        assert sorted(zip(dx, dy)) == [(0.0, 0.0), (1.0, 1.0)]
+
+
+class TestVisualizer:
+    '''Test plot output'''
+
+    def test_plot_all_point_budget(self, tmp_path, monkeypatch):
+        '''Test the point budget bounds the HTML size and switches to WebGL'''
+        monkeypatch.chdir(tmp_path)
+        db = DatabaseManager(f"sqlite:///{tmp_path / 'viz.db'}")
+        x = np.linspace(-20, 20, 20_000)
+        pd.DataFrame({'X': x, **{f'Y{i}': np.sin(x * i) for i in range(1, 5)}}).to_sql(
+            'training', db.engine, if_exists='replace', index=False)
+        rng = np.random.default_rng(0)
+        pd.DataFrame({'X': rng.uniform(-20, 20, 50_000), 'Y': rng.normal(size=50_000),
+                      'Delta Y': np.nan,
+                      'No. of ideal func': np.where(rng.random(50_000) < 0.5, 'Y1', None)}).to_sql(
+            'test_results', db.engine, if_exists='replace', index=False)
+
+        Visualizer(db.engine).plot_all()
+        full = os.path.getsize('visualization.html')
+        Visualizer(db.engine).plot_all(max_points=2_000)
+        html = open('visualization.html').read()
+        assert len(html) < full / 10
+        assert 'webgl' in html
+    
+    def test_density_grids_and_image_output(self, tmp_path, monkeypatch):
+        '''Test density grids count every point and the HTML size tracks the grid'''
+        monkeypatch.chdir(tmp_path)
+        db = DatabaseManager(f"sqlite:///{tmp_path / 'viz.db'}")
+        pd.DataFrame({'X': [1.0, 2.0, 3.0], **{f'Y{i}': [1.0, 2.0, 3.0] for i in range(1, 5)}}).to_sql(
+            'training', db.engine, if_exists='replace', index=False)
+        rng = np.random.default_rng(0)
+        n = 200_000
+        is_mapped = rng.random(n) < 0.3
+        pd.DataFrame({'X': rng.uniform(-20, 20, n), 'Y': rng.normal(size=n), 'Delta Y': np.nan,
+                      'No. of ideal func': np.where(is_mapped, 'Y2', None)}).to_sql(
+            'test_results', db.engine, if_exists='replace', index=False)
+
+        mapped, unmapped, bounds = density_grids(db.engine, 50, chunksize=30_000)
+        assert mapped.shape == (50, 50)
+        assert mapped.sum() == is_mapped.sum()
+        assert unmapped.sum() == n - is_mapped.sum()
+        in_memory = frame_density_grids(pd.read_sql('test_results', db.engine), 50)
+        assert np.array_equal(in_memory[0], mapped) and np.array_equal(in_memory[1], unmapped)
+        assert in_memory[2] == pytest.approx(bounds)
+
+        Visualizer(db.engine).plot_all(density_bins=50)
+        assert os.path.getsize('visualization.html') < 200_000
+        assert 'Unmapped' in open('visualization.html').read()
+    
+    def test_density_grids_hand_checked(self, tmp_path):
+        '''Test grid cells and bounds against points placed by hand'''
+        db = DatabaseManager(f"sqlite:///{tmp_path / 'grid.db'}")
+        # With 2 bins the X edges are 0, 2, 4 and the Y edges 0, 1, 2; a point on an
+        # inner edge counts in the upper cell and the outer edges are inclusive
+        points = pd.DataFrame({'X': [0.0, 1.0, 3.0, 4.0, 2.0], 'Y': [0.0, 1.5, 0.5, 2.0, 1.0],
+                               'Delta Y': np.nan, 'No. of ideal func': ['Y1', None, 'Y2', 'Y1', None]})
+        points.to_sql('test_results', db.engine, if_exists='replace', index=False)
+
+        mapped, unmapped, bounds = density_grids(db.engine, 2, chunksize=2)
+        assert mapped.tolist() == [[1, 0], [1, 1]]
+        assert unmapped.tolist() == [[0, 1], [0, 1]]
+        assert bounds == (0.0, 4.0, 0.0, 2.0)
+        # A single point gets a unit-wide grid centred on it
+        mapped, unmapped, bounds = frame_density_grids(points.iloc[:1], 2)
+        assert bounds == (-0.5, 0.5, -0.5, 0.5)
+        assert mapped.tolist() == [[0, 0], [0, 1]]
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
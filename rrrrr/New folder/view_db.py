@@ -1,8 +1,15 @@
+import os
+import sys
 import pandas as pd
 import sqlite3
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'))
+from summary import ensure_summary
+
 # Connect to database
 conn = sqlite3.connect('assignment.db')
+# Databases mapped before mapping_summary existed get it built once
+ensure_summary(conn)
 
 print("="*70)
 print("DATABASE TABLES")
@@ -40,8 +47,9 @@ print(test_unmapped.to_string(index=False))
 print("\n" + "="*70)
 print("SUMMARY STATISTICS")
 print("="*70)
-total = pd.read_sql("SELECT COUNT(*) as count FROM test_results", conn)['count'][0]
-mapped = pd.read_sql("SELECT COUNT(*) as count FROM test_results WHERE [No. of ideal func] IS NOT NULL", conn)['count'][0]
+# mapping_summary is maintained as results are written; no scan of test_results needed
+total = pd.read_sql("SELECT SUM(Points) as count FROM mapping_summary", conn)['count'][0]
+mapped = pd.read_sql("SELECT SUM(Points) as count FROM mapping_summary WHERE [Ideal func] IS NOT NULL", conn)['count'][0]
 unmapped = total - mapped
 
 print(f"Total test points: {total}")
@@ -52,10 +60,9 @@ print("\n" + "="*70)
 print("MAPPING DISTRIBUTION BY IDEAL FUNCTION")
 print("="*70)
 distribution = pd.read_sql("""
-    SELECT [No. of ideal func], COUNT(*) as count 
-    FROM test_results 
-    WHERE [No. of ideal func] IS NOT NULL 
-    GROUP BY [No. of ideal func]
+    SELECT [Ideal func] as [No. of ideal func], [Train func], Points as count 
+    FROM mapping_summary 
+    WHERE [Ideal func] IS NOT NULL AND Points > 0 
     ORDER BY count DESC
 """, conn)
 print(distribution.to_string(index=False))